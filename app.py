@@ -1,28 +1,162 @@
+import argparse
+import base64
+import bisect
+import collections
+import contextlib
+import fcntl
+import gzip
 import hashlib
+import heapq
+import hmac
+import io
+import json
+import lzma
+import math
+import mmap
 import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import secrets
 import threading
 import time
 import uuid
+import zipfile
+import zlib
 from datetime import datetime
+from urllib.parse import quote, urlsplit
 
-import requests
-import streamlit as st
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, parse_if_range_header, parse_range_header, quote_etag
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Data, Epilogue, Field, File
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import FileWrapper
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # ================== 全局配置 ==================
 # 文件存储根目录
 UPLOAD_FOLDER = './cloud_disk/uploads'
-# 文件元数据
+# 按内容 sha256 去重存储的文件目录，两级分片：blobs/ab/cd/<sha256>
+BLOB_FOLDER = './cloud_disk/blobs'
+# 文件元数据（旧格式，启动时一次性迁移到 METADATA_LOG）
 METADATA_FILE = './cloud_disk/metadata.txt'
+# 文件元数据日志（追加写，启动时回放到内存索引）
+METADATA_LOG = './cloud_disk/metadata.log'
+# 元数据快照（压缩日志时写入，启动时先载入快照再回放日志尾部）
+METADATA_SNAPSHOT = './cloud_disk/metadata.snapshot'
+# 日志超过该大小且大于快照时由清理线程压缩
+METADATA_COMPACT_BYTES = 16 * 1024 * 1024
 # 单文件上传最大大小 50MB
 MAX_FILE_SIZE = 50 * 1024 * 1024
+# 上传请求体流式读取的块大小
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# 流式上传不知道文件大小时每次预留的配额，避免每个数据块都重新计算一次已用空间
+UPLOAD_RESERVE_SIZE = 4 * 1024 * 1024
+# 断点续传上传会话目录（需与 UPLOAD_FOLDER 在同一文件系统，提交时原子改名）
+UPLOAD_SESSION_FOLDER = './cloud_disk/sessions'
+# 断点续传默认分块大小及允许范围
+UPLOAD_SESSION_CHUNK_SIZE = 4 * 1024 * 1024
+MIN_UPLOAD_SESSION_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_SESSION_CHUNK_SIZE = 16 * 1024 * 1024
+# 上传会话无活动后保留时间 1天
+UPLOAD_SESSION_TTL = 86400
+# 上传表单普通字段（token/password/expire）的最大长度
+MAX_FORM_FIELD_SIZE = 4 * 1024
+# 秒传要求客户端证明持有内容：对随机选取的一段内容（最多该字节数）加随机数求哈希，挑战有效期（秒）
+UPLOAD_PROOF_SIZE = 64 * 1024
+UPLOAD_PROOF_TTL = 300
+# 秒传挑战的片段只从内容开头的该字节数内选取，校验压缩保存的内容时最多解压这么多
+UPLOAD_PROOF_MAX_OFFSET = 4 * 1024 * 1024
+# 批量上传/删除/打包下载一次最多的文件数
+MAX_BATCH_FILES = 200
 # 云文件存储最大存储大小 10G
 CLOUD_DISK_MAX_STORAGE_SIZE = 10 * 1024 * 1024 * 1024
+# 存储时透明压缩的编码：'gzip'、'zstd'（需安装 zstandard，未安装时使用 gzip）或 ''（不压缩）
+STORAGE_CODEC = 'gzip'
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# 按文件开头的样本判断是否值得压缩：样本大小、最小压缩文件大小，以及样本试压缩后的最大体积比例
+CODEC_SAMPLE_SIZE = 64 * 1024
+CODEC_MIN_SIZE = 4 * 1024
+CODEC_MAX_RATIO = 0.9
+# 存储与磁盘对账一轮的时长（秒）：后台线程每次只扫描一个分片目录，分片之间均匀休眠
+STORAGE_RECONCILE_INTERVAL = 3600
+# 冷存储层：超过 TIER_COLD_AFTER 秒没有被下载的文件（永久文件或剩余有效期超过 TIER_MIN_REMAINING 的），
+# 由后台线程高压缩比压缩后追加到 COLD_FOLDER 下的打包文件（可以放在另一块磁盘上），TIER_COLD_AFTER 为 0 时不分层
+COLD_FOLDER = './cloud_disk/cold'
+TIER_COLD_AFTER = 3 * 86400
+TIER_MIN_REMAINING = 86400
+# 冷存储压缩：'xz'（标准库 lzma）或 'zstd'（需安装 zstandard，未安装时使用 xz）；已压缩的格式原样打包
+COLD_CODEC = 'xz'
+COLD_XZ_PRESET = 6
+COLD_ZSTD_LEVEL = 19
+# 单个打包文件写到该大小后新建下一个；打包文件中已删除的内容超过该比例时重写回收空间
+COLD_PACK_SIZE = 256 * 1024 * 1024
+COLD_PACK_GARBAGE_RATIO = 0.5
+# 冷数据扫描间隔（秒）与每轮最多移入冷存储的文件数
+TIER_SCAN_INTERVAL = 3600
+TIER_MAX_MOVES = 1000
+# 下载时记录最后访问时间的最小间隔（秒），间隔内的重复下载不再写元数据
+TIER_TOUCH_INTERVAL = 3600
+# 冷存储中的文件被同一进程下载该次数后取回热存储，在此之前直接从打包文件边解压边发送
+TIER_REHYDRATE_REQUESTS = 2
+# 文件下载方式：'stream' Python 生成器逐块发送；'sendfile' 交给 WSGI 服务器的 file_wrapper
+# （gunicorn 下为 os.sendfile 零拷贝）；'x-accel' 返回 X-Accel-Redirect 由 Nginx 直接发送文件
+DOWNLOAD_BACKEND = 'sendfile'
+# 'stream'/'sendfile' 方式每次读取的块大小
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 热点文件缓存（每个进程各自缓存）：同一文件被下载 HOT_CACHE_MIN_REQUESTS 次后缓存，
+# 不超过 HOT_CACHE_MAX_FILE_SIZE 的文件读入内存（总量不超过 HOT_CACHE_BYTES，0 为关闭缓存），
+# 更大的文件保持 mmap 映射（最多 HOT_CACHE_MMAP_FILES 个，内容由页缓存提供，不占进程内存预算）
+HOT_CACHE_BYTES = 64 * 1024 * 1024
+HOT_CACHE_MAX_FILE_SIZE = 1024 * 1024
+HOT_CACHE_MMAP_FILES = 32
+HOT_CACHE_MIN_REQUESTS = 2
+# 尚未缓存、记录下载次数的文件数上限
+HOT_CACHE_TRACKED_FILES = 10000
+# 单个 Range 请求最多允许的区间数，超出时返回完整文件
+MAX_DOWNLOAD_RANGES = 16
+# X-Accel-Redirect 内部路径前缀，需在 Nginx 中配置为 internal 并 alias 到 NGINX_ACCEL_ROOT
+NGINX_ACCEL_PREFIX = '/c1yunpan/internal/'
+NGINX_ACCEL_ROOT = './cloud_disk'
+# 过期调度线程最长睡眠时间（秒），到点后同步其它进程写入的元数据
+EXPIRY_MAX_SLEEP = 60
+# 后台删除队列日志（崩溃重启后恢复未完成的删除）
+DELETE_QUEUE_FILE = './cloud_disk/delete_queue.log'
+# 后台删除队列上限，满时同步删除
+DELETE_QUEUE_MAX = 10000
+# 后台删除线程每批最多删除的文件数
+DELETE_BATCH_SIZE = 100
+# 删除失败的最大尝试次数与首次重试间隔（秒，指数退避）
+DELETE_MAX_RETRIES = 5
+DELETE_RETRY_DELAY = 5
+# 后台删除线程读入其它 worker 进程提交的任务的间隔（秒）
+DELETE_QUEUE_POLL_INTERVAL = 1
+# 文件列表每页最大数量
+LISTING_MAX_PER_PAGE = 200
+# 文件列表搜索结果缓存条数（元数据变化时整体失效）
+LISTING_CACHE_SIZE = 64
+# 密码尝试限流（令牌桶）：每个令牌/客户端 IP 最多连续失败次数，以及每秒恢复的次数
+GUESS_BURST = 10
+GUESS_RATE = 0.2
+# 限流器最多记录的令牌/IP 数，超出时淘汰最久未活动的
+GUESS_MAX_CLIENTS = 100000
 # 网盘文件目录查看密码
 LIST_PASSWORD_HASH = hashlib.sha256('salt_pass_imfun'.encode()).hexdigest()
 # flask应用启动端口
 FLASK_APP_PORT = 5001
+# python app.py api 以 gunicorn 运行 API 时的 worker 进程数与每个进程的线程数
+API_WORKERS = 4
+API_THREADS = 8
+# 后台任务选主锁文件：持有该锁的进程运行清理/过期/删除/对账任务，其余进程只处理请求
+BACKGROUND_LOCK_FILE = './cloud_disk/background.lock'
 # streamlit应用启动端口
 STREAMLIT_APP_PORT = 8501
 # 本地测试
@@ -34,273 +168,3921 @@ FLASK_BASE_PATH = "/c1yunpan/api"
 # flask云应用路径
 FLASK_CLOUD_PATH = f"{DOMAIN}{FLASK_BASE_PATH}"
 
-# 存储临时令牌 {token: expiry_time}
-TOKENS = {}
+# 浏览器访问 API 的地址，用于生成下载直链；留空时生成同源的相对链接（FLASK_BASE_PATH 开头，
+# 页面与 API 由同一个 Nginx 反向代理），API 在其它域名时配置为完整地址，如 https://api.example.com/c1yunpan/api
+DOWNLOAD_LINK_BASE = ''
+# 下载直链签名密钥文件（首次启动时生成）与有效期（秒）
+DOWNLOAD_LINK_KEY_FILE = './cloud_disk/download_link.key'
+DOWNLOAD_LINK_TTL = 600
+# Streamlit 页面调用 API 的超时（连接, 读取）秒数，以及连接失败时的重试次数
+UI_API_TIMEOUT = (3, 30)
+UI_API_RETRIES = 2
+# Streamlit 页面缓存网盘状态与文件列表的秒数（上传/删除后立即失效），以及最多缓存的查询组数
+UI_CACHE_TTL = 5
+UI_CACHE_SIZE = 8
+
+# /metrics 访问令牌（请求头 Authorization: Bearer <令牌>），为空时不校验
+METRICS_TOKEN = ''
+# 慢请求采样分析：处理耗时超过该秒数的请求，把调用栈采样写入 PROFILE_FOLDER（0 为关闭）
+PROFILE_SLOW_REQUEST_SECONDS = 0
+# 采样间隔（秒）
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_FOLDER = './cloud_disk/profiles'
+
+# 临时令牌存储：'memory' 仅限单进程；'sqlite:<路径>' 多个 worker 进程共享；
+# 'redis://host:port/db' 使用 Redis 协议服务（本地测试可用 redis_standin.py）
+TOKEN_BACKEND = 'sqlite:./cloud_disk/tokens.db'
+# 令牌有效期（秒）：请求时剩余有效期不足一半则续期到完整有效期（滑动过期），持续使用的页面不会中途失效
+TOKEN_TTL = 600
+# 最多同时有效的令牌数，超出时淘汰最早过期的（memory/sqlite 存储；redis 由键的 TTL 回收）
+TOKEN_MAX_ACTIVE = 10000
+
+
+# ================== 监控指标 ==================
+# 直方图分桶上限（秒）
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    """
+    进程内监控指标（计数器与直方图），按 Prometheus 文本格式输出。
+    每次记录只是一次加锁的字典更新，可在生产环境常开；多 worker 部署时每个进程各自统计。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # {(name, labels): value}
+        self.histograms = {}  # {(name, labels): [各桶计数..., +Inf 桶计数, 总和, 次数]}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(METRICS_BUCKETS) + 3)
+            histogram[bisect.bisect_left(METRICS_BUCKETS, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+    def render(self, gauges):
+        """输出全部指标，gauges 为当前取值的 [(名称, 值)]"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(value)) for key, value in self.histograms.items())
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for name, value in gauges:
+            declare(name, 'gauge')
+            lines.append(f"{name} {value}")
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(METRICS_BUCKETS + ('+Inf',), histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+class TimedLock:
+    """记录等待时间的锁"""
+
+    def __init__(self, name, lock=None):
+        self.name = name
+        self.lock = lock or threading.Lock()
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        metrics.observe('c1yunpan_lock_wait_seconds', time.perf_counter() - started, lock=self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class SlowRequestProfiler:
+    """
+    慢请求采样分析：后台线程每隔 interval 秒抓取处理中请求所在线程的调用栈，
+    请求耗时超过阈值时把采样按 folded 格式（flamegraph.pl、speedscope 可直接读取）写入目录。
+    """
+
+    def __init__(self, folder, threshold, interval):
+        self.folder = folder
+        self.threshold = threshold
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.samples = {}  # {thread_id: Counter(folded_stack)}
+
+    def begin(self):
+        with self.lock:
+            self.samples[threading.get_ident()] = collections.Counter()
+
+    def end(self, duration, label):
+        with self.lock:
+            stacks = self.samples.pop(threading.get_ident(), None)
+        if not stacks or duration < self.threshold:
+            return
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{label}"
+        path = os.path.join(self.folder, ''.join(c if c.isalnum() or c in '-_' else '_' for c in name) + '.folded')
+        os.makedirs(self.folder, exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in stacks.items():
+                f.write(f"{stack} {count}\n")
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None and len(names) < 128:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.samples:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self.samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[self._fold(frame)] += 1
+
+
+metrics = Metrics()
+
+
+# ================== 跨进程锁 ==================
+class ProcessLock:
+    """线程锁 + fcntl 文件锁，gunicorn 多个 worker 进程之间也互斥，同一线程可重入"""
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+        # fork 出的子进程（gunicorn worker）与父进程共享打开的文件描述，flock 在两边都算持有，
+        # 子进程里重新打开文件；父进程 fork 时可能有别的线程正持有锁，线程锁也一并重建
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        if self.depth == 0:
+            if self.fd is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            metrics.observe('c1yunpan_lock_wait_seconds', time.perf_counter() - started, lock=self.name)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+class LogTail:
+    """
+    按偏移增量读取只追加的日志文件（多个进程追加，压缩时原子替换为新文件），只返回完整的行。
+    一直持有打开的文件：只比较 inode 号时，旧文件删除后新文件可能恰好复用同一个 inode 号而被当成同一个文件；
+    持有期间旧文件的 inode 不会被释放，路径指向的 inode 号不同就说明日志被替换了。
+    读取用 pread，fork 出的子进程共享打开的文件也互不影响。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.inode = None
+        self.offset = 0  # 已读入的字节数
+
+    def read(self):
+        """返回 (是否换成了新文件, 新增的完整行)，换成新文件时从头读取；没有新内容时返回 None"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        replaced = stat.st_ino != self.inode
+        if not replaced and stat.st_size <= self.offset:
+            return None
+        if replaced and not self.reopen():
+            return None
+        data = os.pread(self.fd, os.fstat(self.fd).st_size - self.offset, self.offset)
+        # 只消费完整的行，写了一半的行留到下次
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        return replaced, data[:end].splitlines()
+
+    def reopen(self, offset=0):
+        """改为读取路径当前指向的文件（从 offset 开始），文件不存在时返回 False"""
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        self.close()
+        self.fd = fd
+        self.inode = os.fstat(fd).st_ino
+        self.offset = offset
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = self.inode = None
+        self.offset = 0
+
+
+# ================== 元数据存储 ==================
+def stored_size(entry):
+    """内容在磁盘上占用的字节数（压缩后的大小），用于配额计算"""
+    return entry.get('stored_size', entry['size'])
+
+
+def name_trigrams(text):
+    """文件名搜索用的三字符片段（不区分大小写）"""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class MetadataStore:
+    """
+    元数据存储引擎：快照 + 追加写日志 + 内存索引。
+    日志每行一条 JSON 记录（put/del），启动时先载入快照再回放日志，耗时与日志尾部长度相关；
+    其它进程/实例追加的记录在每次访问前按文件偏移增量读入；
+    写操作持有跨进程文件锁，先追上日志尾部再校验、追加，多个 worker 进程的读-改-写不会交错；
+    追加在锁内完成，fsync 在释放锁之后进行，并发的写入共享同一次 fsync（组提交）。
+    日志过大时压缩：全部元数据写成新快照后换成空日志，两步都是临时文件 fsync 后原子改名。
+    索引：文件名哈希索引、密码哈希索引、内容哈希引用索引、各排序字段的有序索引、文件名三元组搜索索引。
+    """
+
+    # 文件列表可排序字段 -> 排序键
+    SORT_KEYS = {
+        'upload_time': lambda entry: entry['upload_time'],
+        'size': lambda entry: entry['size'],
+        # 永久文件（expire_time 为 0）排在最后
+        'expire_time': lambda entry: entry['expire_time'] or float('inf'),
+        'name': lambda entry: entry['name'].lower()
+    }
+
+    def __init__(self, log_path, snapshot_path):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.lock = threading.RLock()
+        self.file_lock = ProcessLock(log_path + '.lock', 'metadata')
+        self.entries = {}  # {filename: entry}
+        self.by_password = {}  # {password_hash: filename}
+        self.by_sha256 = {}  # {sha256: {filename}}，同一内容的引用
+        self.legacy = set()  # 没有 sha256、仍在平铺上传目录中的旧文件
+        self.sorted_indexes = {field: [] for field in self.SORT_KEYS}  # {字段: [(排序键, filename)]}，升序
+        self.trigrams = {}  # {文件名小写的三字符片段: {filename}}
+        self.query_cache = collections.OrderedDict()  # {(search, sort): [(排序键, filename)]}
+        self._cache_version = None
+        self._version_offset = 0  # 最后一条 put/del 记录之后的日志偏移，只有 touch 记录时元数据版本不变
+        self.total_size = 0  # 随索引增量维护的已用空间（相同内容只计一次）
+        self.listeners = []  # 新增元数据回调（包括回放其它进程写入的记录）
+        self._log = LogTail(log_path)
+        self._bulk = False  # 大批量回放中，有序索引在回放结束后整体重建
+        self._sync_cond = threading.Condition()
+        self._written = 0  # 本进程追加日志的批次号
+        self._synced = 0  # 已 fsync 的批次号
+        self._syncing = False
+        self._local = threading.local()  # 当前线程在 group_commit 块内待落盘的批次号
+        # 快照与日志在第一次访问时载入，导入模块时不读文件也不加锁（只导入模块的进程不占用索引内存）
+
+    def _reset(self):
+        self.entries = {}
+        self.by_password = {}
+        self.by_sha256 = {}
+        self.legacy = set()
+        self.sorted_indexes = {field: [] for field in self.SORT_KEYS}
+        self.trigrams = {}
+        self.total_size = 0
+        self._version_offset = 0
+
+    def _index(self, entry):
+        name = entry['name']
+        self.entries[name] = entry
+        self.by_password[entry['password']] = name
+        if not self._bulk:
+            for field, key in self.SORT_KEYS.items():
+                bisect.insort(self.sorted_indexes[field], (key(entry), name))
+        for gram in name_trigrams(name):
+            self.trigrams.setdefault(gram, set()).add(name)
+        sha256 = entry.get('sha256')
+        if sha256 is None:
+            self.total_size += stored_size(entry)
+            self.legacy.add(name)
+        else:
+            refs = self.by_sha256.setdefault(sha256, set())
+            if not refs:
+                self.total_size += stored_size(entry)
+            refs.add(name)
+        for listener in self.listeners:
+            listener(entry)
+
+    def _unindex(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return None
+        if self.by_password.get(entry['password']) == name:
+            del self.by_password[entry['password']]
+        for field, key in self.SORT_KEYS.items():
+            if self._bulk:
+                break
+            index = self.sorted_indexes[field]
+            i = bisect.bisect_left(index, (key(entry), name))
+            if i < len(index) and index[i] == (key(entry), name):
+                del index[i]
+        for gram in name_trigrams(name):
+            names = self.trigrams[gram]
+            names.discard(name)
+            if not names:
+                del self.trigrams[gram]
+        sha256 = entry.get('sha256')
+        if sha256 is None:
+            self.total_size -= stored_size(entry)
+            self.legacy.discard(name)
+        else:
+            refs = self.by_sha256[sha256]
+            refs.discard(name)
+            if not refs:
+                del self.by_sha256[sha256]
+                self.total_size -= stored_size(entry)
+        return entry
+
+    def _apply(self, record):
+        if record['op'] == 'put':
+            self._unindex(record['entry']['name'])
+            self._index(record['entry'])
+        elif record['op'] == 'del':
+            self._unindex(record['name'])
+        elif record['op'] == 'touch':
+            # 最后访问时间不参与任何索引，直接更新
+            for name in record['names']:
+                entry = self.entries.get(name)
+                if entry is not None and entry.get('last_access', 0) < record['time']:
+                    entry['last_access'] = record['time']
+
+    def _repair_tail(self):
+        """截掉崩溃时写了一半的最后一行，否则之后追加的记录会接在它后面，两条一起损坏"""
+        with open(self.log_path, 'ab+') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != size:
+                print(f"元数据日志尾部不完整，已截掉 {size - end} 字节")
+                f.truncate(end)
+                os.fsync(f.fileno())
+
+    def _rebuild_sorted_indexes(self):
+        self.sorted_indexes = {
+            field: sorted((key(entry), name) for name, entry in self.entries.items())
+            for field, key in self.SORT_KEYS.items()
+        }
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        self._bulk = True
+        try:
+            for line in lines:
+                try:
+                    self._index(json.loads(line))
+                except (ValueError, KeyError):
+                    print(f"元数据快照记录损坏，已跳过: {line[:100]!r}")
+        finally:
+            self._bulk = False
+            self._rebuild_sorted_indexes()
+
+    def _refresh(self):
+        """增量回放日志尾部（包括本实例刚写入的记录）"""
+        started = time.perf_counter()
+        tail = self._log.read()
+        if tail is None:
+            return
+        replaced, lines = tail
+        if replaced:
+            # 首次加载或日志被压缩替换：载入快照后从头回放新日志。
+            # 快照总是先于新日志改名，载入的快照不会比日志旧；即使比日志新，put/del 重复回放结果也不变
+            self._reset()
+            self._load_snapshot()
+        # 启动或日志被替换时的大批量回放：逐条 insort 是 O(N²)，改为回放完后整体排序
+        self._bulk = len(lines) > max(1000, len(self.entries) // 10)
+        position = self._log.offset - sum(len(line) + 1 for line in lines)
+        try:
+            for line in lines:
+                position += len(line) + 1
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    self._apply(record)
+                    if record['op'] != 'touch':
+                        self._version_offset = position
+                except (ValueError, KeyError):
+                    print(f"元数据日志记录损坏，已跳过: {line[:100]!r}")
+        finally:
+            if self._bulk:
+                self._bulk = False
+                self._rebuild_sorted_indexes()
+        metrics.observe('c1yunpan_metadata_replay_seconds', time.perf_counter() - started)
+        metrics.inc('c1yunpan_metadata_replayed_records_total', len(lines))
+
+    def _append(self, records, durable=True):
+        """追加记录（在 group_commit 块内、持有文件锁时调用），落盘在块结束时统一等待；durable 为 False 时不等待落盘"""
+        data = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records).encode()
+        # O_APPEND 单次写入，多个写入方不会交错
+        fd = os.open(self.log_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # 持有文件锁时不会有别的写入方写到一半，日志不以换行结尾说明有进程写入时崩溃了
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                self._repair_tail()
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        if durable:
+            with self._sync_cond:
+                self._written += 1
+                self._local.ticket = self._written
+        metrics.inc('c1yunpan_metadata_commits_total')
+        self._refresh()
+
+    @contextlib.contextmanager
+    def group_commit(self):
+        """
+        块内的元数据写入只追加到日志，退出块时（调用方已释放自己的锁）再等待落盘，接口返回时记录已 fsync。
+        等待时已有 fsync 在进行则等它结束，否则由当前线程执行一次覆盖全部已写入批次的 fsync。
+        """
+        local = self._local
+        local.depth = getattr(local, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            local.depth -= 1
+            if not local.depth:
+                ticket, local.ticket = getattr(local, 'ticket', 0), 0
+                self._wait_synced(ticket)
+
+    def _wait_synced(self, ticket):
+        with self._sync_cond:
+            while self._synced < ticket:
+                if self._syncing:
+                    self._sync_cond.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                self._sync_cond.release()
+                try:
+                    started = time.perf_counter()
+                    # 日志若已被压缩替换，之前写入的记录已包含在 fsync 过的快照中
+                    fd = os.open(self.log_path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    metrics.observe('c1yunpan_metadata_fsync_seconds', time.perf_counter() - started)
+                    metrics.inc('c1yunpan_metadata_fsyncs_total')
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                    self._sync_cond.notify_all()
+                self._synced = max(self._synced, target)
+
+    def journal_size(self):
+        """日志中已回放的字节数（上次压缩以来的日志长度）"""
+        with self.lock:
+            self._refresh()
+            return self._log.offset
+
+    def compact(self, force=False):
+        """
+        日志超过 METADATA_COMPACT_BYTES 且大于快照时（force 为 True 时无条件）压缩：
+        全部元数据写入快照临时文件，fsync 后原子改名，再用空日志原子替换旧日志。
+        崩溃在两次改名之间时，旧日志回放到新快照上结果不变。返回是否进行了压缩。
+        """
+        with self.file_lock, self.lock:
+            self._refresh()
+            try:
+                snapshot_size = os.path.getsize(self.snapshot_path)
+            except FileNotFoundError:
+                snapshot_size = 0
+            if not force and (self._log.offset < METADATA_COMPACT_BYTES or self._log.offset <= snapshot_size):
+                return False
+            started = time.perf_counter()
+            for path, lines in ((self.snapshot_path, self.entries.values()), (self.log_path, ())):
+                temp_path = path + '.tmp'
+                with open(temp_path, 'w') as f:
+                    for entry in lines:
+                        f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, path)
+            fd = os.open(os.path.dirname(os.path.abspath(self.log_path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            # 内存索引已与快照一致，直接切换到新日志
+            self._log.reopen()
+            self._version_offset = 0
+            metrics.observe('c1yunpan_metadata_compaction_seconds', time.perf_counter() - started)
+            return True
+
+    def get(self, filename):
+        with self.lock:
+            self._refresh()
+            return self.entries.get(filename)
+
+    def find_by_password(self, password_hash):
+        with self.lock:
+            self._refresh()
+            name = self.by_password.get(password_hash)
+            return self.entries.get(name) if name else None
+
+    def add(self, entry):
+        """新增元数据，密码已被占用时返回 False"""
+        return self.add_all([entry])
+
+    def add_all(self, entries):
+        """批量新增元数据，一次追加、一次落盘；任一密码已被占用或批内重复时全部不写入，返回 False"""
+        with self.group_commit(), self.file_lock, self.lock:
+            self._refresh()
+            passwords = {entry['password'] for entry in entries}
+            if len(passwords) < len(entries) or not passwords.isdisjoint(self.by_password):
+                return False
+            self._append([{'op': 'put', 'entry': e} for e in entries])
+            return True
+
+    def find_by_sha256(self, sha256):
+        """返回任意一个引用该内容的元数据"""
+        with self.lock:
+            self._refresh()
+            names = self.by_sha256.get(sha256)
+            return self.entries[next(iter(names))] if names else None
+
+    def refcount(self, sha256):
+        with self.lock:
+            self._refresh()
+            return len(self.by_sha256.get(sha256, ()))
+
+    def add_many(self, entries):
+        with self.group_commit(), self.file_lock, self.lock:
+            self._append([{'op': 'put', 'entry': e} for e in entries])
+
+    def update(self, entry):
+        """覆盖已有的同名元数据（密码不变，用于补充字段），元数据不存在或密码不一致时返回 False"""
+        with self.group_commit(), self.file_lock, self.lock:
+            self._refresh()
+            current = self.entries.get(entry['name'])
+            if current is None or current['password'] != entry['password']:
+                return False
+            self._append([{'op': 'put', 'entry': entry}])
+            return True
+
+    def touch(self, filenames, access_time):
+        """记录最后访问时间（冷热分层的依据）；不等待落盘，崩溃时丢失的只是访问时间"""
+        with self.file_lock, self.lock:
+            self._refresh()
+            names = [name for name in filenames if name in self.entries]
+            if names:
+                self._append([{'op': 'touch', 'names': names, 'time': access_time}], durable=False)
+
+    def sha256s(self):
+        """所有被引用的内容哈希"""
+        with self.lock:
+            self._refresh()
+            return list(self.by_sha256)
+
+    def legacy_names(self):
+        """仍在平铺上传目录中、没有 sha256 的旧文件名"""
+        with self.lock:
+            self._refresh()
+            return list(self.legacy)
+
+    def remove(self, filename):
+        removed = self.remove_many([filename])
+        return removed[0] if removed else None
+
+    def remove_many(self, filenames):
+        """批量删除元数据，一次追加、一次落盘，返回被删除的元数据"""
+        with self.group_commit(), self.file_lock, self.lock:
+            self._refresh()
+            removed = [self.entries[name] for name in dict.fromkeys(filenames) if name in self.entries]
+            if removed:
+                self._append([{'op': 'del', 'name': entry['name']} for entry in removed])
+            return removed
+
+    def version(self):
+        """
+        元数据版本（日志文件 inode 与最后一条 put/del 记录之后的偏移），各 worker 进程读到相同内容时版本相同；
+        touch 只更新最后访问时间，不改变版本，下载不会让列表的 ETag 与查询缓存失效
+        """
+        with self.lock:
+            self._refresh()
+            return f"{self._log.inode or 0:x}-{self._version_offset:x}"
+
+    def _search(self, search, sort):
+        """文件名包含 search 的有序索引 [(排序键, filename)]，结果按元数据版本缓存"""
+        if self._cache_version != (self._log.inode, self._version_offset):
+            self.query_cache.clear()
+            self._cache_version = (self._log.inode, self._version_offset)
+        cache_key = (search, sort)
+        result = self.query_cache.get(cache_key)
+        if result is not None:
+            self.query_cache.move_to_end(cache_key)
+            return result
+
+        grams = name_trigrams(search)
+        if grams:
+            # 先取各三元组倒排集合的交集，再逐个确认子串（三元组都命中不代表连续出现）
+            postings = sorted((self.trigrams.get(gram, ()) for gram in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            # 少于 3 个字符无法用三元组索引，退化为全量扫描，结果同样缓存
+            candidates = self.entries
+        key = self.SORT_KEYS[sort]
+        result = sorted((key(self.entries[name]), name) for name in candidates if search in name.lower())
+
+        self.query_cache[cache_key] = result
+        if len(self.query_cache) > LISTING_CACHE_SIZE:
+            self.query_cache.popitem(last=False)
+        return result
+
+    def query(self, search='', sort='upload_time', descending=True, start=0, limit=None, after=None):
+        """
+        分页查询，返回 (匹配总数, 当前页元数据, 当前页最后一条的排序位置)。
+        after 为上一页返回的排序位置 (排序键, 文件名) 时按游标翻页，忽略 start；
+        没有搜索词时直接在有序索引上定位，开销只与每页数量有关。
+        """
+        started = time.perf_counter()
+        with self.lock:
+            self._refresh()
+            index = self._search(search.lower(), sort) if search else self.sorted_indexes[sort]
+            total = len(index)
+            if after is not None:
+                after = tuple(after)
+                start = total - bisect.bisect_left(index, after) if descending else bisect.bisect_right(index, after)
+            end = total if limit is None else min(start + limit, total)
+            if descending:
+                page = [index[total - 1 - i] for i in range(start, end)]
+            else:
+                page = index[start:end]
+            result = total, [self.entries[name] for _, name in page], page[-1] if page else None
+        metrics.observe('c1yunpan_metadata_query_seconds', time.perf_counter() - started,
+                        search='yes' if search else 'no')
+        return result
+
+    def all(self):
+        with self.lock:
+            self._refresh()
+            return list(self.entries.values())
+
+    def usage(self):
+        """返回 (已用空间, 文件数)，O(1)"""
+        with self.lock:
+            self._refresh()
+            return self.total_size, len(self.entries)
+
+    def recount(self):
+        """全量重算已用空间，修正增量计数器的偏差，返回 (已用空间, 文件数, 磁盘上应有的文件数)"""
+        with self.lock:
+            self._refresh()
+            stored = {}
+            for entry in self.entries.values():
+                stored[entry.get('sha256') or ('', entry['name'])] = stored_size(entry)
+            total_size = sum(stored.values())
+            if total_size != self.total_size:
+                print(f"已用空间计数偏差已修正: {self.total_size} -> {total_size}")
+                self.total_size = total_size
+            return self.total_size, len(self.entries), len(stored)
+
+
+def migrate_legacy_metadata(store, txt_path=METADATA_FILE):
+    """
+    一次性把旧的 metadata.txt（filename:password:upload_time:size:expire_time）迁移到元数据日志。
+    先改名占位，保证多个进程同时启动时只迁移一次；迁移完成后保留为 .migrated 备份。
+    """
+    migrating_path = txt_path + '.migrating'
+    try:
+        os.rename(txt_path, migrating_path)
+    except FileNotFoundError:
+        # 上次迁移中途退出时继续（put 记录可重复回放）
+        if not os.path.exists(migrating_path):
+            return 0
+
+    entries = []
+    with open(migrating_path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            parts = line.strip().split(':')
+            entries.append({
+                "name": parts[0],
+                "password": parts[1],
+                "upload_time": float(parts[2]),
+                "size": int(parts[3]),
+                "expire_time": float(parts[4])
+            })
+    if entries:
+        store.add_many(entries)
+    os.replace(migrating_path, txt_path + '.migrated')
+    return len(entries)
+
+
+metadata_store = MetadataStore(METADATA_LOG, METADATA_SNAPSHOT)
+
+# ================== 令牌存储 ==================
+class MemoryTokenStore:
+    """
+    进程内字典 + 按过期时间排列的最小堆，只适用于单进程部署。
+    过期令牌在访问时删除，写入时从堆顶弹出已过期的令牌（均摊 O(log n)），不再整体重建字典；
+    续期在堆中留下的旧记录惰性失效，失效记录过多时重建堆。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}  # {token: expiry_time}
+        self.heap = []  # [(expiry_time, token)]
+
+    def _pop_expired(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            self._pop()
+
+    def _pop(self):
+        expiry_time, token = heapq.heappop(self.heap)
+        if self.tokens.get(token) == expiry_time:
+            del self.tokens[token]
+
+    def get(self, token):
+        """返回令牌过期时间，不存在时返回 0"""
+        with self.lock:
+            expiry_time = self.tokens.get(token, 0)
+            if expiry_time and expiry_time <= time.time():
+                del self.tokens[token]
+                return 0
+            return expiry_time
+
+    def set(self, token, expiry_time):
+        with self.lock:
+            self._pop_expired(time.time())
+            # 超出上限时淘汰最早过期的令牌，脚本大量申请令牌也不会无限占用内存
+            while token not in self.tokens and len(self.tokens) >= TOKEN_MAX_ACTIVE:
+                self._pop()
+            self.tokens[token] = expiry_time
+            heapq.heappush(self.heap, (expiry_time, token))
+            if len(self.heap) > 2 * len(self.tokens) + 64:
+                self.heap = [(v, k) for k, v in self.tokens.items()]
+                heapq.heapify(self.heap)
+
+    def purge(self, now):
+        with self.lock:
+            self._pop_expired(now)
+
+    def count(self, now):
+        with self.lock:
+            self._pop_expired(now)
+            return len(self.tokens)
+
+
+class SQLiteTokenStore:
+    """SQLite 文件（WAL 模式），同一台机器上的多个 worker 进程共享令牌"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()  # sqlite3 连接不能跨线程使用，每个线程一个连接
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # 数据库文件与表在第一次使用时创建
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS tokens (token TEXT PRIMARY KEY, expiry_time REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tokens_expiry_time ON tokens (expiry_time)')
+            self.local.conn = conn
+        return conn
+
+    def get(self, token):
+        row = self._conn().execute('SELECT expiry_time FROM tokens WHERE token = ?', (token,)).fetchone()
+        return row[0] if row else 0
+
+    def set(self, token, expiry_time):
+        conn = self._conn()
+        # 续期只按主键更新过期时间
+        if conn.execute('UPDATE tokens SET expiry_time = ? WHERE token = ?', (expiry_time, token)).rowcount:
+            return
+        conn.execute('INSERT OR REPLACE INTO tokens (token, expiry_time) VALUES (?, ?)', (token, expiry_time))
+        # 新令牌：按过期时间索引删除已过期的令牌，仍超出上限时才淘汰最早过期的
+        now = time.time()
+        self.purge(now)
+        excess = self.count(now) - TOKEN_MAX_ACTIVE
+        if excess > 0:
+            conn.execute('DELETE FROM tokens WHERE token IN '
+                         '(SELECT token FROM tokens ORDER BY expiry_time LIMIT ?)', (excess,))
+
+    def purge(self, now):
+        self._conn().execute('DELETE FROM tokens WHERE expiry_time <= ?', (now,))
+
+    def count(self, now):
+        return self._conn().execute('SELECT COUNT(*) FROM tokens WHERE expiry_time > ?', (now,)).fetchone()[0]
+
+
+class RedisTokenStore:
+    """Redis 协议（RESP）的最小客户端，多台机器共享令牌；过期由服务端 TTL 处理"""
+
+    KEY_PREFIX = 'c1yunpan:token:'
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.address = (parts.hostname or '127.0.0.1', parts.port or 6379)
+        self.db = int(parts.path.strip('/') or 0)
+        self.password = parts.password
+        self.local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        self.local.sock = sock
+        self.local.reader = sock.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _read_reply(self):
+        reader = self.local.reader
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Redis 连接已断开')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RuntimeError(f"Redis 错误: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2].decode()
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"无法解析的 Redis 响应: {line[:50]!r}")
+
+    def _send(self, *args):
+        data = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            arg = str(arg).encode()
+            data.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.local.sock.sendall(b''.join(data))
+        return self._read_reply()
+
+    def _command(self, *args):
+        # 连接断开（服务重启等）时重连一次
+        for attempt in range(2):
+            if getattr(self.local, 'sock', None) is None:
+                self._connect()
+            try:
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                self.local.sock.close()
+                self.local.sock = None
+                if attempt:
+                    raise
+
+    def get(self, token):
+        value = self._command('GET', self.KEY_PREFIX + token)
+        return float(value) if value else 0
+
+    def set(self, token, expiry_time):
+        ttl_ms = max(1, int((expiry_time - time.time()) * 1000))
+        self._command('SET', self.KEY_PREFIX + token, repr(expiry_time), 'PX', ttl_ms)
+
+    def purge(self, now):
+        # 过期键由 Redis 自行删除
+        pass
+
+    def count(self, now):
+        # SCAN 分批遍历，不阻塞 Redis
+        cursor, total = '0', 0
+        while True:
+            cursor, keys = self._command('SCAN', cursor, 'MATCH', self.KEY_PREFIX + '*', 'COUNT', 1000)
+            total += len(keys)
+            if cursor == '0':
+                return total
+
+
+def create_token_store(backend):
+    """根据 TOKEN_BACKEND 创建令牌存储"""
+    if backend == 'memory':
+        return MemoryTokenStore()
+    if backend.startswith('sqlite:'):
+        return SQLiteTokenStore(backend[len('sqlite:'):])
+    if backend.startswith('redis://'):
+        return RedisTokenStore(backend)
+    raise ValueError(f"不支持的令牌存储: {backend}")
+
+
+token_store = create_token_store(TOKEN_BACKEND)
+
+
+class TokenAuth:
+    """
+    令牌校验层（由 before_request 统一调用）：签发、校验与滑动续期。
+    剩余有效期不足一半时才续期，同一令牌每半个有效期最多写一次存储；
+    每个令牌的请求数在本进程内计数（最多记录 TOKEN_MAX_ACTIVE 个，淘汰最久未使用的）。
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.requests = collections.OrderedDict()  # {token: 请求数}，按最近使用排序
+
+    def issue(self):
+        token = hashlib.sha256(str(uuid.uuid4()).encode()).hexdigest()
+        self.store.set(token, time.time() + TOKEN_TTL)
+        metrics.inc('c1yunpan_tokens_issued_total')
+        return token
+
+    def validate(self, token):
+        """令牌有效时计一次请求并按需续期，返回是否有效"""
+        if not token or not isinstance(token, str):
+            return False
+        now = time.time()
+        expiry_time = self.store.get(token)
+        if expiry_time <= now:
+            return False
+        if expiry_time - now < TOKEN_TTL / 2:
+            self.store.set(token, now + TOKEN_TTL)
+            metrics.inc('c1yunpan_token_renewals_total')
+        with self.lock:
+            self.requests[token] = self.requests.pop(token, 0) + 1
+            while len(self.requests) > TOKEN_MAX_ACTIVE:
+                self.requests.popitem(last=False)
+        return True
+
+    def info(self, token):
+        with self.lock:
+            requests_count = self.requests.get(token, 0)
+        return {"expires_at": self.store.get(token), "requests": requests_count}
+
+
+token_auth = TokenAuth(token_store)
+
+
+# ================== 访问限流 ==================
+class RateLimiter:
+    """
+    令牌桶限流：每个键最多积累 burst 次，每秒恢复 rate 次。
+    只在内存中计数，不产生任何 I/O；多 worker 部署时每个进程各自计数。
+    """
+
+    def __init__(self, burst, rate, max_keys):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets = collections.OrderedDict()  # {key: (剩余次数, 更新时间)}，按最近活动排序
+
+    def _level(self, key, now):
+        level, updated = self.buckets.get(key, (self.burst, now))
+        return min(self.burst, level + (now - updated) * self.rate)
+
+    def retry_after(self, keys):
+        """距离允许下一次尝试的秒数，0 表示允许"""
+        now = time.monotonic()
+        with self.lock:
+            wait = 0
+            for key in keys:
+                level = self._level(key, now)
+                if level < 1:
+                    wait = max(wait, (1 - level) / self.rate)
+            return wait
+
+    def consume(self, keys):
+        """记一次失败尝试；并发请求可能让余量短暂为负，恢复时间随之延长"""
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                self.buckets[key] = (self._level(key, now) - 1, now)
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+
+
+def password_matches(expected, received):
+    """常量时间比较密码哈希，避免按响应时间逐字符猜测"""
+    return isinstance(received, str) and hmac.compare_digest(expected.encode(), received.encode())
+
+
+guess_limiter = RateLimiter(GUESS_BURST, GUESS_RATE, GUESS_MAX_CLIENTS)
+
+
+# ================== Flask API部分 ==================
+flask_app = Flask(__name__)
+slow_request_profiler = SlowRequestProfiler(
+    PROFILE_FOLDER, PROFILE_SLOW_REQUEST_SECONDS, PROFILE_SAMPLE_INTERVAL
+) if PROFILE_SLOW_REQUEST_SECONDS > 0 else None
+
+
+@flask_app.before_request
+def begin_request_metrics():
+    g.request_started = time.perf_counter()
+    if slow_request_profiler:
+        slow_request_profiler.begin()
+
+
+def token_required(view):
+    """标记需要令牌的接口，由 authenticate 在进入视图前统一校验"""
+    view.token_required = True
+    return view
+
+
+def request_token():
+    """令牌在查询参数或 JSON 请求体中（multipart 上传的令牌在表单字段里，由上传接口校验）"""
+    token = request.args.get('token')
+    if not token and request.is_json:
+        data = request.get_json(silent=True)
+        token = data.get('token') if isinstance(data, dict) else None
+    return token
+
+
+@flask_app.before_request
+def authenticate():
+    if not getattr(flask_app.view_functions.get(request.endpoint), 'token_required', False):
+        return None
+    token = request_token()
+    if not token_auth.validate(token):
+        return jsonify({"error": "重新进入云盘列表"}), 401
+    g.token = token
+    return None
+
+
+@flask_app.after_request
+def record_request_metrics(response):
+    """按路由模板统计请求数与处理耗时（流式响应只计到返回响应头为止）"""
+    duration = time.perf_counter() - g.get('request_started', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('c1yunpan_http_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics.observe('c1yunpan_http_request_duration_seconds', duration, route=route, method=request.method)
+    if slow_request_profiler:
+        slow_request_profiler.end(duration, f"{request.method} {route}")
+    return response
+
+
+class StorageManager:
+    """
+    存储配额管理：已用空间与文件数由元数据索引增量维护，
+    上传过程中的文件先预留配额，元数据提交后再释放预留。
+    """
+
+    def __init__(self):
+        self.lock = TimedLock('storage')
+        self.reserved = 0  # 上传中的文件预留的空间
+
+    def get_storage_usage(self):
+        # 冷存储中的内容按打包后的字节计算
+        return metadata_store.usage()[0] - cold_tier.saved_bytes()
+
+    def get_file_count(self):
+        return metadata_store.usage()[1]
+
+    def check_storage(self, file_size):
+        with self.lock:
+            current_usage = self.get_storage_usage() + self.reserved
+            return (current_usage + file_size) <= CLOUD_DISK_MAX_STORAGE_SIZE
+
+    def reserve(self, file_size):
+        """预留配额，成功返回 True，之后必须调用 release"""
+        with self.lock:
+            current_usage = self.get_storage_usage() + self.reserved
+            if current_usage + file_size > CLOUD_DISK_MAX_STORAGE_SIZE:
+                return False
+            self.reserved += file_size
+            return True
+
+    def release(self, file_size):
+        with self.lock:
+            self.reserved -= file_size
+
+
+# 存储编码 -> blob 文件后缀
+BLOB_SUFFIXES = {'': '', 'gzip': '.gz', 'zstd': '.zst'}
+# 常见已压缩格式的文件头（zip/docx/apk、gzip、zstd、bzip2、xz、7z、rar、png、jpeg、gif、webp/avi、ogg、flac、mp3、mkv/webm）
+COMPRESSED_MAGIC = (b'PK\x03\x04', b'\x1f\x8b', b'(\xb5/\xfd', b'BZh', b'\xfd7zXZ', b'7z\xbc\xaf', b'Rar!',
+                    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF', b'OggS', b'fLaC', b'ID3', b'\x1aE\xdf\xa3')
+
+
+def choose_storage_encoding(sample):
+    """按文件头和开头样本的试压缩比例判断是否值得压缩，返回存储编码（'' 为原样保存）"""
+    if not STORAGE_CODEC or len(sample) < CODEC_MIN_SIZE:
+        return ''
+    # 已压缩的格式（mp4/mov 的 ftyp 在第 4 字节）再压缩只会浪费 CPU
+    if sample.startswith(COMPRESSED_MAGIC) or sample[4:8] == b'ftyp':
+        return ''
+    # 用 zlib 最快档压缩样本估计信息熵
+    sample = sample[:CODEC_SAMPLE_SIZE]
+    if len(zlib.compress(sample, 1)) > len(sample) * CODEC_MAX_RATIO:
+        return ''
+    if STORAGE_CODEC == 'zstd' and zstandard is None:
+        return 'gzip'
+    return STORAGE_CODEC
+
+
+def new_compressor(encoding):
+    if encoding == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return None
+
+
+def open_decoded(filepath, encoding):
+    """打开压缩保存的文件（路径或文件对象），返回读出原始内容的只读文件对象（支持向后 seek）"""
+    if encoding == 'gzip':
+        return gzip.open(filepath, 'rb')
+    source = open(filepath, 'rb') if isinstance(filepath, str) else filepath
+    return zstandard.ZstdDecompressor().stream_reader(source, closefd=True)
+
+
+class BlobEncoder:
+    """
+    边写边压缩：先缓存开头 CODEC_SAMPLE_SIZE 字节判断一次是否值得压缩，
+    之后的数据按判断结果压缩或原样写入 file。encoding 为 None 表示还未判断。
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.pending = bytearray()
+        self.encoding = None
+        self.compressor = None
+
+    def write(self, data):
+        if self.encoding is not None:
+            self._emit(data)
+            return
+        self.pending += data
+        if len(self.pending) >= CODEC_SAMPLE_SIZE:
+            self._decide()
+
+    def finish(self):
+        """写出剩余数据，返回存储编码"""
+        if self.encoding is None:
+            self._decide()
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+        return self.encoding
+
+    def _decide(self):
+        pending, self.pending = bytes(self.pending), None
+        self.encoding = choose_storage_encoding(pending)
+        self.compressor = new_compressor(self.encoding)
+        self._emit(pending)
+
+    def _emit(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.file.write(data)
+
+
+class BlobStore:
+    """
+    按内容寻址的去重存储：文件保存为 BLOB_FOLDER/ab/cd/<sha256>，多个元数据可引用同一内容，
+    最后一个引用被删除或过期时才删除文件。没有 sha256 的旧数据仍在 UPLOAD_FOLDER/<filename>。
+    压缩保存的内容带编码后缀（<sha256>.gz/.zst），元数据记录 encoding 与 stored_size。
+    放入文件+登记元数据、删除元数据+回收文件都在同一把跨进程锁内完成，避免秒传与回收并发时误删。
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = ProcessLock(os.path.join(folder, '.lock'), 'blob')
+
+    def path(self, sha256, encoding=''):
+        return os.path.join(self.folder, sha256[:2], sha256[2:4], sha256 + BLOB_SUFFIXES[encoding])
+
+    def entry_path(self, entry):
+        if entry.get('sha256'):
+            return self.path(entry['sha256'], entry.get('encoding', ''))
+        return os.path.join(UPLOAD_FOLDER, entry['name'])
+
+    def find_hot(self, sha256):
+        """返回 blob 目录中内容的 (编码, 存储字节数)，不存在时返回 None"""
+        for encoding in BLOB_SUFFIXES:
+            try:
+                return encoding, os.path.getsize(self.path(sha256, encoding))
+            except FileNotFoundError:
+                continue
+        return None
+
+    def find(self, sha256):
+        """返回已保存内容的 (编码, 存储字节数)，包括已移入冷存储的（按移入前的编码与大小），不存在时返回 None"""
+        stored = self.find_hot(sha256)
+        if stored is None:
+            record = cold_tier.get(sha256)
+            if record is not None:
+                stored = record['encoding'], record['stored_size']
+        return stored
+
+    def exists(self, sha256):
+        return self.find(sha256) is not None
+
+    def add_entry(self, entry, temp_path=None, encoding=''):
+        """
+        登记元数据；temp_path 为已写好的内容文件（按 encoding 编码），内容已存在时直接丢弃，
+        temp_path 为空（秒传）时要求内容已存在。成功返回 True，密码被占用返回 False，内容不存在返回 None。
+        各进程的配额预留互不可见，新内容在这里按已提交的用量做最终的配额校验。
+        """
+        return self.add_entries([(entry, temp_path, encoding)])
+
+    def add_entries(self, items):
+        """
+        批量登记 [(元数据, 临时文件, 编码)]，返回值同 add_entry：内容全部放入 blob 目录后元数据一次提交，
+        任一密码被占用时全部不登记；配额按本批新增内容的总字节校验。
+        """
+        temp_paths = [temp_path for _, temp_path, _ in items if temp_path is not None]
+        # 内容在锁外先落盘，再改名进 blob 目录，元数据落盘后不会指向不完整的文件；已存在的内容不需要落盘
+        synced = set()
+        for entry, temp_path, _ in items:
+            if temp_path is not None and self.find(entry['sha256']) is None:
+                fsync_path(temp_path)
+                synced.add(temp_path)
+        # 释放 blob 锁之后再等待元数据落盘，并发上传共享 fsync
+        with metadata_store.group_commit(), self.lock:
+            stored = {}  # {sha256: (编码, 存储字节数)}
+            moves = {}  # {临时文件: blob 路径}，其余临时文件的内容已存在，直接丢弃
+            for entry, temp_path, encoding in items:
+                sha256 = entry['sha256']
+                if sha256 in stored:
+                    continue
+                stored[sha256] = self.find(sha256)
+                if stored[sha256] is None:
+                    if temp_path is None:
+                        self._discard(temp_paths)
+                        return None
+                    stored[sha256] = encoding, os.path.getsize(temp_path)
+                    moves[temp_path] = self.path(sha256, encoding)
+            added = sum(stored[entry['sha256']][1] for entry, temp_path, _ in items if temp_path in moves)
+            if added and storage_manager.get_storage_usage() + added > CLOUD_DISK_MAX_STORAGE_SIZE:
+                self._discard(temp_paths)
+                raise UploadError("存储空间不足")
+            for temp_path in moves:
+                if temp_path not in synced:
+                    fsync_path(temp_path)
+            self.place(moves)
+            for temp_path in temp_paths:
+                if temp_path not in moves:
+                    os.remove(temp_path)
+
+            entries = [entry for entry, _, _ in items]
+            for entry in entries:
+                # 同一内容的所有引用共用已保存的编码
+                entry.pop('encoding', None)
+                entry.pop('stored_size', None)
+                encoding, size = stored[entry['sha256']]
+                if encoding:
+                    entry['encoding'], entry['stored_size'] = encoding, size
+
+            previous = [metadata_store.get(entry['name']) for entry in entries]
+            if not metadata_store.add_all(entries):
+                for entry in entries:
+                    self._collect(entry)
+                return False
+            # 同名覆盖时回收旧内容
+            for entry in previous:
+                if entry is not None:
+                    self._collect(entry)
+            return True
+
+    def remove_entry(self, filename, expire_time=None, defer=False):
+        """
+        删除元数据，内容不再被引用时删除文件，返回被删除的元数据。
+        expire_time 不为空时只删除过期时间一致的元数据（避免误删同名新文件）；
+        defer 为 True 时两阶段删除：先把文件写入持久化删除队列，再提交元数据墓碑，
+        文件由后台线程删除（队列已满时退化为同步删除）。
+        """
+        with metadata_store.group_commit(), self.lock:
+            entry = metadata_store.get(filename)
+            if entry is None or (expire_time is not None and entry['expire_time'] != expire_time):
+                return None
+            deferred = defer and self._is_last_reference(entry) and \
+                deletion_queue.submit(self.entry_path(entry), entry.get('sha256'), entry['name'])
+            metadata_store.remove(filename)
+            if not deferred:
+                self._collect(entry)
+            return entry
+
+    def remove_entries(self, filenames, defer=False):
+        """
+        批量删除元数据（一次提交墓碑），返回被删除的元数据；defer 含义同 remove_entry，
+        本批删除后不再被引用的内容一次写入删除队列。
+        """
+        with metadata_store.group_commit(), self.lock:
+            entries = [entry for entry in map(metadata_store.get, dict.fromkeys(filenames)) if entry is not None]
+            # 同一内容在本批中有多个引用时，全部删除后才是最后一个引用
+            removing = collections.Counter(entry.get('sha256') for entry in entries)
+            tasks = {}
+            for entry in entries:
+                if not entry.get('sha256') or metadata_store.refcount(entry['sha256']) <= removing[entry['sha256']]:
+                    tasks[self.entry_path(entry)] = (entry.get('sha256'), entry['name'])
+            deferred = defer and deletion_queue.submit_many(
+                [(path, sha256, name) for path, (sha256, name) in tasks.items()])
+            metadata_store.remove_many([entry['name'] for entry in entries])
+            if not deferred:
+                for entry in entries:
+                    self._collect(entry)
+            return entries
+
+    def migrate_flat(self, filename):
+        """
+        把没有 sha256 的旧文件从平铺上传目录移入 blob 目录，元数据补充 sha256，
+        返回迁移后的元数据；已迁移、文件不存在或期间被删除/覆盖时返回 None。
+        哈希在锁外计算，锁内确认元数据没有变化后再移动文件。
+        """
+        entry = metadata_store.get(filename)
+        if entry is None or entry.get('sha256'):
+            return None
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        hasher = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+                    hasher.update(chunk)
+        except FileNotFoundError:
+            return None
+        migrated = dict(entry, sha256=hasher.hexdigest())
+        with metadata_store.group_commit(), self.lock:
+            if metadata_store.get(filename) != entry:
+                return None
+            stored = self.find(migrated['sha256'])
+            if stored is None:
+                fsync_path(path)
+                self.place({path: self.path(migrated['sha256'])})
+            else:
+                # 内容已存在，与已有的 blob 共用
+                os.remove(path)
+                if stored[0]:
+                    migrated['encoding'], migrated['stored_size'] = stored
+            metadata_store.update(migrated)
+            hot_file_cache.invalidate(path)
+            return migrated
+
+    @staticmethod
+    def place(moves):
+        """
+        把已落盘的文件改名到 blob 路径 {文件: blob 路径}，再 fsync 所在目录（新建的分片目录连同父目录），
+        之后提交的元数据引用的文件在崩溃后一定存在
+        """
+        directories = set()
+        for path, target in moves.items():
+            directory = os.path.dirname(target)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+                directories.update((os.path.dirname(directory), os.path.dirname(os.path.dirname(directory))))
+            os.replace(path, target)
+            directories.add(directory)
+        for directory in directories:
+            fsync_path(directory)
+
+    def _is_last_reference(self, entry):
+        return not entry.get('sha256') or metadata_store.refcount(entry['sha256']) <= 1
+
+    @staticmethod
+    def _discard(temp_paths):
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _collect(self, entry):
+        if entry.get('sha256') and metadata_store.refcount(entry['sha256']):
+            return
+        path = self.entry_path(entry)
+        hot_file_cache.invalidate(path)
+        if os.path.exists(path):
+            os.remove(path)
+        if entry.get('sha256'):
+            cold_tier.remove([entry['sha256']])
+
+    def delete_unreferenced(self, items):
+        """
+        批量删除文件，删除前再次确认没有被元数据引用（秒传可能复用了待删除的内容，
+        崩溃恢复时墓碑也可能没有提交）。返回删除失败需要重试的任务。
+        """
+        failed = []
+        with self.lock:
+            cold = []
+            for item in items:
+                if item['sha256']:
+                    if metadata_store.refcount(item['sha256']):
+                        continue
+                    cold.append(item['sha256'])
+                else:
+                    entry = metadata_store.get(item['name'])
+                    if entry is not None and not entry.get('sha256'):
+                        continue
+                hot_file_cache.invalidate(item['path'])
+                try:
+                    os.remove(item['path'])
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"删除文件出错: {item['path']} {str(e)}")
+                    failed.append(item)
+            # 冷存储中的内容只删除索引记录，打包文件的空间由冷存储移动线程重写回收
+            cold_tier.remove(cold)
+        return failed
+
+
+def fadvise(fd, advice):
+    """提示内核文件的读取方式：'sequential' 加大预读，'willneed' 提前读入页缓存；不支持的平台上忽略"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL if advice == 'sequential' else os.POSIX_FADV_WILLNEED)
+
+
+def fsync_path(path):
+    """fsync 文件或目录（目录 fsync 后其中新建、改名的条目才落盘）"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def open_sequential(filepath):
+    f = open(filepath, 'rb')
+    fadvise(f.fileno(), 'sequential')
+    return f
+
+
+class HotFile:
+    """缓存的文件内容：data 为 bytes（小文件）或只读 mmap（大文件），stat 为读入时的文件状态"""
+
+    def __init__(self, data, stat, mapped):
+        self.data = data
+        self.stat = stat
+        self.mapped = mapped
+
+
+class HotFileCache:
+    """
+    热点文件读缓存，键为存储路径（blob 按内容寻址，路径不变内容就不变）。
+    同一文件被请求 HOT_CACHE_MIN_REQUESTS 次后才缓存，只下载一次的文件不会挤掉热点文件；
+    小文件整体读入内存按字节预算 LRU 淘汰，大文件 mmap 映射（并提示内核预读）按映射数 LRU 淘汰。
+    淘汰时只丢弃引用，正在发送的响应持有的内容不受影响；文件被删除时由 BlobStore 调用 invalidate。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = collections.OrderedDict()  # {路径: HotFile}，读入内存的小文件，按最近使用排序
+        self.mapped = collections.OrderedDict()  # {路径: HotFile}，mmap 映射的大文件
+        self.requests = collections.OrderedDict()  # {路径: 请求次数}，尚未缓存的文件
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, filepath):
+        with self.lock:
+            return filepath in self.files or filepath in self.mapped
+
+    def get(self, filepath):
+        """返回缓存的内容；未缓存时记一次请求，达到次数后读入缓存并返回，否则返回 None"""
+        if not HOT_CACHE_BYTES:
+            return None
+        with self.lock:
+            for cache in (self.files, self.mapped):
+                hot = cache.get(filepath)
+                if hot is not None:
+                    cache.move_to_end(filepath)
+                    self.hits += 1
+                    metrics.inc('c1yunpan_hot_cache_requests_total', result='hit')
+                    return hot
+            self.misses += 1
+            metrics.inc('c1yunpan_hot_cache_requests_total', result='miss')
+            count = self.requests.pop(filepath, 0) + 1
+            if count < HOT_CACHE_MIN_REQUESTS:
+                self.requests[filepath] = count
+                while len(self.requests) > HOT_CACHE_TRACKED_FILES:
+                    self.requests.popitem(last=False)
+                return None
+
+        # 读文件在锁外进行
+        hot = self._load(filepath)
+        if hot is None:
+            return None
+        with self.lock:
+            cache = self.mapped if hot.mapped else self.files
+            if filepath in cache:
+                return cache[filepath]
+            cache[filepath] = hot
+            if not hot.mapped:
+                self.bytes += hot.stat.st_size
+            self._evict()
+        return hot
+
+    @staticmethod
+    def _load(filepath):
+        try:
+            with open(filepath, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size <= HOT_CACHE_MAX_FILE_SIZE:
+                    return HotFile(f.read(), stat, False)
+                if not HOT_CACHE_MMAP_FILES:
+                    return None
+                fadvise(f.fileno(), 'willneed')
+                # 映射在文件关闭后仍然有效
+                return HotFile(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), stat, True)
+        except FileNotFoundError:
+            return None
+
+    def _evict(self):
+        while self.bytes > HOT_CACHE_BYTES:
+            _, hot = self.files.popitem(last=False)
+            self.bytes -= hot.stat.st_size
+            self.evictions += 1
+        while len(self.mapped) > HOT_CACHE_MMAP_FILES:
+            self.mapped.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, filepath):
+        with self.lock:
+            self.requests.pop(filepath, None)
+            self.mapped.pop(filepath, None)
+            hot = self.files.pop(filepath, None)
+            if hot is not None:
+                self.bytes -= hot.stat.st_size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "files": len(self.files),
+                "bytes": self.bytes,
+                "mapped_files": len(self.mapped),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def choose_cold_codec(sample):
+    """冷存储的压缩方式：已压缩的格式或试压缩比例不理想的内容原样打包（''），其余按 COLD_CODEC 压缩"""
+    if len(sample) < CODEC_MIN_SIZE or sample.startswith(COMPRESSED_MAGIC) or sample[4:8] == b'ftyp':
+        return ''
+    if len(zlib.compress(sample[:CODEC_SAMPLE_SIZE], 1)) > len(sample[:CODEC_SAMPLE_SIZE]) * CODEC_MAX_RATIO:
+        return ''
+    if COLD_CODEC == 'zstd' and zstandard is not None:
+        return 'zstd'
+    return 'xz'
+
+
+def new_cold_compressor(codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=COLD_ZSTD_LEVEL).compressobj()
+    if codec == 'xz':
+        return lzma.LZMACompressor(preset=COLD_XZ_PRESET)
+    return None
+
+
+class PackSlice(io.RawIOBase):
+    """打包文件中一段内容的只读文件对象（pread 读取，不影响其它读取方），支持 seek"""
+
+    def __init__(self, path, offset, length):
+        self.fd = None
+        self.fd = os.open(path, os.O_RDONLY)
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self.length - self.position)
+        if size <= 0:
+            return 0
+        data = os.pread(self.fd, size, self.offset + self.position)
+        b[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.length}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed and self.fd is not None:
+            os.close(self.fd)
+        super().close()
+
+
+class XzReader(lzma.LZMAFile):
+    """LZMAFile 关闭时不会关闭传入的文件对象，这里一并关闭打包文件切片"""
+
+    def __init__(self, source):
+        super().__init__(source)
+        self.source = source
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.source.close()
+
+
+class ColdTier:
+    """
+    冷存储：内容按 sha256 寻址，高压缩比压缩后追加写入 COLD_FOLDER/pack-<序号>.pack（只追加，避免大量小文件占用 inode），
+    索引日志 index.log 记录每个内容所在的打包文件、偏移与长度（add/del 记录）以及打包文件的大小（pack/drop 记录），
+    各进程按文件偏移增量读入。
+    元数据中的 encoding/stored_size 仍是移入前热存储的编码与大小，取回热存储时按原编码重新写出。
+    追加打包文件与索引都持有跨进程文件锁；打包文件只由后台任务主进程重写，重写后旧文件删除，读取方重新读索引后重试。
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_path = os.path.join(folder, 'index.log')
+        self.lock = threading.Lock()
+        self.file_lock = ProcessLock(os.path.join(folder, '.lock'), 'cold')
+        self.records = {}  # {sha256: 索引记录}
+        self.pack_live = collections.Counter()  # {打包文件名: 仍被引用的字节数}
+        self.pack_sizes = {}  # {打包文件名: 文件大小}，包括已删除内容占用、尚未重写回收的空间
+        self.size = 0  # 原始内容字节数
+        self.stored_bytes = 0  # 移入前在热存储中占用的字节数
+        self.packed_bytes = 0  # 在打包文件中占用的字节数
+        self._index = LogTail(self.index_path)
+
+    def _pack_path(self, pack):
+        return os.path.join(self.folder, pack)
+
+    def _apply(self, record, sign):
+        self.pack_live[record['pack']] += sign * record['length']
+        self.size += sign * record['size']
+        self.stored_bytes += sign * record['stored_size']
+        self.packed_bytes += sign * record['length']
+
+    def _refresh(self):
+        """增量读入索引日志尾部（持有 self.lock 时调用）"""
+        tail = self._index.read()
+        if tail is None:
+            return
+        replaced, lines = tail
+        if replaced:
+            # 首次读取或索引被压缩替换：从头读入
+            self.records = {}
+            self.pack_live = collections.Counter()
+            self.pack_sizes = {}
+            self.size = self.stored_bytes = self.packed_bytes = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record['op'] == 'pack':
+                self.pack_sizes[record['pack']] = record['size']
+                continue
+            if record['op'] == 'drop':
+                self.pack_sizes.pop(record['pack'], None)
+                continue
+            previous = self.records.pop(record['sha256'], None)
+            if previous is not None:
+                self._apply(previous, -1)
+            if record['op'] == 'add':
+                self.records[record['sha256']] = record
+                self._apply(record, 1)
+                end_offset = record['offset'] + record['length']
+                if self.pack_sizes.get(record['pack'], 0) < end_offset:
+                    self.pack_sizes[record['pack']] = end_offset
+
+    def _write(self, records):
+        """追加索引记录并 fsync（持有文件锁时调用）"""
+        data = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records).encode()
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def get(self, sha256):
+        """返回内容的索引记录，不在冷存储中时返回 None"""
+        if not sha256:
+            return None
+        with self.lock:
+            record = self.records.get(sha256)
+            if record is None:
+                self._refresh()
+                record = self.records.get(sha256)
+            return record
+
+    def sha256s(self):
+        with self.lock:
+            self._refresh()
+            return list(self.records)
+
+    def contains(self, sha256):
+        """重新读入索引后判断内容是否仍在冷存储中（get 对已读入的记录不会重新读索引）"""
+        with self.lock:
+            self._refresh()
+            return sha256 in self.records
+
+    def saved_bytes(self):
+        """移入冷存储节省的配额字节数，打包文件中已删除内容的空间在重写回收前仍计入用量"""
+        with self.lock:
+            self._refresh()
+            return self.stored_bytes - sum(self.pack_sizes.values())
+
+    def open(self, sha256):
+        """返回读出原始内容的只读文件对象，内容不在冷存储中时抛出 FileNotFoundError"""
+        for attempt in range(2):
+            record = self.get(sha256)
+            if record is None:
+                raise FileNotFoundError(sha256)
+            try:
+                source = PackSlice(self._pack_path(record['pack']), record['offset'], record['length'])
+                break
+            except FileNotFoundError:
+                # 打包文件刚被重写删除，读入新的索引后重试
+                with self.lock:
+                    self._refresh()
+                if attempt:
+                    raise
+        fadvise(source.fd, 'sequential')
+        if record['codec'] == 'zstd':
+            return zstandard.ZstdDecompressor().stream_reader(source, closefd=True)
+        if record['codec'] == 'xz':
+            return XzReader(source)
+        return source
+
+    def add(self, sha256, temp_path, record, replaces=None):
+        """
+        把已压缩好的临时文件追加到当前打包文件并登记索引，返回是否登记；
+        replaces 为 (打包文件, 偏移) 时只在索引仍指向该位置时登记（重写打包文件时使用）。
+        """
+        length = os.path.getsize(temp_path)
+        os.makedirs(self.folder, exist_ok=True)
+        with self.file_lock, self.lock:
+            self._refresh()
+            current = self.records.get(sha256)
+            if replaces is not None and (current is None or (current['pack'], current['offset']) != replaces):
+                return False
+            pack = self._current_pack(length)
+            with open(self._pack_path(pack), 'ab') as out, open(temp_path, 'rb') as src:
+                offset = out.tell()
+                shutil.copyfileobj(src, out, DOWNLOAD_CHUNK_SIZE)
+                out.flush()
+                os.fsync(out.fileno())
+            self._write([dict(record, op='add', sha256=sha256, pack=pack, offset=offset, length=length,
+                              time=time.time())])
+            self._refresh()
+            return True
+
+    def _current_pack(self, length):
+        """最新的打包文件，写入后会超过 COLD_PACK_SIZE 时新建下一个"""
+        packs = sorted(name for name in os.listdir(self.folder) if name.startswith('pack-') and name.endswith('.pack'))
+        if packs:
+            last = packs[-1]
+            size = os.path.getsize(self._pack_path(last))
+            if size == 0 or size + length <= COLD_PACK_SIZE:
+                return last
+            return self._next_pack(last)
+        return self._next_pack(None)
+
+    @staticmethod
+    def _next_pack(last):
+        number = int(last[len('pack-'):-len('.pack')]) + 1 if last else 1
+        return f"pack-{number:08d}.pack"
+
+    def remove(self, sha256s):
+        """删除索引记录（内容已被删除或已取回热存储），打包文件中的空间之后重写回收"""
+        if not sha256s:
+            return
+        with self.lock:
+            self._refresh()
+            if not any(sha256 in self.records for sha256 in sha256s):
+                return
+        with self.file_lock, self.lock:
+            self._refresh()
+            present = [sha256 for sha256 in dict.fromkeys(sha256s) if sha256 in self.records]
+            if present:
+                self._write([{'op': 'del', 'sha256': sha256} for sha256 in present])
+                self._refresh()
+
+    def compact(self):
+        """
+        重写已删除内容超过 COLD_PACK_GARBAGE_RATIO 的打包文件：仍被引用的内容原样复制到当前打包文件，
+        之后删除旧文件；最后把索引日志压缩为只含有效记录。返回回收的字节数。
+        最新的打包文件需要重写时先封存：新建下一个空打包文件，之后的写入（包括重写复制的内容）都进入新文件，
+        否则小规模部署的打包文件永远写不满 COLD_PACK_SIZE，其中已删除内容的空间一直计入用量。
+        """
+        if not os.path.isdir(self.folder):
+            return 0
+        with self.file_lock, self.lock:
+            self._refresh()
+            packs = sorted(name for name in os.listdir(self.folder) if name.startswith('pack-') and name.endswith('.pack'))
+            garbage = []
+            for pack in packs:
+                size = os.path.getsize(self._pack_path(pack))
+                if size and (size - self.pack_live[pack]) / size >= COLD_PACK_GARBAGE_RATIO:
+                    if pack == packs[-1]:
+                        open(self._pack_path(self._next_pack(pack)), 'ab').close()
+                    garbage.append((pack, size, [r for r in self.records.values() if r['pack'] == pack]))
+        reclaimed = 0
+        for pack, size, records in garbage:
+            for record in records:
+                temp_path = os.path.join(self.folder, f".archive-{uuid.uuid4().hex}")
+                try:
+                    with PackSlice(self._pack_path(pack), record['offset'], record['length']) as src, \
+                            open(temp_path, 'wb') as out:
+                        shutil.copyfileobj(src, out, DOWNLOAD_CHUNK_SIZE)
+                    fields = {key: record[key] for key in ('size', 'stored_size', 'encoding', 'codec')}
+                    self.add(record['sha256'], temp_path, fields, replaces=(pack, record['offset']))
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            with self.file_lock, self.lock:
+                self._refresh()
+                if not self.pack_live[pack]:
+                    # 先删除文件再登记，中途崩溃时只会多算用量
+                    os.remove(self._pack_path(pack))
+                    self._write([{'op': 'drop', 'pack': pack}])
+                    self._refresh()
+                    del self.pack_live[pack]
+                    reclaimed += size
+        self._compact_index()
+        return reclaimed
+
+    def _compact_index(self):
+        with self.file_lock, self.lock:
+            self._refresh()
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                for pack, size in self.pack_sizes.items():
+                    f.write(json.dumps({'op': 'pack', 'pack': pack, 'size': size}, separators=(',', ':')) + '\n')
+                for record in self.records.values():
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            os.replace(temp_path, self.index_path)
+            # 内存中的记录已与新索引一致，从新索引末尾继续读
+            self._index.reopen(size)
+
+    def stats(self):
+        with self.lock:
+            self._refresh()
+            result = {
+                "files": len(self.records),
+                "size": self.size,
+                "stored_bytes": self.stored_bytes,
+                "packed_bytes": self.packed_bytes
+            }
+        pack_bytes = 0
+        pack_files = 0
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.startswith('pack-') and name.endswith('.pack'):
+                    pack_files += 1
+                    pack_bytes += os.path.getsize(self._pack_path(name))
+        result.update(pack_files=pack_files, pack_bytes=pack_bytes,
+                      ratio=round(result['packed_bytes'] / result['size'], 3) if result['size'] else None)
+        return result
+
+
+class TierMover:
+    """
+    冷热分层：下载时记录最后访问时间（同一文件每 TIER_TOUCH_INTERVAL 最多写一次元数据）；
+    后台任务主进程每 TIER_SCAN_INTERVAL 扫描一次元数据，全部引用都超过 TIER_COLD_AFTER 没有被下载的内容移入冷存储，
+    之后重写空间利用率低的打包文件。冷存储中的内容被同一进程下载 TIER_REHYDRATE_REQUESTS 次后由后台线程取回热存储。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()  # {'hot'/'cold': 下载文件数}
+        self.cold_requests = collections.OrderedDict()  # {sha256: 从冷存储下载的次数}
+        self.rehydrating = set()
+        self.archived = 0
+        self.rehydrated = 0
+        self.reclaimed = 0
+        self.last_scan = {}
+
+    def record_access(self, entries, tier):
+        """记录一次下载：必要时更新最后访问时间，冷存储的内容达到次数后开始取回"""
+        if not entries:
+            return
+        now = time.time()
+        stale = [entry['name'] for entry in entries
+                 if now - entry.get('last_access', entry['upload_time']) >= TIER_TOUCH_INTERVAL]
+        if stale:
+            metadata_store.touch(stale, now)
+        metrics.inc('c1yunpan_tier_requests_total', len(entries), tier=tier)
+        rehydrate = []
+        with self.lock:
+            self.requests[tier] += len(entries)
+            if tier == 'cold':
+                for entry in entries:
+                    count = self.cold_requests.pop(entry['sha256'], 0) + 1
+                    if count < TIER_REHYDRATE_REQUESTS:
+                        self.cold_requests[entry['sha256']] = count
+                    elif entry['sha256'] not in self.rehydrating:
+                        self.rehydrating.add(entry['sha256'])
+                        rehydrate.append(entry)
+                while len(self.cold_requests) > HOT_CACHE_TRACKED_FILES:
+                    self.cold_requests.popitem(last=False)
+        for entry in rehydrate:
+            threading.Thread(target=self._rehydrate, args=(entry,), daemon=True).start()
+
+    def _rehydrate(self, entry):
+        try:
+            self.rehydrate(entry)
+        except Exception as e:
+            print(f"取回热存储出错: {entry['name']} {str(e)}")
+        finally:
+            with self.lock:
+                self.rehydrating.discard(entry['sha256'])
+
+    def rehydrate(self, entry):
+        """把冷存储中的内容按元数据中的编码写回 blob 目录并删除索引记录，返回是否取回"""
+        sha256 = entry['sha256']
+        try:
+            source = cold_tier.open(sha256)
+        except FileNotFoundError:
+            return False
+        compressor = new_compressor(entry.get('encoding', ''))
+        path = blob_store.entry_path(entry)
+        fd, temp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix='.upload-', suffix='.part')
+        try:
+            with source, os.fdopen(fd, 'wb') as out:
+                while chunk := source.read(DOWNLOAD_CHUNK_SIZE):
+                    out.write(compressor.compress(chunk) if compressor else chunk)
+                if compressor:
+                    out.write(compressor.flush())
+                out.flush()
+                os.fsync(out.fileno())
+            rehydrated = False
+            with blob_store.lock:
+                if metadata_store.refcount(sha256) and not os.path.exists(path):
+                    # 改名落盘后才删除冷存储的索引记录
+                    blob_store.place({temp_path: path})
+                    rehydrated = True
+                cold_tier.remove([sha256])
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if rehydrated:
+            with self.lock:
+                self.rehydrated += 1
+            metrics.inc('c1yunpan_tier_moves_total', direction='rehydrate')
+        return rehydrated
+
+    def archive(self, entry):
+        """把内容压缩后移入冷存储并删除 blob 目录中的文件，返回是否移入"""
+        sha256 = entry['sha256']
+        path = blob_store.entry_path(entry)
+        encoding = entry.get('encoding', '')
+        try:
+            source = open_decoded(path, encoding) if encoding else open_sequential(path)
+        except FileNotFoundError:
+            return False
+        os.makedirs(COLD_FOLDER, exist_ok=True)
+        temp_path = os.path.join(COLD_FOLDER, f".archive-{uuid.uuid4().hex}")
+        hasher = hashlib.sha256()
+        try:
+            with source, open(temp_path, 'wb') as out:
+                chunk = source.read(CODEC_SAMPLE_SIZE)
+                codec = choose_cold_codec(chunk)
+                compressor = new_cold_compressor(codec)
+                while chunk:
+                    hasher.update(chunk)
+                    out.write(compressor.compress(chunk) if compressor else chunk)
+                    chunk = source.read(DOWNLOAD_CHUNK_SIZE)
+                if compressor:
+                    out.write(compressor.flush())
+            if hasher.hexdigest() != sha256:
+                print(f"内容校验失败，不移入冷存储: {path}")
+                return False
+            cold_tier.add(sha256, temp_path, {"size": entry['size'], "stored_size": stored_size(entry),
+                                              "encoding": encoding, "codec": codec})
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with blob_store.lock:
+            if not metadata_store.refcount(sha256):
+                # 压缩期间最后一个引用被删除
+                cold_tier.remove([sha256])
+                return False
+            if not cold_tier.contains(sha256):
+                # 对账在登记冷存储后、删除热存储文件前看到两边都有，已删除冷存储的记录，保留热存储的文件
+                return False
+            hot_file_cache.invalidate(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        metrics.inc('c1yunpan_tier_moves_total', direction='archive')
+        return True
+
+    def step(self):
+        """扫描一轮：按最后访问时间从旧到新移入冷存储，最多 TIER_MAX_MOVES 个，之后回收打包文件空间"""
+        started = time.time()
+        cold = set(cold_tier.sha256s())
+        groups = {}  # {sha256: [引用该内容的元数据]}
+        for entry in metadata_store.all():
+            if entry.get('sha256') and entry['sha256'] not in cold:
+                groups.setdefault(entry['sha256'], []).append(entry)
+        candidates = []
+        for entries in groups.values():
+            last_access = max(entry.get('last_access', entry['upload_time']) for entry in entries)
+            if started - last_access < TIER_COLD_AFTER:
+                continue
+            # 全部引用都即将过期的内容留给过期清理
+            if all(entry['expire_time'] and entry['expire_time'] - started < TIER_MIN_REMAINING for entry in entries):
+                continue
+            candidates.append((last_access, entries[0]))
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        archived = 0
+        for _, entry in candidates[:TIER_MAX_MOVES]:
+            try:
+                archived += self.archive(entry)
+            except Exception as e:
+                print(f"移入冷存储出错: {entry['name']} {str(e)}")
+        reclaimed = cold_tier.compact()
+        with self.lock:
+            self.archived += archived
+            self.reclaimed += reclaimed
+            self.last_scan = {"started": started, "finished": time.time(), "candidates": len(candidates),
+                              "archived": archived, "reclaimed_bytes": reclaimed}
+
+    def run(self):
+        if not TIER_COLD_AFTER:
+            return
+        # Linux 下只降低本线程的调度优先级
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            try:
+                self.step()
+            except Exception as e:
+                print(f"冷热分层出错: {str(e)}")
+                metrics.inc('c1yunpan_cleanup_errors_total')
+            time.sleep(TIER_SCAN_INTERVAL)
+
+    def stats(self):
+        cold = cold_tier.stats()
+        with self.lock:
+            hot_requests, cold_requests = self.requests['hot'], self.requests['cold']
+            result = {
+                "hot": {"stored_bytes": metadata_store.usage()[0] - cold['stored_bytes']},
+                "cold": cold,
+                "requests": {"hot": hot_requests, "cold": cold_requests},
+                "cold_hit_rate": round(cold_requests / (hot_requests + cold_requests), 3)
+                if hot_requests + cold_requests else None,
+                "archived": self.archived,
+                "rehydrated": self.rehydrated,
+                "reclaimed_bytes": self.reclaimed,
+                "last_scan": dict(self.last_scan)
+            }
+        return result
+
+
+class DeletionQueue:
+    """
+    持久化后台删除队列：任务追加写入队列日志（add/done 记录）并 fsync 后才返回，
+    后台线程攒批删除，失败按指数退避重试，进程崩溃重启后回放日志恢复未完成的任务。
+    各 worker 进程持有跨进程文件锁向同一个日志追加任务，只有后台任务主进程运行删除线程，
+    按文件偏移增量读入其它进程提交的任务。
+    队列有上限，满时由调用方同步删除作为背压。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cond = threading.Condition()
+        self.file_lock = ProcessLock(path + '.lock', 'delete_queue')
+        self.pending = {}  # {task_id: item}
+        self.ready = collections.deque()  # 待处理的 task_id
+        self.delayed = []  # 等待重试 [(next_try, task_id)]
+        self.running = False  # 本进程运行删除线程时，读入的新任务进入 ready
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self._log = LogTail(path)
+
+    def _refresh(self):
+        """增量读入日志尾部（持有 cond 时调用）：本进程与其它进程提交的任务，以及删除线程的完成记录"""
+        tail = self._log.read()
+        if tail is None:
+            return
+        replaced, lines = tail
+        if replaced:
+            # 首次读取或日志被压缩替换：从头读入
+            self.pending = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record['op'] == 'add':
+                self.pending[record['id']] = record['item']
+                if self.running:
+                    self.ready.append(record['id'])
+            else:
+                self.pending.pop(record['id'], None)
+
+    def _compact(self):
+        """删除线程启动时压缩日志，只保留未完成的任务；持有文件锁，其它进程此时不能追加"""
+        with self.cond, self.file_lock:
+            self._log.close()
+            self._refresh()
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as f:
+                for task_id, item in self.pending.items():
+                    f.write(json.dumps({'op': 'add', 'id': task_id, 'item': item}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            os.replace(temp_path, self.path)
+            self._log.reopen(size)
+            self.running = True
+            self.ready.extend(self.pending)
+
+    def _write(self, records):
+        """追加记录（持有文件锁时调用，不会写进刚被压缩替换掉的旧日志）"""
+        data = ''.join(json.dumps(r) + '\n' for r in records).encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def submit(self, path, sha256=None, name=None):
+        """任务落盘后返回 True，队列已满返回 False"""
+        return self.submit_many([(path, sha256, name)])
+
+    def submit_many(self, tasks):
+        """批量提交 [(路径, sha256, 文件名)]，一次写入并 fsync；队列放不下全部任务时返回 False"""
+        with self.cond, self.file_lock:
+            self._refresh()
+            if len(self.pending) + len(tasks) > DELETE_QUEUE_MAX:
+                return False
+            records = [{'op': 'add', 'id': uuid.uuid4().hex,
+                        'item': {"path": path, "sha256": sha256, "name": name, "attempts": 0}}
+                       for path, sha256, name in tasks]
+            if records:
+                self._write(records)
+            self._refresh()
+            self.cond.notify()
+            return True
+
+    def run(self):
+        self._compact()
+        while True:
+            with self.cond:
+                while True:
+                    self._refresh()
+                    now = time.time()
+                    while self.delayed and self.delayed[0][0] <= now:
+                        self.ready.append(heapq.heappop(self.delayed)[1])
+                    if self.ready:
+                        break
+                    # 其它进程提交的任务不会唤醒本线程，定时读入
+                    timeout = DELETE_QUEUE_POLL_INTERVAL
+                    if self.delayed:
+                        timeout = min(timeout, self.delayed[0][0] - now)
+                    self.cond.wait(timeout)
+                task_ids = [self.ready.popleft() for _ in range(min(len(self.ready), DELETE_BATCH_SIZE))]
+                task_ids = [task_id for task_id in task_ids if task_id in self.pending]
+                batch = [dict(self.pending[task_id], id=task_id) for task_id in task_ids]
+
+            try:
+                failed = {item['id'] for item in blob_store.delete_unreferenced(batch)}
+            except Exception as e:
+                print(f"删除文件出错: {str(e)}")
+                failed = set(task_ids)
+
+            with self.cond:
+                done = []
+                for task_id in task_ids:
+                    item = self.pending[task_id]
+                    if task_id in failed:
+                        item['attempts'] += 1
+                        if item['attempts'] < DELETE_MAX_RETRIES:
+                            self.retries += 1
+                            delay = DELETE_RETRY_DELAY * 2 ** (item['attempts'] - 1)
+                            heapq.heappush(self.delayed, (time.time() + delay, task_id))
+                            continue
+                        self.failed += 1
+                        print(f"删除文件失败，放弃重试: {item['path']}")
+                    else:
+                        self.completed += 1
+                    done.append({'op': 'done', 'id': task_id})
+                    del self.pending[task_id]
+                if done:
+                    with self.file_lock:
+                        self._write(done)
+
+    def backlog(self):
+        """未完成的任务数（包括其它进程刚提交的）"""
+        with self.cond:
+            self._refresh()
+            return len(self.pending)
+
+    def stats(self):
+        with self.cond:
+            self._refresh()
+            return {
+                "pending": len(self.pending),
+                "retrying": len(self.delayed),
+                "completed": self.completed,
+                "failed": self.failed,
+                "retries": self.retries
+            }
+
+
+class ExpiryScheduler:
+    """
+    过期调度：最小堆按 expire_time 排列非永久文件，线程睡眠到最近的过期时间，
+    到期后只删除对应的元数据，磁盘文件交给后台删除线程批量删除。
+    堆中记录惰性失效：出堆时与当前元数据核对，已删除或已被同名覆盖的直接丢弃。
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []  # [(expire_time, filename)]
+        self.queued = set()  # 堆中已有的 (expire_time, filename)，日志压缩后重新载入快照时不重复入堆
+        self.backlog = 0  # 已到期、尚未处理的数量
+        self.expired_total = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def schedule(self, entry):
+        if entry['expire_time'] == 0:
+            return
+        item = (entry['expire_time'], entry['name'])
+        with self.cond:
+            if item in self.queued:
+                return
+            self.queued.add(item)
+            heapq.heappush(self.heap, item)
+            # 新的最早过期时间，唤醒调度线程重新计算睡眠时长
+            if self.heap[0][1] == entry['name']:
+                self.cond.notify()
+
+    def run(self):
+        # 只在运行调度线程的进程里订阅元数据并建堆
+        with metadata_store.lock:
+            metadata_store.listeners.append(self.schedule)
+            for entry in metadata_store.all():
+                self.schedule(entry)
+        while True:
+            with self.cond:
+                timeout = EXPIRY_MAX_SLEEP
+                if self.heap:
+                    timeout = min(timeout, self.heap[0][0] - time.time())
+                if timeout > 0:
+                    self.cond.wait(timeout)
+                now = time.time()
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap))
+                    self.queued.discard(due[-1])
+                self.backlog = len(due)
+
+            # 同步其它进程写入的元数据（新记录会通过 schedule 进堆）
+            metadata_store.usage()
+            for expire_time, filename in due:
+                try:
+                    if blob_store.remove_entry(filename, expire_time=expire_time, defer=True) is not None:
+                        self.expired_total += 1
+                        self.last_lag = time.time() - expire_time
+                        self.max_lag = max(self.max_lag, self.last_lag)
+                except Exception as e:
+                    print(f"清理出错: {str(e)}")
+                self.backlog -= 1
+
+    def stats(self):
+        # 删除队列有自己的锁，不在持有 self.cond 时读取
+        delete_backlog = deletion_queue.backlog()
+        with self.cond:
+            return {
+                "scheduled": len(self.heap),
+                "next_expire_in": max(0.0, self.heap[0][0] - time.time()) if self.heap else None,
+                "backlog": self.backlog,
+                "expired_total": self.expired_total,
+                "last_lag_seconds": round(self.last_lag, 3),
+                "max_lag_seconds": round(self.max_lag, 3),
+                "delete_backlog": delete_backlog
+            }
+
+
+class StorageReconciler:
+    """
+    低优先级的增量对账：每一步只用 os.scandir 扫描一个分片目录（平铺上传目录，或 BLOB_FOLDER/ab），
+    分片之间均匀休眠，STORAGE_RECONCILE_INTERVAL 内扫完一轮，从不整体遍历磁盘。
+    - 磁盘上没有元数据引用的文件（以及残留超过 UPLOAD_SESSION_TTL 的上传临时文件）删除
+    - 元数据引用但磁盘上（以及冷存储中）不存在的文件，删除对应的元数据
+    - 冷存储中没有元数据引用、或已有热存储副本的索引记录删除
+    修正前在 blob 跨进程锁内重新确认，不会误删正在提交的上传；一轮结束后汇总偏差并重算已用空间。
+    """
+
+    # '' 为旧的平铺上传目录，'cold' 为冷存储索引，其余为 blob 目录的一级分片
+    SHARDS = [''] + [f"{i:02x}" for i in range(256)] + ['cold']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.position = 0
+        self.expected = []  # 本轮开始时被引用的内容哈希（有序，按前缀二分查找分片）
+        self.current = {}
+        self.last = {}
+
+    def step(self):
+        """扫描下一个分片，返回本轮是否结束"""
+        if self.position == 0:
+            self.expected = sorted(metadata_store.sha256s())
+            self.current = {"started": time.time(), "disk_files": 0, "disk_usage": 0,
+                            "orphan_files": 0, "orphan_bytes": 0, "missing_files": 0}
+        shard = self.SHARDS[self.position]
+        if shard == 'cold':
+            self._scan_cold()
+        elif shard:
+            self._scan_blob_shard(shard)
+        else:
+            self._scan_uploads()
+        self.position += 1
+        if self.position < len(self.SHARDS):
+            return False
+        self.position = 0
+        usage, file_count, stored_count = metadata_store.recount()
+        cold = cold_tier.stats()
+        result = dict(self.current, finished=time.time(), used_storage=usage, file_count=file_count,
+                      stored_count=stored_count, cold_files=cold['files'])
+        # 冷存储中的内容不在 blob 目录，不计入磁盘应有的文件数与字节数
+        usage -= cold['stored_bytes']
+        stored_count -= cold['files']
+        if result['orphan_files'] or result['missing_files'] or \
+                result['disk_usage'] != usage or result['disk_files'] != stored_count:
+            # 一轮扫描期间仍有上传和删除，磁盘与元数据的差值只是近似值
+            print(f"存储对账: 元数据 {stored_count} 个/{usage}B，磁盘 {result['disk_files']} 个/{result['disk_usage']}B，"
+                  f"删除无引用文件 {result['orphan_files']} 个，删除缺失文件的元数据 {result['missing_files']} 条")
+        with self.lock:
+            self.last = result
+        return True
+
+    def _scan_uploads(self):
+        now = time.time()
+        suspects = []
+        legacy = set(metadata_store.legacy_names())
+        with os.scandir(UPLOAD_FOLDER) as it:
+            for item in it:
+                if not item.is_file():
+                    continue
+                if item.name.startswith('.upload-'):
+                    # 进程崩溃残留的上传临时文件
+                    if item.stat().st_mtime + UPLOAD_SESSION_TTL < now:
+                        suspects.append((item.path, None))
+                    continue
+                if item.name.startswith('.'):
+                    continue
+                self._count(item)
+                if item.name in legacy:
+                    legacy.discard(item.name)
+                else:
+                    suspects.append((item.path, item.name))
+        if suspects or legacy:
+            with blob_store.lock:
+                for path, name in suspects:
+                    entry = metadata_store.get(name) if name else None
+                    if entry is None or entry.get('sha256'):
+                        self._remove_orphan(path)
+                for name in legacy:
+                    entry = metadata_store.get(name)
+                    if entry is not None and not entry.get('sha256'):
+                        self._remove_missing(entry)
+
+    def _scan_blob_shard(self, shard):
+        on_disk = {}  # {文件名: 路径}
+        try:
+            with os.scandir(os.path.join(BLOB_FOLDER, shard)) as it:
+                subdirs = [item.path for item in it if item.is_dir()]
+        except FileNotFoundError:
+            subdirs = []
+        for subdir in subdirs:
+            with os.scandir(subdir) as it:
+                for item in it:
+                    if item.is_file() and not item.name.startswith('.'):
+                        on_disk[item.name] = item.path
+                        self._count(item)
+        # 本分片中被引用的内容逐个与磁盘核对，剩下的磁盘文件没有对应的元数据（或编码后缀不一致）
+        suspects = []
+        start = bisect.bisect_left(self.expected, shard)
+        for sha256 in self.expected[start:bisect.bisect_left(self.expected, shard + 'g')]:
+            entry = metadata_store.find_by_sha256(sha256)
+            if entry is None:
+                continue
+            path = blob_store.entry_path(entry)
+            if on_disk.pop(os.path.basename(path), None) is None and cold_tier.get(sha256) is None:
+                suspects.append(path)
+        suspects.extend(on_disk.values())
+        if not suspects:
+            return
+        with blob_store.lock:
+            for path in suspects:
+                sha256 = os.path.basename(path).split('.', 1)[0]
+                entry = metadata_store.find_by_sha256(sha256)
+                if entry is None or blob_store.entry_path(entry) != path:
+                    self._remove_orphan(path)
+                elif not os.path.exists(path) and cold_tier.get(sha256) is None:
+                    self._remove_missing(entry)
+
+    def _scan_cold(self):
+        now = time.time()
+        if os.path.isdir(COLD_FOLDER):
+            with os.scandir(COLD_FOLDER) as it:
+                for item in it:
+                    # 进程崩溃残留的压缩临时文件
+                    if item.name.startswith('.archive-') and item.stat().st_mtime + UPLOAD_SESSION_TTL < now:
+                        self._remove_orphan(item.path)
+        suspects = []
+        for sha256 in cold_tier.sha256s():
+            entry = metadata_store.find_by_sha256(sha256)
+            # 移入冷存储后、删除热存储文件前崩溃时两边都有，保留热存储的
+            if entry is None or os.path.exists(blob_store.entry_path(entry)):
+                suspects.append(sha256)
+        if not suspects:
+            return
+        with blob_store.lock:
+            stale = []
+            for sha256 in suspects:
+                entry = metadata_store.find_by_sha256(sha256)
+                if entry is None or os.path.exists(blob_store.entry_path(entry)):
+                    stale.append(sha256)
+            cold_tier.remove(stale)
+        self.current['orphan_files'] += len(stale)
+        metrics.inc('c1yunpan_reconcile_fixed_total', len(stale), kind='orphan_cold')
+
+    def _count(self, item):
+        self.current['disk_files'] += 1
+        self.current['disk_usage'] += item.stat().st_size
+
+    def _remove_orphan(self, path):
+        hot_file_cache.invalidate(path)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.current['orphan_files'] += 1
+        self.current['orphan_bytes'] += size
+        metrics.inc('c1yunpan_reconcile_fixed_total', kind='orphan_file')
+
+    def _remove_missing(self, entry):
+        """内容文件已不存在，删除引用它的全部元数据"""
+        while entry is not None:
+            print(f"文件内容缺失，删除元数据: {entry['name']}")
+            blob_store.remove_entry(entry['name'])
+            self.current['missing_files'] += 1
+            metrics.inc('c1yunpan_reconcile_fixed_total', kind='missing_file')
+            entry = metadata_store.find_by_sha256(entry['sha256']) if entry.get('sha256') else None
+
+    def run(self):
+        # Linux 下只降低本线程的调度优先级
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            time.sleep(STORAGE_RECONCILE_INTERVAL / len(self.SHARDS))
+            try:
+                self.step()
+            except Exception as e:
+                print(f"存储对账出错: {str(e)}")
+                metrics.inc('c1yunpan_cleanup_errors_total')
+
+    def stats(self):
+        with self.lock:
+            last = dict(self.last)
+        last['progress'] = f"{self.position}/{len(self.SHARDS)}"
+        return last
+
+
+storage_manager = StorageManager()
+blob_store = BlobStore(BLOB_FOLDER)
+hot_file_cache = HotFileCache()
+cold_tier = ColdTier(COLD_FOLDER)
+tier_mover = TierMover()
+deletion_queue = DeletionQueue(DELETE_QUEUE_FILE)
+expiry_scheduler = ExpiryScheduler()
+storage_reconciler = StorageReconciler()
+
+
+def cleanup_task():
+    while True:
+        started = time.perf_counter()
+        try:
+            now = time.time()
+            # 清理长时间无活动的上传会话
+            upload_session_manager.purge_expired(now)
+
+            # 清理过期令牌
+            token_store.purge(now)
+
+            # 日志过长时压缩为快照，缩短重启回放时间
+            metadata_store.compact()
+
+        except Exception as e:
+            print(f"清理出错: {str(e)}")
+            metrics.inc('c1yunpan_cleanup_errors_total')
+        metrics.observe('c1yunpan_cleanup_duration_seconds', time.perf_counter() - started)
+        time.sleep(60)
+
+
+def guess_keys(token=None):
+    """
+    密码尝试的限流键：令牌 + 客户端 IP。
+    经本机 Nginx 转发的请求取 X-Real-IP；Streamlit 页面代用户发起的请求没有该头，只按令牌限流。
+    """
+    keys = [f"token:{token}"] if token else []
+    ip = request.remote_addr
+    if ip in ('127.0.0.1', '::1'):
+        ip = request.headers.get('X-Real-IP')
+    if ip:
+        keys.append(f"ip:{ip}")
+    return keys
+
+
+def guess_throttled(keys):
+    """失败尝试过多时返回 429 响应，在查找元数据和读文件之前调用"""
+    wait = guess_limiter.retry_after(keys)
+    if not wait:
+        return None
+    response = jsonify({"error": "尝试次数过多，请稍后再试"})
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response, 429
+
+
+# 删除接口
+@flask_app.route(f'{FLASK_BASE_PATH}/delete-file', methods=['POST'])
+@token_required
+def delete_file():
+    data = request.json
+    keys = guess_keys(g.token)
+    throttled = guess_throttled(keys)
+    if throttled:
+        return throttled
+
+    filename = data['filename']
+    received_hash_pass = data['password']
+
+    entry = metadata_store.get(filename)
+    valid = entry is not None and password_matches(entry['password'], received_hash_pass)
+
+    if valid:
+        # 元数据墓碑落盘后即返回，内容不再被引用时由后台删除文件
+        blob_store.remove_entry(filename, defer=True)
+    else:
+        # 密码错误或元数据不存在时不动磁盘文件，残留文件由后台对账清理
+        guess_limiter.consume(keys)
+
+    return jsonify({"message": "删除成功"})
+
+
+def batch_too_large(items):
+    """批量操作超过 MAX_BATCH_FILES 个文件时返回 413 响应，客户端应拆分成多批"""
+    if isinstance(items, list) and len(items) > MAX_BATCH_FILES:
+        return jsonify({"error": f"一次最多{MAX_BATCH_FILES}个文件，请分批操作"}), 413
+    return None
+
+
+def parse_batch_items(items):
+    """批量操作的 [{"filename", "password"}]，格式不合法或数量超出上限时返回 None；同名文件只保留一个"""
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_FILES:
+        return None
+    parsed = {}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('filename'), str):
+            return None
+        parsed[item['filename']] = item.get('password')
+    return parsed
+
+
+def verify_batch_items(items, keys):
+    """逐个校验密码，返回密码正确的元数据；失败尝试计入限流，达到上限后不再校验剩余的文件"""
+    entries = []
+    for filename, received_hash_pass in items.items():
+        if guess_limiter.retry_after(keys):
+            break
+        entry = metadata_store.get(filename)
+        if entry is not None and password_matches(entry['password'], received_hash_pass):
+            entries.append(entry)
+        else:
+            guess_limiter.consume(keys)
+    return entries
+
+
+# 批量删除：密码正确的文件一次提交元数据墓碑，返回实际删除的文件名
+@flask_app.route(f'{FLASK_BASE_PATH}/delete-batch', methods=['POST'])
+@token_required
+def delete_batch():
+    data = request.json
+    keys = guess_keys(g.token)
+    throttled = guess_throttled(keys)
+    if throttled:
+        return throttled
+
+    too_large = batch_too_large(data.get('items'))
+    if too_large:
+        return too_large
+    items = parse_batch_items(data.get('items'))
+    if items is None:
+        return jsonify({"error": f"请选择1~{MAX_BATCH_FILES}个文件"}), 400
+
+    entries = verify_batch_items(items, keys)
+    removed = blob_store.remove_entries([entry['name'] for entry in entries], defer=True)
+    return jsonify({"message": "删除成功", "deleted": [entry['name'] for entry in removed]})
+
+
+# 令牌验证接口
+@flask_app.route(f'{FLASK_BASE_PATH}/token', methods=['POST'])
+def generate_token():
+    keys = guess_keys()
+    throttled = guess_throttled(keys)
+    if throttled:
+        return throttled
+
+    password = request.json.get('password')
+    if not password_matches(LIST_PASSWORD_HASH, password):
+        guess_limiter.consume(keys)
+        return jsonify({"error": "密码错误"}), 401
+
+    return jsonify({"token": token_auth.issue()})
+
+
+# 当前令牌的过期时间（滑动续期后）与本进程处理过的请求数
+@flask_app.route(f'{FLASK_BASE_PATH}/token', methods=['GET'])
+@token_required
+def token_info():
+    return jsonify(token_auth.info(g.token))
+
+
+# 上传过期选项 -> 保存秒数（0 为永久）
+EXPIRE_OPTIONS = {
+    '10m': 600,
+    '30m': 1800,
+    '1d': 86400,
+    '3d': 259200,
+    '7d': 604800,
+    'forever': 0
+}
+
+
+class UploadError(Exception):
+    """上传过程中可预期的失败，携带返回给客户端的错误信息和状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class StreamingUpload:
+    """
+    流式接收一个上传文件：分块写入上传目录下的临时文件（按 STORAGE_CODEC 边写边压缩），边写边计算 sha256，
+    按到达的字节校验单文件上限，配额按预期大小一次预留或按 UPLOAD_RESERVE_SIZE 成块预留，完成后原子改名到 blob 目录。
+    """
+
+    def __init__(self, filename, expected_size=None):
+        self.filename = filename
+        fd, self.temp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix='.upload-', suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+        self.encoder = BlobEncoder(self.file)
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.reserved = 0
+        # 已知请求体大小时一次预留（含少量表单开销），配额不足时再退回按块预留
+        if expected_size and storage_manager.reserve(min(expected_size, MAX_FILE_SIZE)):
+            self.reserved = min(expected_size, MAX_FILE_SIZE)
+
+    def write(self, data):
+        self.size += len(data)
+        metrics.inc('c1yunpan_upload_bytes_total', len(data))
+        if self.size > MAX_FILE_SIZE:
+            raise UploadError("文件超过50MB限制")
+        if self.size > self.reserved:
+            self._reserve(self.size - self.reserved)
+        self.hasher.update(data)
+        self.encoder.write(data)
+
+    def _reserve(self, needed):
+        """预留一整块配额，剩余配额不足一块时只预留需要的部分"""
+        for amount in (min(max(needed, UPLOAD_RESERVE_SIZE), MAX_FILE_SIZE - self.reserved), needed):
+            if storage_manager.reserve(amount):
+                self.reserved += amount
+                return
+        raise UploadError("存储空间不足")
+
+    def finish(self, entry):
+        """关闭临时文件，补充内容大小与哈希，返回交给 blob_store.add_entries 的 (元数据, 临时文件, 编码)"""
+        encoding = self.encoder.finish()
+        self.file.close()
+        entry['size'] = self.size
+        entry['sha256'] = self.hasher.hexdigest()
+        temp_path, self.temp_path = self.temp_path, None
+        return entry, temp_path, encoding
+
+    def commit(self, entry):
+        """放入 blob 目录（内容已存在时丢弃）并登记元数据，密码被占用时返回 False"""
+        return blob_store.add_entry(*self.finish(entry))
+
+    def close(self):
+        """释放预留配额，删除未提交的临时文件"""
+        self.file.close()
+        if self.temp_path and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        storage_manager.release(self.reserved)
+        self.reserved = 0
+
+
+def iter_multipart(stream, boundary):
+    """按块读取 multipart 请求体并逐个产出事件，文件内容不会整体缓存在内存里"""
+    decoder = MultipartDecoder(boundary.encode())
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError:
+            raise UploadError("上传数据不完整")
+        if event is NEED_DATA:
+            decoder.receive_data(stream.read(UPLOAD_CHUNK_SIZE) or None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+
+def check_upload_fields(fields, filename):
+    """校验上传表单，返回 (文件名, 密码哈希, 过期时间)，不合法时抛出 UploadError"""
+    token = fields.get('token')
+    if not token_auth.validate(token):
+        raise UploadError("重新进入云盘列表", 401)
+
+    hashed_password = fields.get('password')
+    if not hashed_password:
+        raise UploadError("缺少密码")
+    # 校验密码唯一性；密码已被占用同样会泄露存在的密码，按失败尝试限流
+    keys = guess_keys(token)
+    if guess_limiter.retry_after(keys):
+        raise UploadError("尝试次数过多，请稍后再试", 429)
+    if metadata_store.find_by_password(hashed_password) is not None:
+        guess_limiter.consume(keys)
+        raise UploadError("密码处理失败，请更换其他密码")
+
+    expire_seconds = EXPIRE_OPTIONS.get(fields.get('expire'), -1)
+    if expire_seconds == -1:
+        raise UploadError("非法保存时间")
+    expire_time = time.time() + expire_seconds if expire_seconds else 0
+
+    raw_filename = secure_filename(filename)  # 自动过滤危险字符
+    if not raw_filename or raw_filename != filename:
+        raise UploadError("非法文件名")
+    return raw_filename, hashed_password, expire_time
+
+
+# 文件上传（流式接收，表单字段在文件之前到达时，接收文件内容前即完成校验）
+@flask_app.route(f'{FLASK_BASE_PATH}/upload', methods=['POST'])
+def upload_file():
+    # 请求体明显超过单文件上限时直接拒绝，不读取内容
+    if request.content_length and request.content_length > MAX_FILE_SIZE + MAX_FORM_FIELD_SIZE * 16:
+        return jsonify({"error": "文件超过50MB限制"}), 400
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({"error": "请使用multipart/form-data上传"}), 400
+
+    fields = {}
+    part = None  # 正在接收的部分：表单字段名或 'file'
+    value = bytearray()
+    upload = None
+    checked = None
+    try:
+        for event in iter_multipart(request.stream, boundary):
+            if isinstance(event, File):
+                part = None
+                if event.name == 'file' and upload is None:
+                    if {'token', 'password', 'expire'} <= fields.keys():
+                        checked = check_upload_fields(fields, event.filename)
+                    upload = StreamingUpload(event.filename, request.content_length)
+                    part = 'file'
+            elif isinstance(event, Field):
+                part, value = event.name, bytearray()
+            elif isinstance(event, Data) and part == 'file':
+                upload.write(event.data)
+                if not event.more_data:
+                    part = None
+            elif isinstance(event, Data) and part is not None:
+                value += event.data
+                if len(value) > MAX_FORM_FIELD_SIZE:
+                    raise UploadError("表单字段过长")
+                if not event.more_data:
+                    fields[part] = value.decode(errors='replace')
+                    part = None
+
+        if upload is None:
+            raise UploadError("未选择文件")
+        if checked is None:
+            checked = check_upload_fields(fields, upload.filename)
+        raw_filename, hashed_password, expire_time = checked
+
+        if not upload.commit({
+            "name": raw_filename,
+            "password": hashed_password,
+            "upload_time": time.time(),
+            "expire_time": expire_time
+        }):
+            # 并发上传抢占了同一密码
+            raise UploadError("密码处理失败，请更换其他密码")
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    finally:
+        # 元数据已提交（计入已用空间）或上传失败，释放预留配额
+        if upload is not None:
+            upload.close()
+
+    return jsonify({"message": "上传成功", "filename": raw_filename})
+
+
+# 批量上传：表单字段 token、expire，每个文件一个 password（按文件顺序对应），多个 file 部分逐个流式接收；
+# 全部接收并校验通过后内容一起放入 blob 目录、元数据一次提交，任一文件失败时全部不登记
+@flask_app.route(f'{FLASK_BASE_PATH}/upload-batch', methods=['POST'])
+def upload_batch():
+    if request.content_length and \
+            request.content_length > (MAX_FILE_SIZE + MAX_FORM_FIELD_SIZE * 16) * MAX_BATCH_FILES:
+        return jsonify({"error": "文件超过50MB限制"}), 400
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({"error": "请使用multipart/form-data上传"}), 400
+
+    fields = {}
+    passwords = []
+    part = None  # 正在接收的部分：表单字段名或 'file'
+    value = bytearray()
+    uploads = []
+    checked = []  # 已校验文件的 (文件名, 密码哈希, 过期时间)，与 uploads 顺序一致
+    try:
+        for event in iter_multipart(request.stream, boundary):
+            if isinstance(event, File):
+                part = None
+                if event.name == 'file':
+                    if len(uploads) >= MAX_BATCH_FILES:
+                        raise UploadError(f"一次最多上传{MAX_BATCH_FILES}个文件，请分批上传", 413)
+                    # 之前的文件都已校验且本文件的密码已到达时，接收内容前先校验
+                    if len(checked) == len(uploads) < len(passwords) and {'token', 'expire'} <= fields.keys():
+                        checked.append(check_upload_fields(
+                            dict(fields, password=passwords[len(uploads)]), event.filename))
+                    uploads.append(StreamingUpload(event.filename))
+                    part = 'file'
+            elif isinstance(event, Field):
+                part, value = event.name, bytearray()
+            elif isinstance(event, Data) and part == 'file':
+                uploads[-1].write(event.data)
+                if not event.more_data:
+                    part = None
+            elif isinstance(event, Data) and part is not None:
+                value += event.data
+                if len(value) > MAX_FORM_FIELD_SIZE:
+                    raise UploadError("表单字段过长")
+                if not event.more_data:
+                    if part == 'password':
+                        passwords.append(value.decode(errors='replace'))
+                    else:
+                        fields[part] = value.decode(errors='replace')
+                    part = None
+
+        if not uploads:
+            raise UploadError("未选择文件")
+        if len(passwords) != len(uploads):
+            raise UploadError("每个文件需要设置一个密码")
+        for i in range(len(checked), len(uploads)):
+            checked.append(check_upload_fields(dict(fields, password=passwords[i]), uploads[i].filename))
+        filenames = [raw_filename for raw_filename, _, _ in checked]
+        if len(set(filenames)) < len(filenames):
+            raise UploadError("文件名重复")
+        if len(set(passwords)) < len(passwords):
+            raise UploadError("密码处理失败，请更换其他密码")
+
+        upload_time = time.time()
+        if not blob_store.add_entries([
+            upload.finish({
+                "name": raw_filename,
+                "password": hashed_password,
+                "upload_time": upload_time,
+                "expire_time": expire_time
+            })
+            for upload, (raw_filename, hashed_password, expire_time) in zip(uploads, checked)
+        ]):
+            # 并发上传抢占了其中的密码
+            raise UploadError("密码处理失败，请更换其他密码")
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    finally:
+        for upload in uploads:
+            upload.close()
+
+    return jsonify({"message": "上传成功", "filenames": filenames})
+
+
+class UploadSessionManager:
+    """
+    断点续传上传会话，文件都放在 UPLOAD_SESSION_FOLDER 下：
+    - <id>.json   会话信息，创建后不再修改
+    - <id>.part   按文件大小预分配，各分块按偏移 pwrite，可多连接并发写入
+    - <id>.chunks 已接收分块记录（index:sha256），追加写，进程重启后可恢复进度
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.sessions = {}  # {session_id: info}
+        self.finalizing = set()
+
+    def load(self):
+        """载入磁盘上未完成的会话（create_app 中调用，只导入模块时不读会话也不预留配额）"""
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock:
+            for name in os.listdir(self.folder):
+                if name.endswith('.json') and name[:-len('.json')] not in self.sessions:
+                    self._load(name[:-len('.json')])
+
+    def _path(self, session_id, suffix):
+        return os.path.join(self.folder, session_id + suffix)
+
+    def _load(self, session_id, reserve=True):
+        try:
+            with open(self._path(session_id, '.json'), 'r') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 重启后重新预留配额，空间不足时会话仍可继续，提交时以实际用量为准
+        info['reserved'] = info['size'] if reserve and storage_manager.reserve(info['size']) else 0
+        info['updated'] = self._last_activity(session_id)
+        self.sessions[session_id] = info
+        return info
 
-# ================== Flask API部分 ==================
-flask_app = Flask(__name__)
+    def _last_activity(self, session_id):
+        """会话文件的最后修改时间，其它 worker 进程写入的分块也计入"""
+        mtimes = [0]
+        for suffix in ('.json', '.chunks'):
+            try:
+                mtimes.append(os.path.getmtime(self._path(session_id, suffix)))
+            except OSError:
+                pass
+        return max(mtimes)
 
+    def _forget_discarded(self):
+        """其它进程已提交或清理的会话：文件已删除，释放本进程为它保留的配额"""
+        with self.lock:
+            gone = [info for info in self.sessions.values()
+                    if info['id'] not in self.finalizing and not os.path.exists(self._path(info['id'], '.json'))]
+            for info in gone:
+                del self.sessions[info['id']]
+        for info in gone:
+            storage_manager.release(info['reserved'])
 
-class StorageManager:
-    def __init__(self):
-        self.lock = threading.Lock()
+    def create(self, filename, password, expire, size, chunk_size):
+        self._forget_discarded()
+        if not storage_manager.reserve(size):
+            raise UploadError("存储空间不足")
+        session_id = uuid.uuid4().hex
+        info = {
+            "id": session_id,
+            "filename": filename,
+            "password": password,
+            "expire": expire,
+            "size": size,
+            "chunk_size": chunk_size,
+            "chunk_count": max(1, -(-size // chunk_size))
+        }
+        fd = os.open(self._path(session_id, '.part'), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if size:
+                os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            # 不支持 posix_fallocate 的平台退化为稀疏文件
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+        temp_path = self._path(session_id, '.json.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(temp_path, self._path(session_id, '.json'))
 
-    def get_storage_usage(self):
-        total_size = 0
-        if not os.path.exists(METADATA_FILE):
-            return 0
-        with open(METADATA_FILE, 'r') as f:
-            for line in f:
-                if line.strip():
-                    parts = line.strip().split(':')
-                    total_size += int(parts[3])
-        return total_size
+        info['reserved'] = size
+        info['updated'] = time.time()
+        with self.lock:
+            self.sessions[session_id] = info
+        return info
 
-    def check_storage(self, file_size):
+    def get(self, session_id):
         with self.lock:
-            current_usage = self.get_storage_usage()
-            return (current_usage + file_size) <= CLOUD_DISK_MAX_STORAGE_SIZE
+            info = self.sessions.get(session_id)
+            if info is None and len(session_id) == 32 and all(c in '0123456789abcdef' for c in session_id):
+                # 会话可能由其它 worker 进程创建，配额已由创建方预留
+                info = self._load(session_id, reserve=False)
+            return info
 
+    def chunk_length(self, info, index):
+        return min(info['chunk_size'], info['size'] - index * info['chunk_size'])
 
-storage_manager = StorageManager()
+    def write_chunk(self, info, index, stream, expected_sha256=None):
+        """把请求体写到分块偏移处，返回分块 sha256；分块长度或校验和不符时抛出 UploadError"""
+        length = self.chunk_length(info, index)
+        offset = index * info['chunk_size']
+        hasher = hashlib.sha256()
+        written = 0
+        try:
+            fd = os.open(self._path(info['id'], '.part'), os.O_WRONLY)
+        except FileNotFoundError:
+            raise UploadError("上传会话不存在", 404)
+        try:
+            while written < length:
+                data = stream.read(min(UPLOAD_CHUNK_SIZE, length - written))
+                if not data:
+                    break
+                os.pwrite(fd, data, offset + written)
+                hasher.update(data)
+                written += len(data)
+            metrics.inc('c1yunpan_upload_bytes_total', written)
+            if written != length or stream.read(1):
+                raise UploadError("分块大小不符")
+            digest = hasher.hexdigest()
+            if expected_sha256 and expected_sha256.lower() != digest:
+                raise UploadError("分块校验失败")
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._record(info, f"{index}:{digest}\n")
+        return digest
 
+    def _record(self, info, line):
+        fd = os.open(self._path(info['id'], '.chunks'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+        info['updated'] = time.time()
 
-def cleanup_task():
-    while True:
+    def received(self, info):
+        """返回 {分块序号: sha256}，后写的记录覆盖先写的，'-' 表示该分块已作废"""
+        chunks = {}
+        path = self._path(info['id'], '.chunks')
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        continue
+                    index, digest = line.strip().split(':')
+                    if digest == '-':
+                        chunks.pop(int(index), None)
+                    else:
+                        chunks[int(index)] = digest
+        return chunks
+
+    def finalize(self, info, sha256=None):
+        """校验全部分块与整文件哈希，原子改名到 blob 目录并登记元数据"""
+        with self.lock:
+            if info['id'] in self.finalizing or info['id'] not in self.sessions:
+                raise UploadError("上传会话正在提交", 409)
+            self.finalizing.add(info['id'])
         try:
-            now = time.time()
-            new_lines = []
-            # 清理过期文件
-            if os.path.exists(METADATA_FILE):
-                with open(METADATA_FILE, 'r') as f:
-                    lines = f.readlines()
-
-                for line in lines:
-                    if line.strip():
-                        parts = line.strip().split(':')
-                        filename = parts[0]
-                        expire_time = float(parts[4])
-                        if expire_time != 0 and now > expire_time:
-                            filepath = os.path.join(UPLOAD_FOLDER, filename)
-                            if os.path.exists(filepath):
-                                os.remove(filepath)
-                        else:
-                            new_lines.append(line)
-
-                with open(METADATA_FILE, 'w') as f:
-                    f.writelines(new_lines)
+            chunks = self.received(info)
+            missing = [i for i in range(info['chunk_count']) if i not in chunks]
+            if missing:
+                raise UploadError(f"还有 {len(missing)} 个分块未上传")
 
-            # 清理过期令牌
-            global TOKENS
-            TOKENS = {k: v for k, v in TOKENS.items() if v > now}
+            part_path = self._path(info['id'], '.part')
+            encoded_path = self._path(info['id'], '.encoded')
+            hasher = hashlib.sha256()
+            corrupted = []
+            # 校验的同时按 STORAGE_CODEC 压缩到 .encoded，判断为不值得压缩时直接使用分块文件
+            encoded = open(encoded_path, 'wb') if STORAGE_CODEC else None
+            encoder = BlobEncoder(encoded) if encoded else None
+            try:
+                with open(part_path, 'rb') as f:
+                    for index in range(info['chunk_count']):
+                        data = f.read(info['chunk_size'])
+                        hasher.update(data)
+                        if hashlib.sha256(data).hexdigest() != chunks[index]:
+                            corrupted.append(index)
+                        if encoder is not None:
+                            encoder.write(data)
+                            if encoder.encoding == '':
+                                encoder = None
+                encoding = encoder.finish() if encoder is not None else ''
+            finally:
+                if encoded:
+                    encoded.close()
+            if encoded and (not encoding or corrupted):
+                os.remove(encoded_path)
+            if corrupted:
+                # 作废损坏的分块，客户端重传后可再次提交
+                self._record(info, ''.join(f"{index}:-\n" for index in corrupted))
+                raise UploadError(f"{len(corrupted)} 个分块校验失败，请重新上传")
+            digest = hasher.hexdigest()
+            if sha256 and sha256.lower() != digest:
+                raise UploadError("文件校验失败")
 
-        except Exception as e:
-            print(f"清理出错: {str(e)}")
-        time.sleep(60)
+            if metadata_store.find_by_password(info['password']) is not None:
+                raise UploadError("密码处理失败，请更换其他密码")
+            expire_seconds = EXPIRE_OPTIONS[info['expire']]
+            upload_time = time.time()
+            try:
+                added = blob_store.add_entry({
+                    "name": info['filename'],
+                    "password": info['password'],
+                    "upload_time": upload_time,
+                    "size": info['size'],
+                    "expire_time": upload_time + expire_seconds if expire_seconds else 0,
+                    "sha256": digest
+                }, encoded_path if encoding else part_path, encoding)
+            except UploadError:
+                # 空间不足时临时文件已被删除，没有压缩时删除的就是分块文件，会话无法再次提交
+                if not os.path.exists(part_path):
+                    self.discard(info)
+                raise
+            if not added:
+                # 分块文件已被移走，会话无法再次提交
+                self.discard(info)
+                raise UploadError("密码处理失败，请更换其他密码")
+            self.discard(info)
+            return digest
+        finally:
+            with self.lock:
+                self.finalizing.discard(info['id'])
+
+    def discard(self, info):
+        """删除会话文件并释放预留配额"""
+        with self.lock:
+            if self.sessions.pop(info['id'], None) is None:
+                return
+        for suffix in ('.part', '.encoded', '.chunks', '.json'):
+            path = self._path(info['id'], suffix)
+            if os.path.exists(path):
+                os.remove(path)
+        storage_manager.release(info['reserved'])
 
+    def purge_expired(self, now):
+        # 清理只在后台任务主进程运行，先载入其它 worker 进程创建的会话
+        with self.lock:
+            for name in os.listdir(self.folder):
+                if name.endswith('.json') and name[:-len('.json')] not in self.sessions:
+                    self._load(name[:-len('.json')], reserve=False)
+            expired = [info for info in self.sessions.values()
+                       if info['id'] not in self.finalizing and info['updated'] + UPLOAD_SESSION_TTL < now]
+        for info in expired:
+            # 以文件修改时间为准，其它 worker 进程可能仍在续传
+            if self._last_activity(info['id']) + UPLOAD_SESSION_TTL < now:
+                self.discard(info)
+            else:
+                info['updated'] = self._last_activity(info['id'])
 
-cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
-cleanup_thread.start()
 
+upload_session_manager = UploadSessionManager(UPLOAD_SESSION_FOLDER)
 
-# 删除接口
-@flask_app.route(f'{FLASK_BASE_PATH}/delete-file', methods=['POST'])
-def delete_file():
-    data = request.json
-    token = data['token']
 
-    if not token or TOKENS.get(token, 0) < time.time():
-        return jsonify({"error": "重新进入云盘列表"}), 401
+def sign_upload_challenge(sha256, size, offset, length, nonce, expires):
+    message = f"upload-proof\n{sha256}\n{size}\n{offset}\n{length}\n{nonce}\n{expires}"
+    return hmac.new(download_link_key(), message.encode(), hashlib.sha256).hexdigest()[:32]
 
-    filename = data['filename']
-    received_hash_pass = data['password']
 
-    valid = False
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            for line in f:
-                parts = line.strip().split(':')
-                if parts[0] == filename and parts[1] == received_hash_pass:
-                    valid = True
-                    break
+def new_upload_challenge(sha256, size):
+    """按声明的大小随机选取一段内容（限于开头 UPLOAD_PROOF_MAX_OFFSET 内），不读取已保存的内容，不论内容是否存在都返回挑战"""
+    length = min(size, UPLOAD_PROOF_SIZE)
+    offset = secrets.randbelow(min(size - length, UPLOAD_PROOF_MAX_OFFSET) + 1)
+    nonce = secrets.token_hex(16)
+    expires = int(time.time()) + UPLOAD_PROOF_TTL
+    return {"offset": offset, "length": length, "nonce": nonce, "expires": expires,
+            "signature": sign_upload_challenge(sha256, size, offset, length, nonce, expires)}
 
-    if valid:
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-
-        # 更新元数据
-        new_lines = []
-        if os.path.exists(METADATA_FILE):
-            with open(METADATA_FILE, 'r') as f:
-                for line in f:
-                    if line.strip() and line.strip().split(':')[0] != filename:
-                        new_lines.append(line)
-            with open(METADATA_FILE, 'w') as f:
-                f.writelines(new_lines)
-    else:
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
 
-    return jsonify({"message": "删除成功"})
+def read_content_range(entry, offset, length):
+    """读出已保存内容（热存储或冷存储）解压后的 [offset, offset + length)，内容不存在时返回 None"""
+    filepath = blob_store.entry_path(entry)
+    encoding = entry.get('encoding', '')
+    try:
+        f = open_decoded(filepath, encoding) if encoding else open(filepath, 'rb')
+    except FileNotFoundError:
+        try:
+            f = cold_tier.open(entry['sha256'])
+        except FileNotFoundError:
+            return None
+    with f:
+        f.seek(offset)
+        data = bytearray()
+        while len(data) < length:
+            chunk = f.read(length - len(data))
+            if not chunk:
+                break
+            data += chunk
+    return bytes(data)
 
 
-# 令牌验证接口
-@flask_app.route(f'{FLASK_BASE_PATH}/token', methods=['POST'])
-def generate_token():
-    password = request.json.get('password')
-    if password != LIST_PASSWORD_HASH:
-        return jsonify({"error": "密码错误"}), 401
+def verify_upload_proof(entry, sha256, size, challenge, proof):
+    """校验挑战签名与有效期，再按已保存的内容计算 sha256(随机数 + 内容片段) 与客户端的证明比较"""
+    try:
+        offset, length = int(challenge['offset']), int(challenge['length'])
+        nonce, expires = str(challenge['nonce']), int(challenge['expires'])
+        signature = str(challenge['signature'])
+    except (TypeError, KeyError, ValueError):
+        return False
+    expected = sign_upload_challenge(sha256, size, offset, length, nonce, expires)
+    if not hmac.compare_digest(signature, expected) or expires < time.time():
+        return False
+    if entry is None or entry['size'] != size:
+        return False
+    data = read_content_range(entry, offset, length)
+    if data is None:
+        return False
+    return hmac.compare_digest(str(proof), hashlib.sha256(nonce.encode() + data).hexdigest())
+
 
-    token = hashlib.sha256(str(uuid.uuid4()).encode()).hexdigest()
-    TOKENS[token] = time.time() + 600  # 10分钟有效期
-    return jsonify({"token": token})
+# 秒传：内容已存在时直接登记，不需要再上传文件。分两步，客户端需证明持有内容（只知道 sha256 不能引用别人的文件）：
+# 1. 提交 sha256 与 size，返回挑战 {offset, length, nonce, expires, signature}（不论内容是否存在）；
+# 2. 带上挑战与 proof = sha256(nonce + 内容[offset:offset + length]) 再次提交，校验通过才登记，
+#    否则与内容不存在一样返回 404，客户端改为上传文件内容
+@flask_app.route(f'{FLASK_BASE_PATH}/upload-by-hash', methods=['POST'])
+def upload_by_hash():
+    data = request.json
+    try:
+        raw_filename, hashed_password, expire_time = check_upload_fields(data, data.get('filename', ''))
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+
+    sha256 = str(data.get('sha256', '')).lower()
+    try:
+        size = int(data['size'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "参数错误"}), 400
+    if size < 0 or size > MAX_FILE_SIZE:
+        return jsonify({"error": "文件超过50MB限制"}), 400
+    challenge = data.get('challenge')
+    if not isinstance(challenge, dict):
+        return jsonify({"challenge": new_upload_challenge(sha256, size)})
 
+    # 证明要读取（可能解压）已保存的内容，失败按密码尝试限流；check_upload_fields 已拒绝超限的客户端
+    existing = metadata_store.find_by_sha256(sha256)
+    if not verify_upload_proof(existing, sha256, size, challenge, data.get('proof', '')):
+        guess_limiter.consume(guess_keys(data.get('token')))
+        return jsonify({"exists": False}), 404
+
+    added = blob_store.add_entry({
+        "name": raw_filename,
+        "password": hashed_password,
+        "upload_time": time.time(),
+        "size": existing['size'],
+        "expire_time": expire_time,
+        "sha256": sha256
+    })
+    if added is None:
+        return jsonify({"exists": False}), 404
+    if not added:
+        return jsonify({"error": "密码处理失败，请更换其他密码"}), 400
+    return jsonify({"exists": True, "message": "上传成功", "filename": raw_filename})
 
-# 文件上传
-@flask_app.route(f'{FLASK_BASE_PATH}/upload', methods=['POST'])
-def upload_file():
-    token = request.form['token']
-    if not token or TOKENS.get(token, 0) < time.time():
-        return jsonify({"error": "重新进入云盘列表"}), 401
 
-    file = request.files['file']
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
+# 断点续传：创建上传会话
+@flask_app.route(f'{FLASK_BASE_PATH}/upload-sessions', methods=['POST'])
+def create_upload_session():
+    data = request.json
+    try:
+        raw_filename, hashed_password, _ = check_upload_fields(data, data.get('filename', ''))
+        size = int(data['size'])
+        chunk_size = int(data.get('chunk_size', UPLOAD_SESSION_CHUNK_SIZE))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        # 字段缺失、为 null 或数组/对象，以及请求体不是 JSON 对象
+        return jsonify({"error": "参数错误"}), 400
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
 
-    if file_size > MAX_FILE_SIZE:
+    if size < 0 or size > MAX_FILE_SIZE:
         return jsonify({"error": "文件超过50MB限制"}), 400
+    if not MIN_UPLOAD_SESSION_CHUNK_SIZE <= chunk_size <= MAX_UPLOAD_SESSION_CHUNK_SIZE:
+        return jsonify({"error": "非法分块大小"}), 400
+
+    try:
+        info = upload_session_manager.create(raw_filename, hashed_password, data['expire'], size, chunk_size)
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    return jsonify({
+        "session_id": info['id'],
+        "chunk_size": info['chunk_size'],
+        "chunk_count": info['chunk_count']
+    })
 
-    if not storage_manager.check_storage(file_size):
-        return jsonify({"error": "存储空间不足"}), 400
-
-    hashed_password = request.form['password']
-    expire_option = request.form['expire']
-
-    # 校验密码唯一性
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            for line in f:
-                if line.strip().split(':')[1] == hashed_password:
-                    return jsonify({"error": "密码处理失败，请更换其他密码"}), 400
-
-    upload_time = time.time()
-    expire_map = {
-        '10m': 600,
-        '30m': 1800,
-        '1d': 86400,
-        '3d': 259200,
-        '7d': 604800,
-        'forever': 0
-    }
-    expire_seconds = expire_map.get(expire_option, -1)
-    if expire_seconds == -1:
-        return jsonify({"error": "非法保存时间"}), 400
 
-    expire_time = upload_time + expire_seconds if expire_seconds else 0
+# 断点续传：上传第 index 个分块（请求体为分块原始内容，可带 X-Chunk-Sha256 校验）
+@flask_app.route(f'{FLASK_BASE_PATH}/upload-sessions/<session_id>/chunks/<int:index>', methods=['PUT'])
+@token_required
+def upload_session_chunk(session_id, index):
+    info = upload_session_manager.get(session_id)
+    if info is None:
+        return jsonify({"error": "上传会话不存在"}), 404
+    if not 0 <= index < info['chunk_count']:
+        return jsonify({"error": "非法分块序号"}), 400
+    if request.content_length is not None and \
+            request.content_length != upload_session_manager.chunk_length(info, index):
+        return jsonify({"error": "分块大小不符"}), 400
 
-    raw_filename = secure_filename(file.filename)  # 自动过滤危险字符
-    if raw_filename != file.filename:
-        return jsonify({"error": "非法文件名"}), 400
+    try:
+        digest = upload_session_manager.write_chunk(
+            info, index, request.stream, request.headers.get('X-Chunk-Sha256'))
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    return jsonify({"index": index, "sha256": digest})
 
-    save_path = os.path.join(UPLOAD_FOLDER, raw_filename)
-    file.save(save_path)
 
-    metadata_line = f"{raw_filename}:{hashed_password}:{upload_time}:{file_size}:{expire_time}\n"
-    with open(METADATA_FILE, 'a') as f:
-        f.write(metadata_line)
+# 断点续传：查询已接收的分块
+@flask_app.route(f'{FLASK_BASE_PATH}/upload-sessions/<session_id>')
+@token_required
+def upload_session_status(session_id):
+    info = upload_session_manager.get(session_id)
+    if info is None:
+        return jsonify({"error": "上传会话不存在"}), 404
 
-    return jsonify({"message": "上传成功", "filename": raw_filename})
+    chunks = upload_session_manager.received(info)
+    # 把已接收分块合并为字节区间 [start, end)
+    ranges = []
+    for index in sorted(chunks):
+        start = index * info['chunk_size']
+        end = start + upload_session_manager.chunk_length(info, index)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return jsonify({
+        "session_id": info['id'],
+        "filename": info['filename'],
+        "size": info['size'],
+        "chunk_size": info['chunk_size'],
+        "chunk_count": info['chunk_count'],
+        "received_ranges": ranges,
+        "missing_chunks": [i for i in range(info['chunk_count']) if i not in chunks]
+    })
+
+
+# 断点续传：校验并提交
+@flask_app.route(f'{FLASK_BASE_PATH}/upload-sessions/<session_id>/finalize', methods=['POST'])
+@token_required
+def finalize_upload_session(session_id):
+    data = request.json
+    info = upload_session_manager.get(session_id)
+    if info is None:
+        return jsonify({"error": "上传会话不存在"}), 404
+    try:
+        digest = upload_session_manager.finalize(info, data.get('sha256'))
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    return jsonify({"message": "上传成功", "filename": info['filename'], "sha256": digest})
+
+
+# 断点续传：放弃上传会话
+@flask_app.route(f'{FLASK_BASE_PATH}/upload-sessions/<session_id>', methods=['DELETE'])
+@token_required
+def abort_upload_session(session_id):
+    info = upload_session_manager.get(session_id)
+    if info is None:
+        return jsonify({"error": "上传会话不存在"}), 404
+    upload_session_manager.discard(info)
+    return jsonify({"message": "已取消"})
 
 
 # 文件列表接口（分页）
+def parse_listing_args(args):
+    """解析文件列表查询参数，返回 (查询参数, 错误信息)"""
+    try:
+        page = max(1, int(args.get('page', 1)))
+        per_page = min(max(1, int(args.get('per_page', 10))), LISTING_MAX_PER_PAGE)
+    except ValueError:
+        return None, "无效的页码"
+    search = args.get('search', '')
+    # 默认按上传时间倒序
+    sort = args.get('sort', 'upload_time')
+    order = args.get('order', 'desc')
+    cursor = args.get('cursor')
+    if sort not in MetadataStore.SORT_KEYS or order not in ('asc', 'desc'):
+        return None, "不支持的排序方式"
+
+    after = None
+    if cursor:
+        # 游标翻页：cursor 为上一页返回的 next_cursor
+        try:
+            cursor_sort, key, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            valid_key = isinstance(key, str) if sort == 'name' else isinstance(key, (int, float))
+            if cursor_sort != sort or not isinstance(name, str) or not valid_key:
+                raise ValueError
+        except (ValueError, TypeError):
+            return None, "无效的游标"
+        after = (key, name)
+
+    # 列表内容只取决于元数据版本和查询参数
+    etag = hashlib.sha256(json.dumps(
+        [metadata_store.version(), search, sort, order, page, per_page, cursor]
+    ).encode()).hexdigest()[:32]
+    return {
+        "page": page,
+        "per_page": per_page,
+        "search": search,
+        "sort": sort,
+        "order": order,
+        "after": after,
+        "etag": etag
+    }, None
+
+
+def query_listing(params):
+    total, entries, last = metadata_store.query(
+        params['search'], params['sort'], params['order'] == 'desc',
+        (params['page'] - 1) * params['per_page'], params['per_page'], params['after']
+    )
+    next_cursor = None
+    if last is not None and len(entries) == params['per_page']:
+        next_cursor = base64.urlsafe_b64encode(json.dumps([params['sort'], *last]).encode()).decode()
+    files = [{
+        "name": entry['name'],
+        "size": entry['size'],
+        "upload_time": entry['upload_time'],
+        "expire_time": entry['expire_time']
+    } for entry in entries]
+
+    return {
+        "files": files,
+        "total": total,
+        "page": params['page'],
+        "per_page": params['per_page'],
+        "next_cursor": next_cursor
+    }
+
+
+def storage_status():
+    file_count = metadata_store.usage()[1]
+    return {
+        "max_storage": CLOUD_DISK_MAX_STORAGE_SIZE,
+        "used_storage": storage_manager.get_storage_usage(),
+        "file_count": file_count,
+        "expiry": expiry_scheduler.stats(),
+        "delete_queue": deletion_queue.stats(),
+        "reconcile": storage_reconciler.stats(),
+        "hot_cache": hot_file_cache.stats(),
+        "tiers": tier_mover.stats(),
+        "background": background_jobs.stats()
+    }
+
+
 @flask_app.route(f'{FLASK_BASE_PATH}/files')
+@token_required
 def list_files():
-    token = request.args.get('token')
-    if not token or TOKENS.get(token, 0) < time.time():
-        return jsonify({"error": "重新进入云盘列表"}), 401
+    params, error = parse_listing_args(request.args)
+    if error:
+        return jsonify({"error": error}), 400
 
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 10))
-    search = request.args.get('search', '')
+    # 列表未变化时返回 304
+    if request.if_none_match.contains(params['etag']):
+        return Response(status=304, headers={'ETag': quote_etag(params['etag']), 'Cache-Control': 'private, no-cache'})
 
-    files = []
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            lines = sorted(f.readlines(),
-                           key=lambda x: -float(x.split(':')[2]))  # 按上传时间倒序
+    response = jsonify(query_listing(params))
+    response.headers['ETag'] = quote_etag(params['etag'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-            for line in lines:
-                parts = line.strip().split(':')
-                filename = parts[0]
-                if search.lower() in filename.lower():
-                    files.append({
-                        "name": filename,
-                        "size": int(parts[3]),
-                        "upload_time": float(parts[2]),
-                        "expire_time": float(parts[4])
-                    })
-
-    total = len(files)
-    start = (page - 1) * per_page
-    end = start + per_page
+
+# 网盘状态 + 文件列表合并为一次请求（Streamlit 页面使用）
+@flask_app.route(f'{FLASK_BASE_PATH}/overview')
+@token_required
+def overview():
+    params, error = parse_listing_args(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # 文件列表未变化（If-None-Match 命中 listing_etag）时 listing 为 null，客户端沿用上次结果
+    not_modified = request.if_none_match.contains(params['etag'])
     return jsonify({
-        "files": files[start:end],
-        "total": total,
-        "page": page,
-        "per_page": per_page
+        "status": storage_status(),
+        "listing": None if not_modified else query_listing(params),
+        "listing_etag": quote_etag(params['etag'])
     })
 
 
+def file_etag(entry, stat):
+    """优先用存储的内容哈希作为 ETag，没有哈希的旧数据用 mtime 和大小"""
+    if entry and entry.get('sha256'):
+        return entry['sha256'][:32]
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def plan_file_response(file_size, etag, last_modified, request_headers, allow_ranges=True):
+    """
+    处理条件请求（If-None-Match/If-Modified-Since）与 Range 请求（支持单区间和多区间），
+    返回 (状态码, 响应头, 响应体片段)。片段为 bytes（multipart 分隔内容）或 (起始偏移, 长度)。
+    """
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': 'private, no-cache'
+    }
+
+    # 条件请求：If-None-Match 优先，缺省时才看 If-Modified-Since
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match:
+        if parse_etags(if_none_match).contains_weak(etag):
+            return 304, headers, []
+    else:
+        since = parse_date(request_headers.get('If-Modified-Since'))
+        if since is not None and int(last_modified) <= since.timestamp():
+            return 304, headers, []
+
+    ranges = None
+    range_header = request_headers.get('Range')
+    if allow_ranges and range_header:
+        # If-Range 不匹配时忽略 Range，返回完整文件
+        if_range = parse_if_range_header(request_headers.get('If-Range'))
+        if (if_range.etag is None or if_range.etag == etag) and \
+                (if_range.date is None or int(last_modified) <= if_range.date.timestamp()):
+            parsed = parse_range_header(range_header)
+            if parsed is not None and parsed.units == 'bytes' and len(parsed.ranges) <= MAX_DOWNLOAD_RANGES:
+                ranges = []
+                for start, stop in parsed.ranges:
+                    if start < 0:
+                        start, stop = max(0, file_size + start), file_size
+                    else:
+                        stop = file_size if stop is None else min(stop, file_size)
+                    if start < stop:
+                        ranges.append((start, stop - start))
+
+    if ranges is None:
+        headers['Content-Length'] = str(file_size)
+        return 200, headers, [(0, file_size)]
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{file_size}'
+        headers['Content-Length'] = '0'
+        return 416, headers, []
+
+    if len(ranges) == 1:
+        start, length = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{start + length - 1}/{file_size}'
+        headers['Content-Length'] = str(length)
+        return 206, headers, ranges
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, length in ranges:
+        parts.append((f'\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\n'
+                      f'Content-Range: bytes {start}-{start + length - 1}/{file_size}\r\n\r\n').encode())
+        parts.append((start, length))
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    headers['Content-Length'] = str(sum(len(p) if isinstance(p, bytes) else p[1] for p in parts))
+    return 206, headers, parts
+
+
+def iter_file_parts(filepath, parts):
+    with open_sequential(filepath) as f:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, length = part
+            f.seek(start)
+            while length > 0:
+                chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+
+
+def iter_cached_parts(data, parts):
+    """从缓存的内容（bytes 或 mmap）切片发送，不再打开和读取文件"""
+    for part in parts:
+        if isinstance(part, bytes):
+            yield part
+            continue
+        start, length = part
+        for offset in range(start, start + length, DOWNLOAD_CHUNK_SIZE):
+            yield data[offset:min(offset + DOWNLOAD_CHUNK_SIZE, start + length)]
+
+
+def iter_stream_parts(open_stream, parts, f=None):
+    """从只能顺序读取的文件对象（解压流）发送各片段；区间靠前时调用 open_stream 重新打开，从头读取"""
+    f = f or open_stream()
+    try:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, length = part
+            if start < f.tell():
+                f.close()
+                f = open_stream()
+            f.seek(start)
+            while length > 0:
+                chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+    finally:
+        f.close()
+
+
+def iter_decoded_parts(filepath, encoding, parts, data=None):
+    """边读边解压发送，片段偏移是解压后的偏移。data 为缓存在内存中的压缩内容"""
+    source = lambda: filepath if data is None else io.BytesIO(data)
+    return iter_stream_parts(lambda: open_decoded(source(), encoding), parts)
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """客户端的 Accept-Encoding 是否接受该编码（没有该请求头时只按原始内容发送）"""
+    return parse_accept_header(accept_encoding)[encoding] > 0
+
+
+def send_stored_file(filepath, download_name, entry=None, headers=None):
+    """
+    按 DOWNLOAD_BACKEND 发送已存储的文件（支持 Range、ETag 与条件请求）：
+    - stream：Python 生成器逐块读取发送
+    - sendfile：交给 WSGI 服务器的 wsgi.file_wrapper（gunicorn 会使用 os.sendfile 零拷贝）
+    - x-accel：只返回 X-Accel-Redirect 头，由 Nginx 直接发送文件，立即释放 worker
+    压缩保存的文件在客户端接受该编码时带 Content-Encoding 原样发送，否则边读边解压。
+    热点文件从 hot_file_cache 发送（sendfile 方式的大文件整体下载仍交给 file_wrapper 零拷贝）。
+    """
+    encoding = entry.get('encoding', '') if entry else ''
+    # x-accel 方式的 Range 由 Nginx 处理；Nginx 不会为 X-Accel-Redirect 的文件加 Content-Encoding，压缩文件改用 sendfile
+    x_accel = DOWNLOAD_BACKEND == 'x-accel' and not encoding
+    hot = None if x_accel else hot_file_cache.get(filepath)
+    try:
+        stat = hot.stat if hot else os.stat(filepath)
+    except FileNotFoundError:
+        # 已移入冷存储
+        if entry and cold_tier.get(entry.get('sha256')) is not None:
+            return send_cold_file(entry, download_name, headers)
+        return jsonify({"error": "文件不存在"}), 404
+    size, etag = stat.st_size, file_etag(entry, stat)
+    decode = False
+    extra_headers = {}
+    if encoding:
+        extra_headers['Vary'] = 'Accept-Encoding'
+        if accepts_encoding(request.headers.get('Accept-Encoding'), encoding):
+            # 压缩表示与原始内容的字节不同，使用不同的 ETag
+            etag = f"{etag}-{encoding}"
+            extra_headers['Content-Encoding'] = encoding
+        else:
+            size, decode = entry['size'], True
+    status, plan_headers, parts = plan_file_response(
+        size, etag, stat.st_mtime, request.headers, allow_ranges=not x_accel)
+    headers = {'Content-Disposition': f'attachment; filename="{download_name}"',
+               **plan_headers, **extra_headers, **(headers or {})}
+
+    if status != 200 and status != 206:
+        return Response(status=status, headers=headers)
+
+    if entry:
+        tier_mover.record_access([entry], 'hot')
+    # 大文件的整体下载交给 file_wrapper（sendfile 零拷贝），比从 mmap 复制发送更省
+    cached = hot is not None and (not hot.mapped or DOWNLOAD_BACKEND == 'stream' or status == 206)
+    # 计划发送的字节数（客户端中途断开时实际发送量会更少）
+    backend = 'decode' if decode else 'cache' if cached else DOWNLOAD_BACKEND
+    metrics.inc('c1yunpan_download_bytes_total', int(headers['Content-Length']), backend=backend)
+    if decode:
+        data = hot.data if hot and not hot.mapped else None
+        return Response(iter_decoded_parts(filepath, encoding, parts, data), status=status, headers=headers,
+                        direct_passthrough=True)
+
+    if cached:
+        return Response(iter_cached_parts(hot.data, parts), status=status, headers=headers,
+                        direct_passthrough=True)
+
+    if x_accel:
+        relative_path = os.path.relpath(filepath, NGINX_ACCEL_ROOT)
+        headers['X-Accel-Redirect'] = NGINX_ACCEL_PREFIX + quote(relative_path)
+        del headers['Content-Length']
+        return Response(headers=headers)
+
+    if DOWNLOAD_BACKEND != 'stream' and status == 200:
+        file_wrapper = request.environ.get('wsgi.file_wrapper', FileWrapper)
+        body = file_wrapper(open_sequential(filepath), DOWNLOAD_CHUNK_SIZE)
+        return Response(body, status=status, headers=headers, direct_passthrough=True)
+
+    return Response(iter_file_parts(filepath, parts), status=status, headers=headers, direct_passthrough=True)
+
+
+def send_cold_file(entry, download_name, headers=None):
+    """从冷存储的打包文件边解压边发送（支持 Range 与条件请求），多次下载后由后台线程取回热存储"""
+    sha256 = entry['sha256']
+    try:
+        f = cold_tier.open(sha256)
+    except FileNotFoundError:
+        return jsonify({"error": "文件不存在"}), 404
+    status, plan_headers, parts = plan_file_response(
+        entry['size'], file_etag(entry, None), entry['upload_time'], request.headers)
+    headers = {'Content-Disposition': f'attachment; filename="{download_name}"', **plan_headers, **(headers or {})}
+    if status != 200 and status != 206:
+        f.close()
+        return Response(status=status, headers=headers)
+
+    tier_mover.record_access([entry], 'cold')
+    metrics.inc('c1yunpan_download_bytes_total', int(headers['Content-Length']), backend='cold')
+    return Response(iter_stream_parts(lambda: cold_tier.open(sha256), parts, f), status=status, headers=headers,
+                    direct_passthrough=True)
+
+
+class ZipSink:
+    """zipfile 的写入目标：不可 seek（zipfile 因此在每个文件后写数据描述符），写入的数据由生成器随时取走发送"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_zip(entries, files):
+    """
+    边读边打包：文件逐块写入 ZIP 并立即发送，不生成临时文件，内存只占用一块。
+    上传时判断为值得压缩（压缩保存）的内容用 deflate，其余原样存储；生成结束或客户端断开时关闭全部文件。
+    """
+    sink = ZipSink()
+    try:
+        with zipfile.ZipFile(sink, 'w') as archive:
+            for entry, f in zip(entries, files):
+                info = zipfile.ZipInfo(entry['name'], time.localtime(entry['upload_time'])[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED if entry.get('encoding') else zipfile.ZIP_STORED
+                # 预先给出大小，zipfile 据此决定不需要 ZIP64 扩展
+                info.file_size = entry['size']
+                with archive.open(info, 'w') as dest:
+                    while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+                        dest.write(chunk)
+                        yield sink.take()
+                yield sink.take()
+        yield sink.take()
+    finally:
+        for f in files:
+            f.close()
+
+
+def send_zip(entries):
+    """多个文件打包为 ZIP 流式下载；先打开全部文件，打包过程中文件被删除也能完整读出"""
+    files = []
+    tiers = {'hot': [], 'cold': []}
+    try:
+        for entry in entries:
+            filepath = blob_store.entry_path(entry)
+            encoding = entry.get('encoding', '')
+            try:
+                files.append(open_decoded(filepath, encoding) if encoding else open_sequential(filepath))
+                tiers['hot'].append(entry)
+            except FileNotFoundError:
+                files.append(cold_tier.open(entry.get('sha256')))
+                tiers['cold'].append(entry)
+    except FileNotFoundError:
+        for f in files:
+            f.close()
+        return jsonify({"error": "文件不存在"}), 404
+
+    for tier, tier_entries in tiers.items():
+        tier_mover.record_access(tier_entries, tier)
+
+    metrics.inc('c1yunpan_download_bytes_total', sum(entry['size'] for entry in entries), backend='zip')
+    download_name = f"c1yunpan-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    headers = {'Content-Disposition': f'attachment; filename="{download_name}"',
+               'Cache-Control': 'private, no-cache'}
+    return Response(iter_zip(entries, files), mimetype='application/zip', headers=headers,
+                    direct_passthrough=True)
+
+
+# 打包下载：items 为 [{"filename", "password"}]，全部密码正确时返回即时生成的 ZIP
+@flask_app.route(f'{FLASK_BASE_PATH}/download-zip', methods=['POST'])
+@token_required
+def download_zip():
+    data = request.json
+    keys = guess_keys(g.token)
+    throttled = guess_throttled(keys)
+    if throttled:
+        return throttled
+
+    too_large = batch_too_large(data.get('items'))
+    if too_large:
+        return too_large
+    items = parse_batch_items(data.get('items'))
+    if items is None:
+        return jsonify({"error": f"请选择1~{MAX_BATCH_FILES}个文件"}), 400
+
+    entries = verify_batch_items(items, keys)
+    if len(entries) != len(items):
+        return jsonify({"error": "密码错误"}), 401
+    return send_zip(entries)
+
+
 # 密码直接下载接口
 @flask_app.route(f'{FLASK_BASE_PATH}/download-by-pass', methods=['POST'])
+@token_required
 def download_by_password():
     data = request.json
-    token = data.get('token')
-    if not token or TOKENS.get(token, 0) < time.time():
-        return jsonify({"error": "重新进入云盘列表"}), 401
+    keys = guess_keys(g.token)
+    throttled = guess_throttled(keys)
+    if throttled:
+        return throttled
 
     hashed_pass = data.get('password')
 
-    target_file = None
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            for line in f:
-                parts = line.strip().split(':')
-                if parts[1] == hashed_pass:
-                    target_file = parts[0]
-                    break
+    # 密码哈希索引 O(1) 定位，再常量时间确认
+    entry = metadata_store.find_by_password(hashed_pass) if isinstance(hashed_pass, str) else None
+    target_file = entry['name'] if entry and password_matches(entry['password'], hashed_pass) else None
 
     if not target_file:
+        guess_limiter.consume(keys)
         return jsonify({"error": "文件不存在1"}), 404
 
-    filepath = os.path.join(UPLOAD_FOLDER, target_file)
-    if not os.path.exists(filepath):
+    filepath = blob_store.entry_path(entry)
+    if filepath not in hot_file_cache and not os.path.exists(filepath) and cold_tier.get(entry.get('sha256')) is None:
         return jsonify({"error": "文件不存在2"}), 404
 
-    def generate():
-        with open(filepath, 'rb') as f:
-            while chunk := f.read(4096):
-                yield chunk
-
-    return Response(
-        generate(),
-        headers={
-            'Content-Disposition': f'attachment; filename="{target_file}"',
-            'x-c1-filename': target_file,
-        },
-        mimetype='application/octet-stream'
-    )
+    return send_stored_file(filepath, target_file, entry, {'x-c1-filename': target_file})
 
 
 # 文件下载
 @flask_app.route(f'{FLASK_BASE_PATH}/download/<filename>')
+@token_required
 def download_file(filename):
-    token = request.args.get('token')
-    if not token or TOKENS.get(token, 0) < time.time():
-        return jsonify({"error": "重新进入云盘列表"}), 401
+    keys = guess_keys(g.token)
+    throttled = guess_throttled(keys)
+    if throttled:
+        return throttled
 
     received_hash_pass = request.args.get('password')
     filepath = os.path.join(UPLOAD_FOLDER, filename)
@@ -309,318 +4091,307 @@ def download_file(filename):
     if not os.path.realpath(filepath).startswith(os.path.realpath(UPLOAD_FOLDER)):
         return jsonify({"error": "非法文件"}), 403
 
-    if not os.path.exists(filepath):
+    # 先在内存中校验密码，通过后才访问磁盘
+    entry = metadata_store.get(filename)
+    if entry is None or not password_matches(entry['password'], received_hash_pass):
+        guess_limiter.consume(keys)
+        return jsonify({"error": "密码错误"}), 401
+
+    filepath = blob_store.entry_path(entry)
+    if filepath not in hot_file_cache and not os.path.exists(filepath) and cold_tier.get(entry.get('sha256')) is None:
         return jsonify({"error": "文件不存在"}), 404
 
-    valid = False
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            for line in f:
-                parts = line.strip().split(':')
-                if parts[0] == filename and parts[1] == received_hash_pass:
-                    valid = True
-                    break
+    return send_stored_file(filepath, filename, entry)
 
-    if valid:
-        def generate():
-            with open(filepath, 'rb') as f:
-                while chunk := f.read(4096):
-                    yield chunk
-
-        return Response(
-            generate(),
-            headers={'Content-Disposition': f'attachment; filename="{filename}"'},
-            mimetype='application/octet-stream'
-        )
+
+def load_link_key(path):
+    """读取下载直链签名密钥，不存在时生成；先写临时文件再硬链接，多个 worker 进程只会有一个生成成功"""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def sign_download_link(entries, expires):
+    """签名包含各文件的文件名、密码哈希和过期时间，文件被删除后以同名重新上传时旧链接失效"""
+    message = ''.join(f"{entry['name']}\n{entry['password']}\n" for entry in entries) + str(expires)
+    return hmac.new(download_link_key(), message.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+_download_link_key = None
+
+
+def download_link_key():
+    """签名密钥在第一次使用时读取（create_app 中调用），只导入模块时不生成密钥文件"""
+    global _download_link_key
+    if _download_link_key is None:
+        _download_link_key = load_link_key(DOWNLOAD_LINK_KEY_FILE)
+    return _download_link_key
+
+
+# 生成下载直链：校验密码后返回带签名的短期链接，浏览器直接从 API 下载，不经过 Streamlit 进程
+@flask_app.route(f'{FLASK_BASE_PATH}/download-link', methods=['POST'])
+@token_required
+def create_download_link():
+    data = request.json
+    keys = guess_keys(g.token)
+    throttled = guess_throttled(keys)
+    if throttled:
+        return throttled
+
+    # 指定多个文件时生成打包下载链接
+    if 'items' in data:
+        too_large = batch_too_large(data['items'])
+        if too_large:
+            return too_large
+        items = parse_batch_items(data['items'])
+        if items is None:
+            return jsonify({"error": f"请选择1~{MAX_BATCH_FILES}个文件"}), 400
+        entries = verify_batch_items(items, keys)
+        if len(entries) != len(items):
+            return jsonify({"error": "密码错误"}), 401
+        expires = int(time.time()) + DOWNLOAD_LINK_TTL
+        filenames = [entry['name'] for entry in entries]
+        url = (f"{DOWNLOAD_LINK_BASE or FLASK_BASE_PATH}/dl-zip?files={quote(','.join(filenames))}"
+               f"&expires={expires}&signature={sign_download_link(entries, expires)}")
+        return jsonify({"url": url, "filenames": filenames, "size": sum(entry['size'] for entry in entries),
+                        "expires": expires})
+
+    # 指定文件名时校验该文件的密码，否则按密码查找文件
+    hashed_pass = data.get('password')
+    filename = data.get('filename')
+    if filename:
+        entry = metadata_store.get(filename)
     else:
-        return jsonify({"error": "密码错误"}), 401
+        entry = metadata_store.find_by_password(hashed_pass) if isinstance(hashed_pass, str) else None
+    if entry is None or not password_matches(entry['password'], hashed_pass):
+        guess_limiter.consume(keys)
+        return jsonify({"error": "密码错误" if filename else "文件不存在"}), 401 if filename else 404
+
+    expires = int(time.time()) + DOWNLOAD_LINK_TTL
+    url = (f"{DOWNLOAD_LINK_BASE or FLASK_BASE_PATH}/dl/{quote(entry['name'])}"
+           f"?expires={expires}&signature={sign_download_link([entry], expires)}")
+    return jsonify({"url": url, "filename": entry['name'], "size": entry['size'], "expires": expires})
+
+
+# 签名直链下载（不需要令牌，支持 Range/ETag）
+@flask_app.route(f'{FLASK_BASE_PATH}/dl/<filename>')
+def download_by_link(filename):
+    expires = request.args.get('expires', '')
+    signature = request.args.get('signature', '')
+    if not expires.isdigit() or int(expires) < time.time():
+        return jsonify({"error": "链接已过期"}), 403
+
+    entry = metadata_store.get(filename)
+    if entry is None or not hmac.compare_digest(sign_download_link([entry], int(expires)), signature):
+        return jsonify({"error": "链接无效"}), 403
+
+    filepath = blob_store.entry_path(entry)
+    if filepath not in hot_file_cache and not os.path.exists(filepath) and cold_tier.get(entry.get('sha256')) is None:
+        return jsonify({"error": "文件不存在"}), 404
+    return send_stored_file(filepath, filename, entry)
+
+
+# 签名打包下载链接（不需要令牌）
+@flask_app.route(f'{FLASK_BASE_PATH}/dl-zip')
+def download_zip_by_link():
+    expires = request.args.get('expires', '')
+    signature = request.args.get('signature', '')
+    if not expires.isdigit() or int(expires) < time.time():
+        return jsonify({"error": "链接已过期"}), 403
+
+    filenames = request.args.get('files', '').split(',')
+    entries = [metadata_store.get(filename) for filename in filenames[:MAX_BATCH_FILES]]
+    if None in entries or len(filenames) > MAX_BATCH_FILES or \
+            not hmac.compare_digest(sign_download_link(entries, int(expires)), signature):
+        return jsonify({"error": "链接无效"}), 403
+    return send_zip(entries)
 
 
 @flask_app.route(f'{FLASK_BASE_PATH}/status')
+@token_required
 def system_status():
-    token = request.args.get('token')
-    if not token or TOKENS.get(token, 0) < time.time():
-        return jsonify({"error": "重新进入云盘列表"}), 401
+    return jsonify(storage_status())
 
-    usage = storage_manager.get_storage_usage()
-    return jsonify({
-        "max_storage": CLOUD_DISK_MAX_STORAGE_SIZE,
-        "used_storage": usage,
-        "file_count": len(os.listdir(UPLOAD_FOLDER)) if os.path.exists(UPLOAD_FOLDER) else 0
-    })
 
+@flask_app.route(f'{FLASK_BASE_PATH}/metrics')
+def export_metrics():
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                                 f"Bearer {METRICS_TOKEN}".encode()):
+        return jsonify({"error": "无权访问"}), 401
 
-# ================== Streamlit UI部分 ==================
-def format_time(seconds):
-    if seconds == 0:
-        return "永久"
-    periods = [('天', 86400), ('小时', 3600), ('分钟', 60)]
-    result = []
-    for name, sec in periods:
-        if seconds >= sec:
-            val, seconds = divmod(seconds, sec)
-            result.append(f"{int(val)}{name}")
-    return ' '.join(result) if result else "不足1分钟"
+    now = time.time()
+    usage, file_count = storage_manager.get_storage_usage(), metadata_store.usage()[1]
+    expiry = expiry_scheduler.stats()
+    delete_queue = deletion_queue.stats()
+    cold = cold_tier.stats()
+    gauges = [
+        ('c1yunpan_process_start_time_seconds', metrics.started),
+        ('c1yunpan_storage_max_bytes', CLOUD_DISK_MAX_STORAGE_SIZE),
+        ('c1yunpan_storage_used_bytes', usage),
+        ('c1yunpan_storage_reserved_bytes', storage_manager.reserved),
+        ('c1yunpan_files', file_count),
+        ('c1yunpan_metadata_journal_bytes', metadata_store.journal_size()),
+        ('c1yunpan_active_tokens', token_store.count(now)),
+        ('c1yunpan_upload_sessions', len(upload_session_manager.sessions)),
+        ('c1yunpan_expiry_scheduled', expiry['scheduled']),
+        ('c1yunpan_expiry_backlog', expiry['backlog']),
+        ('c1yunpan_expiry_max_lag_seconds', expiry['max_lag_seconds']),
+        ('c1yunpan_delete_queue_pending', delete_queue['pending']),
+        ('c1yunpan_delete_queue_failed', delete_queue['failed']),
+        ('c1yunpan_hot_cache_bytes', hot_file_cache.bytes),
+        ('c1yunpan_hot_cache_mapped_files', len(hot_file_cache.mapped)),
+        ('c1yunpan_cold_tier_files', cold['files']),
+        ('c1yunpan_cold_tier_packed_bytes', cold['packed_bytes']),
+        ('c1yunpan_cold_tier_pack_bytes', cold['pack_bytes']),
+        ('c1yunpan_background_leader', int(background_jobs.leader))
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 
-def format_file_size(size_in_bytes):
+# ================== 后台任务与启动入口 ==================
+class BackgroundJobs:
     """
-    将文件大小从字节转换为 KB、MB 或 GB 的格式，并以最小的单位显示。
-    :param size_in_bytes: 文件大小（以字节为单位）
-    :return: 格式化后的文件大小字符串
+    后台任务选主：每个提供 API 的进程启动一个选主线程，阻塞等待 BACKGROUND_LOCK_FILE 的 fcntl 排它锁，
+    抢到锁的进程运行清理、过期、删除、对账与冷热分层线程，其余进程只处理请求；
+    主进程退出时锁由内核释放，等待中的进程接替，不会出现两个进程同时运行后台任务。
     """
-    units = ['B', 'KB', 'MB', 'GB']
-    size = size_in_bytes  # 初始大小单位是 Bytes
-    unit_index = 0  # 初始单位是 Bytes
 
-    # 逐步转换单位，直到文件大小小于 1000
-    while size >= 1024 and unit_index < len(units) - 1:
-        size /= 1024
-        unit_index += 1
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.lock = threading.Lock()
+        self.started = False
+        self.leader = False
+        self.elected_at = None
+        self.fd = None
+
+    def start(self):
+        """可重复调用，每个进程只启动一次"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        # 慢请求采样分析每个进程各自运行
+        if slow_request_profiler:
+            threading.Thread(target=slow_request_profiler.run, daemon=True).start()
+        threading.Thread(target=self._elect, daemon=True).start()
 
-    # 格式化输出，保留两位小数
-    return f"{size:.2f}{units[unit_index]}"
+    def _elect(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        self.fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        # 锁文件内容记录当前主进程 pid，便于排查
+        os.ftruncate(self.fd, 0)
+        os.pwrite(self.fd, f"{os.getpid()}\n".encode(), 0)
+        self.leader = True
+        self.elected_at = time.time()
+        for target in (cleanup_task, expiry_scheduler.run, deletion_queue.run, storage_reconciler.run, tier_mover.run):
+            threading.Thread(target=target, daemon=True).start()
 
+    def leader_pid(self):
+        try:
+            with open(self.lock_path, 'r') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
 
-def streamlit_ui():
-    # 初始化会话状态
-    if 'token' not in st.session_state:
-        st.session_state.token = None
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "leader": self.leader,
+            "leader_pid": os.getpid() if self.leader else self.leader_pid(),
+            "elected_at": self.elected_at
+        }
 
-    st.set_page_config(
-        page_title="C1云盘",
-        page_icon="📁",
-        layout="centered" if st.session_state.token == None else "wide"
-    )
 
-    st.header("C1云盘")
+background_jobs = BackgroundJobs(BACKGROUND_LOCK_FILE)
 
-    # 密码验证模块
-    if not st.session_state.token:
-        list_pass = st.text_input("🔑 输入云盘查看密码", type="password")
-        if list_pass:
-            try:
-                pass_hash = hashlib.sha256(f'salt_pass_{list_pass}'.encode()).hexdigest()
-                response = requests.post(
-                    f"{FLASK_CLOUD_PATH}/token",
-                    json={"password": pass_hash}
-                )
-                if response.status_code == 200:
-                    st.session_state.token = response.json()['token']
-                    st.rerun()
-                else:
-                    st.error("密码错误")
-            except Exception as e:
-                st.error("服务不可用")
-        return
 
-    # 系统状态
+def create_app():
+    """
+    WSGI 应用工厂：gunicorn -w 4 --threads 8 'app:create_app()'。
+    先创建数据目录和下载直链密钥，迁移旧元数据并载入元数据索引（第一个请求不承担回放耗时）和未完成的上传会话，
+    再启动本进程的后台任务选主；只导入 app 模块（Streamlit 页面读取配置、迁移脚本）没有任何副作用：
+    不创建目录和文件、不加文件锁，也不启动任何后台线程。
+    """
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(os.path.dirname(METADATA_LOG), exist_ok=True)
+    download_link_key()
+    migrate_legacy_metadata(metadata_store)
+    metadata_store.usage()
+    upload_session_manager.load()
+    background_jobs.start()
+    return flask_app
+
+
+# ================== 启动入口 ==================
+def run_api(workers, threads):
+    """gunicorn 多进程运行 API；未安装 gunicorn 时退化为单进程的 Flask 开发服务器"""
     try:
-        status = requests.get(f"{FLASK_CLOUD_PATH}/status", params={"token": st.session_state.token}).json()
-        used_storage = status['used_storage']
-        max_storage = status['max_storage']
-        used_size_str = format_file_size(used_storage)
-        max_size_str = format_file_size(max_storage)
-        st.progress(used_storage / max_storage,
-                    f"存储使用： {used_size_str} / {max_size_str}，文件总数：{status['file_count']}")
-    except Exception as e:
-        st.error('云盘状态获取失败')
-
-    # 主界面功能
-    # 快速下载模块
-    with st.expander("⬇️ 输入密码直接下载", expanded=True):
-        dl_password = st.text_input("输入下载密码（4位数字）", max_chars=4, key="direct_download_text_input")
-        if st.button("立即下载"):
-            if len(dl_password) != 4 or not dl_password.isdigit():
-                st.error("需4位数字")
-            else:
-                try:
-                    pass_hash = hashlib.sha256(dl_password.encode()).hexdigest()
-                    response = requests.post(
-                        f"{FLASK_CLOUD_PATH}/download-by-pass",
-                        json={"password": pass_hash, "token": st.session_state.token},
-                        stream=True
-                    )
-                    if response.status_code == 200:
-                        st.download_button(
-                            "保存文件",
-                            data=response.content,
-                            file_name=f'{response.headers["x-c1-filename"]}',
-                            key="direct_download"
-                        )
-                    else:
-                        st.error(response.json().get("error"))
-                except Exception as e:
-                    st.error(f"下载失败")
-
-    # 上传模块
-    with st.expander("⬆️ 文件共享", expanded=False):
-        if "file_uploader_counter" not in st.session_state:
-            st.session_state.file_uploader_counter = 0
-        if "upload_pass_counter" not in st.session_state:
-            st.session_state.upload_pass_counter = 0
-        if "expire_option_counter" not in st.session_state:
-            st.session_state.expire_option_counter = 0
-
-        uploaded_file = st.file_uploader(
-            "选择文件（最大50MB）",
-            accept_multiple_files=False,
-            key=f"file_uploader_{st.session_state.file_uploader_counter}"
-        )
-        expire_option = st.selectbox(
-            "保存时间",
-            options=[('10分钟', '10m'), ('30分钟', '30m'), ('1天', '1d'),
-                     ('3天', '3d'), ('7天', '7d'), ('永久', 'forever')],
-            format_func=lambda x: x[0],
-            key=f"expire_option_{st.session_state.expire_option_counter}"
-        )
-        file_pass = st.text_input("🔢 设置4位数字密码", max_chars=4,
-                                  key=f"upload_pass_{st.session_state.upload_pass_counter}")
-
-        if st.button("上传") and uploaded_file:
-            if len(file_pass) != 4 or not file_pass.isdigit():
-                st.error("密码必须为4位数字")
-            else:
-                hashed_pass = hashlib.sha256(file_pass.encode()).hexdigest()
-                try:
-                    response = requests.post(
-                        f"{FLASK_CLOUD_PATH}/upload",
-                        files={"file": (uploaded_file.name, uploaded_file)},
-                        data={"password": hashed_pass, "expire": expire_option[1], "token": st.session_state.token}
-                    )
-                    if response.status_code == 200:
-                        st.success("上传成功")
-                        st.session_state.file_uploader_counter += 1
-                        st.session_state.upload_pass_counter += 1
-                        st.session_state.expire_option_counter += 1
-                        st.rerun()
+        from gunicorn.app.wsgiapp import WSGIApplication
+    except ImportError:
+        print("未安装 gunicorn（pip install gunicorn），使用 Flask 开发服务器运行 API")
+        create_app().run(host='0.0.0.0', port=FLASK_APP_PORT, threaded=True)
+        return
+    # 不使用 --preload：每个 worker 各自导入 app 并调用 create_app，选主锁与文件描述符不跨 fork 共享
+    sys.argv = [
+        "gunicorn", "-w", str(workers), "--threads", str(threads),
+        "-b", f"0.0.0.0:{FLASK_APP_PORT}",
+        "--pythonpath", os.path.dirname(os.path.abspath(__file__)),
+        "app:create_app()"
+    ]
+    WSGIApplication("%(prog)s [OPTIONS] [APP_MODULE]").run()
 
-                    else:
-                        st.error(response.json().get("error"))
-                except Exception as e:
-                    st.error(f"上传失败")
 
-    st.subheader('文件列表')
-    # 文件列表展示（分页+搜索）
-    search_key = st.text_input("🔍 搜索文件名")
-    col1, col2 = st.columns(2)
-    page = col1.number_input("页码", min_value=1, value=1)
-    per_page = col2.selectbox("每页数量", [10, 20, 50], index=0)
+def run_ui():
+    """以 streamlit 命令行运行 ui.py（页面通过 HTTP 调用 API，不在本进程提供 API）"""
+    from streamlit.web.cli import main as streamlit_main
 
-    try:
-        response = requests.get(
-            f"{FLASK_CLOUD_PATH}/files",
-            params={
-                "token": st.session_state.token,
-                "page": page,
-                "per_page": per_page,
-                "search": search_key
-            }
-        )
-        if response.status_code == 200:
-            data = response.json()
-            st.write(f"共 {data['total']} 个文件（输入\"下载密码\"，点击\"下载\"按钮开始下载文件）")
-
-            for file in data['files']:
-                metadata = {
-                    "name": file['name'],
-                    "upload_time": datetime.fromtimestamp(
-                        float(file['upload_time'])).strftime('%Y-%m-%d %H:%M'),
-                    "expire_time": float(file['expire_time']),
-                    "size": f"{file['size']}"
-                }
-                remain_sec = metadata.get('expire_time', 0) - time.time()
-                file_is_not_expired = remain_sec > 0
-                remain_time = format_time(int(remain_sec)) if file_is_not_expired else "已过期"
-
-                cols = st.columns([3, 1, 2, 2, 2, 1, 1], vertical_alignment="center")
-                cols[0].markdown(f"**{metadata['name']}**")
-                cols[1].markdown(f"{format_file_size(float(metadata.get('size', '0')))}")
-                cols[2].markdown(f"{remain_time}后过期" if file_is_not_expired else f"{remain_time}")
-                cols[3].markdown(f"于{metadata.get('upload_time', '-')}共享")
-
-                if file_is_not_expired:
-                    download_pass = cols[4].text_input(
-                        '🔑 下载密码',
-                        label_visibility="collapsed",
-                        placeholder="🔑 下载密码",
-                        key=f"pass_{metadata["name"]}",
-                        max_chars=4
-                    )
-                    if cols[5].button("⬇️ 下载", key=f"btn_{metadata["name"]}") and download_pass is not None:
-                        if len(download_pass) != 4 or not download_pass.isdigit():
-                            cols[5].error("需4位数字")
-                        else:
-                            hashed_dl = hashlib.sha256(download_pass.encode()).hexdigest()
-                        try:
-                            response = requests.get(
-                                f"{FLASK_CLOUD_PATH}/download/{metadata["name"]}",
-                                params={"password": hashed_dl, "token": st.session_state.token},
-                                stream=True
-                            )
-                            if response.status_code == 200:
-                                cols[5].download_button(
-                                    "保存",
-                                    data=response.content,
-                                    file_name=metadata["name"],
-                                    key=f"dl_{metadata["name"]}"
-                                )
-                            else:
-                                st.error(response.json().get("error"))
-                        except Exception as e:
-                            st.error(f"下载失败")
-
-                    # 删除按钮
-                    if cols[6].button("🗑️ 删除", key=f"del_{metadata["name"]}") and download_pass is not None:
-                        if len(download_pass) != 4 or not download_pass.isdigit():
-                            cols[6].error("需4位数字")
-                        else:
-                            hashed_dl = hashlib.sha256(download_pass.encode()).hexdigest()
-                            try:
-                                response = requests.post(
-                                    f"{FLASK_CLOUD_PATH}/delete-file",
-                                    json={
-                                        "token": st.session_state.token,
-                                        "filename": metadata["name"],
-                                        "password": hashed_dl
-                                    }
-                                )
-                                if response.status_code == 200:
-                                    st.rerun()
-                                else:
-                                    st.error("删除失败")
-                            except Exception as e:
-                                st.error(f"服务不可用")
-                else:
-                    cols[4].markdown('-')
-                    cols[5].markdown('不可下载')
-                    cols[6].markdown('不可删除')
+    sys.argv = [
+        "streamlit", "run", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui.py"),
+        f"--server.port={STREAMLIT_APP_PORT}",
+        f"--server.baseUrlPath={STREAMLIT_BASE_PATH}",
+        "--server.headless=true"
+    ]
+    streamlit_main()
 
-    except Exception as e:
-        st.error('服务连接错误')
 
+def main():
+    parser = argparse.ArgumentParser(description='C1云盘')
+    parser.add_argument('command', nargs='?', choices=['all', 'api', 'ui'], default='all',
+                        help='all：API 子进程 + Streamlit 页面（默认）；api：只运行 API；ui：只运行页面')
+    parser.add_argument('--workers', type=int, default=API_WORKERS, help='API worker 进程数')
+    parser.add_argument('--threads', type=int, default=API_THREADS, help='每个 worker 的线程数')
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    if args.command == 'api':
+        run_api(args.workers, args.threads)
+    elif args.command == 'ui':
+        run_ui()
+    else:
+        api_process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'api',
+                                        '--workers', str(args.workers), '--threads', str(args.threads)])
+        try:
+            run_ui()
+        finally:
+            api_process.terminate()
+            api_process.wait()
 
-    flask_thread = threading.Thread(
-        target=lambda: flask_app.run(host='0.0.0.0', port=FLASK_APP_PORT, threaded=True)
-    )
-    flask_thread.daemon = True
-    flask_thread.start()
 
-    if st.runtime.exists():
-        # streamlit命令行启动直接运行
+if __name__ == "__main__":
+    if 'streamlit' in sys.modules and sys.modules['streamlit'].runtime.exists():
+        # streamlit run app.py 启动：只运行页面，API 需另外启动
+        from ui import streamlit_ui
+
         streamlit_ui()
     else:
-        # 非streamlit命令行启动以代码命令形式启动
-        from streamlit.web.cli import main
-        import sys
-
-        sys.argv = [
-            "streamlit", "run", __file__,
-            f"--server.port={STREAMLIT_APP_PORT}",
-            f"--server.baseUrlPath={STREAMLIT_BASE_PATH}",
-            "--server.headless=true"
-        ]
         main()
@@ -0,0 +1,181 @@
+"""
+API 的 asyncio（ASGI）运行方式，适合大量慢速客户端同时下载：
+
+    pip install uvicorn
+    python asgi.py --port 5001        # 或 uvicorn asgi:app --port 5001
+
+路由、鉴权与响应完全复用 app.py 中的 Flask 应用：视图函数在线程池中执行（只在处理请求、读取每一块文件时占用线程），
+响应体由事件循环逐块发送，等待客户端接收数据时不占用线程，单进程即可同时保持数千个下载连接。
+"""
+import argparse
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app, DOWNLOAD_CHUNK_SIZE, FLASK_APP_PORT
+
+# 执行视图函数与读取文件块的线程数
+ASGI_THREADS = 64
+# 整文件下载每次读取发送的块大小（每个连接的发送缓冲最多占用约一块，连接数多时不宜过大）
+ASGI_SEND_CHUNK_SIZE = 64 * 1024
+
+
+class RequestBody(io.RawIOBase):
+    """WSGI 的 wsgi.input：视图线程读取请求体时，从事件循环按需取回 ASGI 消息"""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = b''
+        self.more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer and self.more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                # 客户端已断开，按请求体提前结束处理
+                self.more_body = False
+                break
+            self.buffer = message.get('body', b'')
+            self.more_body = message.get('more_body', False)
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+class FileBody:
+    """wsgi.file_wrapper：文件由事件循环分块读取发送，不在视图线程中迭代"""
+
+    def __init__(self, file, block_size=DOWNLOAD_CHUNK_SIZE):
+        self.file = file
+        self.block_size = block_size
+
+    def __iter__(self):
+        while chunk := self.file.read(self.block_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+def build_environ(scope, body):
+    """按 PEP 3333 把 ASGI 的 HTTP scope 转成 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileBody,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsgiApp:
+    """把 WSGI 应用包装为 ASGI 应用：请求在线程池中处理，响应体在事件循环中发送"""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        environ = build_environ(scope, RequestBody(receive, loop))
+        body = await loop.run_in_executor(self.executor, self.wsgi_app, environ, start_response)
+        # 视图已经读完请求体，之后 receive 只会收到断开通知，客户端断开时停止发送
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            if isinstance(body, FileBody):
+                read = lambda: body.file.read(min(body.block_size, ASGI_SEND_CHUNK_SIZE)) or None
+            else:
+                chunks = iter(body)
+                read = lambda: next(chunks, None)
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': response['headers']})
+            while not disconnected.done():
+                chunk = await loop.run_in_executor(self.executor, read)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            if hasattr(body, 'close'):
+                await loop.run_in_executor(self.executor, body.close)
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+
+app = AsgiApp(create_app())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='C1云盘 API（asyncio/ASGI 方式运行）')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=FLASK_APP_PORT)
+    args = parser.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("需要先安装 uvicorn：pip install uvicorn")
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
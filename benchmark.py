@@ -0,0 +1,700 @@
+"""
+C1云盘性能基准测试
+
+在临时目录中启动独立的 API 服务进程（werkzeug 或 gunicorn），通过 HTTP 压测并统计服务端 CPU 开销：
+
+    python benchmark.py download --size-mb 50 --rounds 5 --server gunicorn
+
+按元数据规模压测各接口（Flask test client 进程内调用，或本地 gunicorn），结果保存为 JSON 便于版本间对比：
+
+    python benchmark.py api --entries 1000 100000 --client test gunicorn --output new.json
+    python benchmark.py compare old.json new.json
+
+大量慢速客户端同时下载时，对比多线程（werkzeug/gunicorn）与 asyncio（asgi.py + uvicorn）方式：
+
+    python benchmark.py slow-clients --clients 1000 --rate-kb 32 --duration 20
+"""
+import argparse
+import asyncio
+import hashlib
+import http.client
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+LIST_PASSWORD_HASH = hashlib.sha256('salt_pass_imfun'.encode()).hexdigest()
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+# 下载方式对比：stream-4k 为改造前的 4096 字节生成器。热点缓存只在 stream+cache 中开启，
+# 否则多轮下载后 stream 方式改由内存/mmap 缓存发送，测不到生成器本身，与 sendfile/x-accel 的对比也失真
+DOWNLOAD_MODES = {
+    'stream-4k': {'DOWNLOAD_BACKEND': 'stream', 'DOWNLOAD_CHUNK_SIZE': 4096, 'HOT_CACHE_BYTES': 0},
+    'stream': {'DOWNLOAD_BACKEND': 'stream', 'HOT_CACHE_BYTES': 0},
+    'stream+cache': {'DOWNLOAD_BACKEND': 'stream'},
+    'sendfile': {'DOWNLOAD_BACKEND': 'sendfile', 'HOT_CACHE_BYTES': 0},
+    'x-accel': {'DOWNLOAD_BACKEND': 'x-accel', 'HOT_CACHE_BYTES': 0},
+}
+
+
+# ================== 服务进程 ==================
+def load_app(settings):
+    """导入 app 模块、覆盖全局配置并创建应用"""
+    sys.path.insert(0, REPO_DIR)
+    import app
+
+    for key, value in settings.items():
+        setattr(app, key, value)
+    return app.create_app()
+
+
+def serve(args):
+    """在当前目录下启动 API 服务，--set 中的 JSON 用于覆盖 app 模块的全局配置"""
+    settings = json.loads(args.set)
+    if args.server == 'gunicorn':
+        from gunicorn.app.base import BaseApplication
+
+        class BenchApplication(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', f'127.0.0.1:{args.port}')
+                self.cfg.set('workers', args.workers)
+                self.cfg.set('threads', args.threads)
+                self.cfg.set('loglevel', 'warning')
+
+            def load(self):
+                # 在 worker 进程中导入 app，master 不打开任何存储，与 gunicorn 'app:create_app()' 的部署方式一致
+                return load_app(settings)
+
+        BenchApplication().run()
+    elif args.server == 'asgi':
+        sys.path.insert(0, REPO_DIR)
+        import asgi
+        import uvicorn
+
+        uvicorn.run(asgi.AsgiApp(load_app(settings), args.threads), host='127.0.0.1', port=args.port,
+                    log_level='warning', backlog=4096)
+    else:
+        load_app(settings).run(host='127.0.0.1', port=args.port, threaded=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, server, settings, workers=1, threads=8):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--server', server, '--port', str(port),
+         '--workers', str(workers), '--threads', str(threads), '--set', json.dumps(settings)],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError('服务启动超时')
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def process_tree(pid):
+    """进程及其所有子进程（gunicorn worker）的 pid 列表"""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                parents[int(name)] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except OSError:
+            continue
+    tree = []
+    for child in parents:
+        node = child
+        while node and node != pid:
+            node = parents.get(node)
+        if node == pid:
+            tree.append(child)
+    return tree
+
+
+def process_tree_cpu(pid):
+    """进程及其所有子进程累计的 CPU 秒数"""
+    total = 0.0
+    for child in process_tree(pid):
+        try:
+            with open(f'/proc/{child}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        total += (int(fields[11]) + int(fields[12])) / CLK_TCK
+    return total
+
+
+def process_tree_usage(pid):
+    """进程树的 CPU 秒数、常驻内存（MB）与实际磁盘读写字节数（/proc/<pid>/io）"""
+    usage = {"cpu_s": process_tree_cpu(pid), "rss_mb": 0.0, "read_bytes": 0, "write_bytes": 0}
+    for child in process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        usage['rss_mb'] += int(line.split()[1]) / 1024
+            with open(f'/proc/{child}/io') as f:
+                for line in f:
+                    key, value = line.split(':')
+                    if key in ('read_bytes', 'write_bytes'):
+                        usage[key] += int(value)
+        except OSError:
+            continue
+    return usage
+
+
+def process_tree_threads(pid):
+    """进程树的线程总数"""
+    total = 0
+    for child in process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+def api(port):
+    return f'http://127.0.0.1:{port}/c1yunpan/api'
+
+
+def get_token(port):
+    return requests.post(f'{api(port)}/token', json={'password': LIST_PASSWORD_HASH}).json()['token']
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# ================== 下载方式对比 ==================
+def fetch(port, path):
+    """下载并丢弃响应体，返回 (状态码, 字节数, 响应头)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', path)
+    response = conn.getresponse()
+    size = 0
+    while chunk := response.read(1024 * 1024):
+        size += len(chunk)
+    conn.close()
+    return response.status, size, dict(response.getheaders())
+
+
+def bench_download(args):
+    workdir = tempfile.mkdtemp(prefix='c1bench-')
+    os.makedirs(os.path.join(workdir, 'cloud_disk', 'uploads'))
+    size = int(args.size_mb * 1024 * 1024)
+    password = hashlib.sha256(b'0000').hexdigest()
+    results = {}
+
+    for mode in args.modes:
+        proc, port = start_server(workdir, args.server, DOWNLOAD_MODES[mode], threads=args.threads)
+        try:
+            token = get_token(port)
+            if not results:
+                response = requests.post(
+                    f'{api(port)}/upload',
+                    files={'file': ('bench.bin', os.urandom(size))},
+                    data={'password': password, 'expire': 'forever', 'token': token}
+                )
+                response.raise_for_status()
+            path = f'/c1yunpan/api/download/bench.bin?token={token}&password={password}'
+
+            latencies = []
+            transferred = 0
+            cpu_before = process_tree_cpu(proc.pid)
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                t0 = time.perf_counter()
+                status, received, headers = fetch(port, path)
+                latencies.append(time.perf_counter() - t0)
+                assert status == 200, status
+                assert mode != 'x-accel' or 'X-Accel-Redirect' in headers
+                transferred += received
+            elapsed = time.perf_counter() - started
+            cpu = process_tree_cpu(proc.pid) - cpu_before
+        finally:
+            stop_server(proc)
+
+        # x-accel 模式下文件由 Nginx 发送，这里只统计 worker 处理请求的开销
+        gigabytes = size * args.rounds / 1024 ** 3
+        results[mode] = {
+            "rounds": args.rounds,
+            "bytes": transferred,
+            "seconds": round(elapsed, 4),
+            "throughput_mb_s": round(transferred / 1024 ** 2 / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "server_cpu_s": round(cpu, 4),
+            "server_cpu_s_per_gb": round(cpu / gigabytes, 4)
+        }
+        print(f"{mode:>12}: {results[mode]['throughput_mb_s']:>9} MB/s  "
+              f"p50 {results[mode]['p50_ms']:>8} ms  CPU {results[mode]['server_cpu_s_per_gb']:>8} s/GB")
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# ================== 接口压测 ==================
+API_ENDPOINTS = ['status', 'files', 'files-search', 'download', 'download-by-pass', 'upload', 'delete-file']
+# 压测时放开存储配额，合成的元数据不受空间限制；合成的元数据大多没有文件内容，关闭后台对账
+# 合成的元数据上传时间按条数往前推（100 万条约 11 天前），关闭冷热分层，下载压测的是热存储而不是冷存储解压
+API_SETTINGS = {'CLOUD_DISK_MAX_STORAGE_SIZE': 1 << 50, 'STORAGE_RECONCILE_INTERVAL': 1 << 40, 'TIER_COLD_AFTER': 0}
+
+
+def synthesize_store(workdir, entries, blob_files, blob_size):
+    """
+    在 workdir/cloud_disk 下按元数据日志格式直接写入 entries 条记录，前 blob_files 条有真实的 blob 文件。
+    返回压测样本：有文件内容的 [(文件名, 密码哈希)] 与可删除的 [(文件名, 密码哈希)]。
+    """
+    root = os.path.join(workdir, 'cloud_disk')
+    os.makedirs(os.path.join(root, 'uploads'), exist_ok=True)
+    now = time.time()
+    rng = random.Random(entries)
+    readable, deletable = [], []
+    with open(os.path.join(root, 'metadata.log'), 'w') as log:
+        for i in range(entries):
+            name = f"bench_{i:07d}.bin"
+            password = hashlib.sha256(f"bench-{i}".encode()).hexdigest()
+            if i < blob_files:
+                data = os.urandom(blob_size)
+                sha256 = hashlib.sha256(data).hexdigest()
+                blob_dir = os.path.join(root, 'blobs', sha256[:2], sha256[2:4])
+                os.makedirs(blob_dir, exist_ok=True)
+                with open(os.path.join(blob_dir, sha256), 'wb') as f:
+                    f.write(data)
+                size = blob_size
+                readable.append((name, password))
+            else:
+                sha256 = hashlib.sha256(name.encode()).hexdigest()
+                size = rng.randint(1, 10 * 1024 * 1024)
+                deletable.append((name, password))
+            entry = {
+                "name": name,
+                "password": password,
+                "upload_time": now - entries + i,
+                "size": size,
+                "expire_time": rng.choice([0, now + 30 * 86400 + i]),
+                "sha256": sha256
+            }
+            log.write(json.dumps({"op": "put", "entry": entry}, separators=(',', ':')) + '\n')
+    return readable, deletable
+
+
+def api_request(endpoint, i, token, samples, upload_size):
+    """第 i 次请求的描述 (方法, 路径, 查询参数, JSON, 表单, 上传文件)"""
+    readable, deletable = samples
+    base = '/c1yunpan/api'
+    if endpoint == 'status':
+        return 'GET', f'{base}/status', {'token': token}, None, None, None
+    if endpoint == 'files':
+        return 'GET', f'{base}/files', {'token': token, 'page': i % 50 + 1, 'per_page': 20}, None, None, None
+    if endpoint == 'files-search':
+        # 不同的搜索词，避开查询缓存
+        return 'GET', f'{base}/files', {'token': token, 'search': f"_{i % 1000:03d}", 'per_page': 20}, None, None, None
+    if endpoint == 'download':
+        name, password = readable[i % len(readable)]
+        return 'GET', f'{base}/download/{name}', {'token': token, 'password': password}, None, None, None
+    if endpoint == 'download-by-pass':
+        _, password = readable[i % len(readable)]
+        return 'POST', f'{base}/download-by-pass', None, {'token': token, 'password': password}, None, None
+    if endpoint == 'upload':
+        password = hashlib.sha256(f"upload-{i}-{time.time()}".encode()).hexdigest()
+        form = {'token': token, 'password': password, 'expire': 'forever'}
+        return 'POST', f'{base}/upload', None, None, form, (f"upload_{i}_{os.getpid()}.bin", os.urandom(upload_size))
+    if endpoint == 'delete-file':
+        name, password = deletable[-1 - i]
+        return 'POST', f'{base}/delete-file', None, {'token': token, 'filename': name, 'password': password}, None, None
+    raise ValueError(endpoint)
+
+
+class TestClientDriver:
+    """进程内通过 Flask test client 调用，每个线程一个 client"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.local = threading.local()
+
+    def send(self, method, path, query, json_body, form, upload):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.flask_app.test_client()
+        if upload is not None:
+            form = dict(form, file=(io.BytesIO(upload[1]), upload[0]))
+        response = client.open(path, method=method, query_string=query, json=json_body, data=form)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+
+class HttpDriver:
+    """通过 HTTP 调用本地服务，每个线程一个 keep-alive 会话"""
+
+    def __init__(self, port):
+        self.base_url = f'http://127.0.0.1:{port}'
+        self.local = threading.local()
+
+    def send(self, method, path, query, json_body, form, upload):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        files = {'file': upload} if upload is not None else None
+        response = session.request(method, self.base_url + path, params=query, json=json_body,
+                                   data=form, files=files)
+        return response.status_code, len(response.content)
+
+
+def run_endpoints(driver, usage_pid, token, samples, args):
+    """按顺序压测各接口，返回 {接口: 指标}"""
+    results = {}
+    for endpoint in args.endpoints:
+        count = args.requests
+        if endpoint == 'delete-file':
+            count = min(count, len(samples[1]))
+        if endpoint in ('download', 'download-by-pass') and not samples[0]:
+            continue
+        specs = [api_request(endpoint, i, token, samples, args.upload_size) for i in range(count)]
+
+        def timed(spec):
+            t0 = time.perf_counter()
+            status, size = driver.send(*spec)
+            return time.perf_counter() - t0, status, size
+
+        before = process_tree_usage(usage_pid)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            outcomes = list(pool.map(timed, specs))
+        elapsed = time.perf_counter() - started
+        after = process_tree_usage(usage_pid)
+
+        latencies = [o[0] for o in outcomes]
+        results[endpoint] = {
+            "requests": count,
+            "errors": sum(1 for o in outcomes if o[1] >= 400),
+            "throughput_rps": round(count / elapsed, 2) if elapsed else 0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "response_bytes": sum(o[2] for o in outcomes),
+            "cpu_s": round(after['cpu_s'] - before['cpu_s'], 4),
+            "rss_mb": round(after['rss_mb'], 1),
+            "disk_read_bytes": after['read_bytes'] - before['read_bytes'],
+            "disk_write_bytes": after['write_bytes'] - before['write_bytes']
+        }
+        r = results[endpoint]
+        print(f"  {endpoint:>16}: {r['throughput_rps']:>9} req/s  p50 {r['p50_ms']:>9} ms  "
+              f"p99 {r['p99_ms']:>9} ms  RSS {r['rss_mb']:>7} MB  errors {r['errors']}")
+    return results
+
+
+def api_test_client(args):
+    """（内部使用）在当前目录下导入 app，用 test client 压测，结果写入 --result"""
+    with open(args.spec) as f:
+        spec = json.load(f)
+    started = time.perf_counter()
+    sys.path.insert(0, REPO_DIR)
+    import app
+
+    for key, value in API_SETTINGS.items():
+        setattr(app, key, value)
+    flask_app = app.create_app()
+    startup = time.perf_counter() - started
+    driver = TestClientDriver(flask_app)
+    token = driver.flask_app.test_client().post(
+        '/c1yunpan/api/token', json={'password': LIST_PASSWORD_HASH}).get_json()['token']
+    samples = (spec['readable'], spec['deletable'])
+    result = {
+        "startup_seconds": round(startup, 3),
+        "rss_mb_after_startup": round(process_tree_usage(os.getpid())['rss_mb'], 1),
+        "endpoints": run_endpoints(driver, os.getpid(), token, samples, argparse.Namespace(**spec['args']))
+    }
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+
+
+def bench_api(args):
+    results = {}
+    for entries in args.entries:
+        for client in args.client:
+            workdir = tempfile.mkdtemp(prefix='c1bench-')
+            try:
+                blob_files = min(args.blob_files, entries)
+                readable, deletable = synthesize_store(workdir, entries, blob_files, args.blob_size)
+                print(f"{entries} 条元数据 / {blob_files} 个 {args.blob_size}B 文件，{client}：")
+                options = {k: getattr(args, k) for k in
+                           ('endpoints', 'requests', 'concurrency', 'upload_size')}
+                if client == 'test':
+                    spec_path = os.path.join(workdir, 'spec.json')
+                    result_path = os.path.join(workdir, 'result.json')
+                    with open(spec_path, 'w') as f:
+                        json.dump({'readable': readable, 'deletable': deletable, 'args': options}, f)
+                    subprocess.run([sys.executable, os.path.abspath(__file__), 'api-test-client',
+                                    '--spec', spec_path, '--result', result_path],
+                                   cwd=workdir, check=True)
+                    with open(result_path) as f:
+                        result = json.load(f)
+                else:
+                    started = time.perf_counter()
+                    proc, port = start_server(workdir, 'gunicorn', API_SETTINGS,
+                                              workers=args.workers, threads=args.concurrency)
+                    try:
+                        # 端口就绪后 worker 才开始加载元数据，以第一次请求成功为启动完成
+                        token = get_token(port)
+                        startup = time.perf_counter() - started
+                        result = {
+                            "startup_seconds": round(startup, 3),
+                            "rss_mb_after_startup": round(process_tree_usage(proc.pid)['rss_mb'], 1),
+                            "endpoints": run_endpoints(HttpDriver(port), proc.pid, token, (readable, deletable),
+                                                       argparse.Namespace(**options))
+                        }
+                    finally:
+                        stop_server(proc)
+                results.setdefault(str(entries), {})[client] = result
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# ================== 慢速客户端并发 ==================
+async def slow_download(port, path, rate, deadline, stats):
+    """按每秒 rate 字节读取下载响应（接收缓冲区很小，服务端只能按客户端的速度发送），到 deadline 时断开"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+    sock.setblocking(False)
+    started = time.perf_counter()
+    try:
+        await loop.sock_connect(sock, ('127.0.0.1', port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+    except OSError:
+        sock.close()
+        stats['failed'] += 1
+        return
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept-Encoding: identity\r\n'
+                 f'Connection: close\r\n\r\n'.encode())
+    received = 0
+    try:
+        while time.perf_counter() < deadline:
+            chunk = await asyncio.wait_for(reader.read(max(1, rate // 10)), max(0.01, deadline - time.perf_counter()))
+            if not chunk:
+                break
+            if not received:
+                stats['ttfb'].append(time.perf_counter() - started)
+            received += len(chunk)
+            await asyncio.sleep(len(chunk) / rate)
+    except (asyncio.TimeoutError, OSError):
+        pass
+    finally:
+        writer.close()
+    stats['bytes'] += received
+    if not received:
+        stats['waiting'] += 1
+
+
+def probe_status(port, token, stop, latencies, timeouts):
+    """慢速下载进行期间每 0.1 秒请求一次 status，衡量服务是否还能响应其它请求"""
+    session = requests.Session()
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            session.get(f'{api(port)}/status', params={'token': token}, timeout=5).raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+        except requests.RequestException:
+            timeouts.append(time.perf_counter() - t0)
+            session = requests.Session()
+        stop.wait(0.1)
+
+
+def bench_slow_clients(args):
+    # 客户端与服务端进程都需要数千个文件描述符
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    password = hashlib.sha256(b'0000').hexdigest()
+    results = {}
+    for server in args.servers:
+        workdir = tempfile.mkdtemp(prefix='c1bench-')
+        os.makedirs(os.path.join(workdir, 'cloud_disk', 'uploads'))
+        proc, port = start_server(workdir, server, {}, threads=args.threads)
+        try:
+            token = get_token(port)
+            requests.post(
+                f'{api(port)}/upload',
+                files={'file': ('slow.bin', os.urandom(int(args.size_mb * 1024 * 1024)))},
+                data={'password': password, 'expire': 'forever', 'token': token}
+            ).raise_for_status()
+            path = f'/c1yunpan/api/download/slow.bin?token={token}&password={password}'
+
+            stats = {'bytes': 0, 'ttfb': [], 'waiting': 0, 'failed': 0}
+            latencies, timeouts = [], []
+            stop = threading.Event()
+            prober = threading.Thread(target=probe_status, args=(port, token, stop, latencies, timeouts))
+            peak = {'threads': 0, 'rss_mb': 0.0}
+
+            async def run():
+                deadline = time.perf_counter() + args.duration
+                tasks = [asyncio.ensure_future(slow_download(port, path, args.rate_kb * 1024, deadline, stats))
+                         for _ in range(args.clients)]
+                while not all(task.done() for task in tasks):
+                    peak['threads'] = max(peak['threads'], process_tree_threads(proc.pid))
+                    peak['rss_mb'] = max(peak['rss_mb'], process_tree_usage(proc.pid)['rss_mb'])
+                    await asyncio.sleep(0.5)
+
+            cpu_before = process_tree_cpu(proc.pid)
+            prober.start()
+            asyncio.run(run())
+            stop.set()
+            prober.join()
+            cpu = process_tree_cpu(proc.pid) - cpu_before
+        finally:
+            stop_server(proc)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        results[server] = {
+            "clients": args.clients,
+            "served": len(stats['ttfb']),
+            "waiting": stats['waiting'],
+            "failed": stats['failed'],
+            "ttfb_p50_ms": round(percentile(stats['ttfb'], 50) * 1000, 1),
+            "ttfb_p99_ms": round(percentile(stats['ttfb'], 99) * 1000, 1),
+            "throughput_mb_s": round(stats['bytes'] / 1024 ** 2 / args.duration, 2),
+            "status_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "status_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "status_timeouts": len(timeouts),
+            "server_cpu_s": round(cpu, 3),
+            "peak_threads": peak['threads'],
+            "peak_rss_mb": round(peak['rss_mb'], 1)
+        }
+        r = results[server]
+        print(f"{server:>9}: 已开始接收 {r['served']}/{r['clients']}  首字节 p99 {r['ttfb_p99_ms']:>8} ms  "
+              f"{r['throughput_mb_s']:>7} MB/s  status p99 {r['status_p99_ms']:>7} ms 超时 {r['status_timeouts']}  "
+              f"线程 {r['peak_threads']:>5}  RSS {r['peak_rss_mb']:>7} MB")
+    return results
+
+
+def compare(args):
+    """对比两次 api 压测结果的 p50/p99/吞吐"""
+    with open(args.old) as f:
+        old = json.load(f).get('api', {})
+    with open(args.new) as f:
+        new = json.load(f).get('api', {})
+    for entries in new:
+        for client in new[entries]:
+            before = old.get(entries, {}).get(client)
+            if not before:
+                continue
+            print(f"{entries} 条元数据，{client}（新/旧）：")
+            for endpoint, r in new[entries][client]['endpoints'].items():
+                b = before['endpoints'].get(endpoint)
+                if not b:
+                    continue
+                ratios = [r[k] / b[k] if b[k] else float('nan') for k in ('p50_ms', 'p99_ms', 'throughput_rps')]
+                print(f"  {endpoint:>16}: p50 x{ratios[0]:.2f}  p99 x{ratios[1]:.2f}  吞吐 x{ratios[2]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='C1云盘性能基准测试')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('serve', help='（内部使用）启动被测服务')
+    p.add_argument('--server', choices=['werkzeug', 'gunicorn', 'asgi'], default='werkzeug')
+    p.add_argument('--port', type=int, required=True)
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--set', default='{}')
+
+    p = sub.add_parser('download', help='对比不同 DOWNLOAD_BACKEND 的吞吐与 CPU 开销')
+    p.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='gunicorn')
+    p.add_argument('--size-mb', type=float, default=50)
+    p.add_argument('--rounds', type=int, default=5)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--modes', nargs='+', choices=list(DOWNLOAD_MODES), default=list(DOWNLOAD_MODES))
+    p.add_argument('--output', help='结果保存为 JSON 文件')
+
+    p = sub.add_parser('api', help='按元数据规模与并发压测各接口')
+    p.add_argument('--entries', type=int, nargs='+', default=[1000, 100000], help='合成的元数据条数，可指定多个')
+    p.add_argument('--blob-files', type=int, default=100, help='有真实内容的文件数')
+    p.add_argument('--blob-size', type=int, default=64 * 1024, help='每个文件的字节数')
+    p.add_argument('--client', nargs='+', choices=['test', 'gunicorn'], default=['test', 'gunicorn'])
+    p.add_argument('--workers', type=int, default=4, help='gunicorn worker 数')
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--requests', type=int, default=500, help='每个接口的请求数')
+    p.add_argument('--upload-size', type=int, default=64 * 1024)
+    p.add_argument('--endpoints', nargs='+', choices=API_ENDPOINTS, default=API_ENDPOINTS)
+    p.add_argument('--output', help='结果保存为 JSON 文件')
+
+    p = sub.add_parser('api-test-client', help='（内部使用）进程内压测')
+    p.add_argument('--spec', required=True)
+    p.add_argument('--result', required=True)
+
+    p = sub.add_parser('slow-clients', help='大量慢速客户端同时下载时对比多线程与 asyncio 运行方式')
+    p.add_argument('--servers', nargs='+', choices=['werkzeug', 'gunicorn', 'asgi'],
+                   default=['werkzeug', 'gunicorn', 'asgi'])
+    p.add_argument('--clients', type=int, default=1000)
+    p.add_argument('--rate-kb', type=int, default=32, help='每个客户端每秒接收的 KB 数')
+    p.add_argument('--duration', type=float, default=20, help='每种运行方式的压测秒数')
+    p.add_argument('--size-mb', type=float, default=8)
+    p.add_argument('--threads', type=int, default=8, help='gunicorn 线程数 / asgi 线程池大小')
+    p.add_argument('--output', help='结果保存为 JSON 文件')
+
+    p = sub.add_parser('compare', help='对比两次 api 压测结果')
+    p.add_argument('old')
+    p.add_argument('new')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+        return
+    if args.command == 'api-test-client':
+        api_test_client(args)
+        return
+    if args.command == 'compare':
+        compare(args)
+        return
+
+    if args.command == 'api':
+        results = {'api': bench_api(args)}
+    elif args.command == 'slow-clients':
+        results = {'slow_clients': bench_slow_clients(args)}
+    else:
+        results = {'download': bench_download(args)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
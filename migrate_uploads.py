@@ -0,0 +1,49 @@
+"""
+把旧版本平铺在上传目录中的文件（UPLOAD_FOLDER/<文件名>，元数据没有 sha256）迁移到按内容哈希分片的 blob 目录：
+
+    python migrate_uploads.py            # 在 app.py 所在目录执行
+    python migrate_uploads.py --dry-run  # 只统计待迁移的文件
+
+服务运行中也可以执行：每个文件在 blob 跨进程锁内移动并改写元数据，下载与删除不受影响。
+相同内容的文件迁移后只保留一份。
+"""
+import argparse
+import os
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='迁移平铺上传目录中的旧文件到分片 blob 目录')
+    parser.add_argument('--dry-run', action='store_true', help='只列出待迁移的文件')
+    args = parser.parse_args()
+
+    # 旧的 metadata.txt 要先迁移到元数据日志，否则找不到待迁移的文件
+    app.migrate_legacy_metadata(app.metadata_store)
+    names = sorted(app.metadata_store.legacy_names())
+    print(f"待迁移文件 {len(names)} 个")
+    if args.dry_run:
+        for name in names:
+            print(f"  {name}")
+        return
+
+    migrated = skipped = 0
+    for name in names:
+        try:
+            entry = app.blob_store.migrate_flat(name)
+        except OSError as e:
+            print(f"迁移失败: {name} {str(e)}")
+            skipped += 1
+            continue
+        if entry is None:
+            # 文件已不存在或期间被删除/覆盖，缺失的文件由后台对账处理
+            print(f"跳过: {name}")
+            skipped += 1
+            continue
+        migrated += 1
+        print(f"已迁移: {name} -> {os.path.relpath(app.blob_store.entry_path(entry))}")
+    print(f"完成：迁移 {migrated} 个，跳过 {skipped} 个")
+
+
+if __name__ == '__main__':
+    main()
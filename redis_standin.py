@@ -0,0 +1,140 @@
+"""
+本地测试用的 Redis 协议（RESP）替身服务，只实现令牌存储用到的命令，数据保存在内存中：
+
+    python redis_standin.py --port 6379
+
+然后把 app.py 中的 TOKEN_BACKEND 设为 'redis://127.0.0.1:6379/0'
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+# {db: {key: (value, expire_at)}}，expire_at 为 None 表示不过期
+DATABASES = {}
+LOCK = threading.Lock()
+
+
+def read_command(reader):
+    """读取一条命令，支持数组格式和 inline 格式，连接关闭时返回 None"""
+    line = reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.decode().split()
+    args = []
+    for _ in range(int(line[1:])):
+        length = int(reader.readline()[1:])
+        args.append(reader.read(length + 2)[:-2].decode())
+    return args
+
+
+def encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, bool):
+        return b'+OK\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode(v) for v in value)
+    data = value.encode()
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+
+def live_keys(db, now):
+    data = DATABASES.setdefault(db, {})
+    for key in [k for k, (_, expire_at) in data.items() if expire_at is not None and expire_at <= now]:
+        del data[key]
+    return data
+
+
+def execute(db, args):
+    """执行命令，返回 (新的 db, 响应)"""
+    name = args[0].upper()
+    now = time.time()
+    with LOCK:
+        data = live_keys(db, now)
+        if name == 'PING':
+            return db, b'+PONG\r\n'
+        if name in ('AUTH', 'CLIENT'):
+            return db, encode(True)
+        if name == 'SELECT':
+            return int(args[1]), encode(True)
+        if name == 'GET':
+            item = data.get(args[1])
+            return db, encode(item[0] if item else None)
+        if name == 'SET':
+            expire_at = None
+            options = [a.upper() for a in args[3:]]
+            for i, option in enumerate(options):
+                if option == 'EX':
+                    expire_at = now + int(args[4 + i])
+                elif option == 'PX':
+                    expire_at = now + int(args[4 + i]) / 1000
+            if 'NX' in options and args[1] in data:
+                return db, encode(None)
+            data[args[1]] = (args[2], expire_at)
+            return db, encode(True)
+        if name == 'DEL':
+            return db, encode(sum(1 for key in args[1:] if data.pop(key, None) is not None))
+        if name == 'PTTL':
+            item = data.get(args[1])
+            if item is None:
+                return db, encode(-2)
+            return db, encode(-1 if item[1] is None else int((item[1] - now) * 1000))
+        if name == 'DBSIZE':
+            return db, encode(len(data))
+        if name == 'KEYS':
+            prefix = args[1].rstrip('*')
+            return db, encode([key for key in data if key.startswith(prefix)])
+        if name == 'SCAN':
+            # 一次返回全部匹配的键，游标固定为 0
+            options = [a.upper() for a in args[2:]]
+            prefix = args[3 + options.index('MATCH')].rstrip('*') if 'MATCH' in options else ''
+            return db, encode(['0', [key for key in data if key.startswith(prefix)]])
+        if name == 'FLUSHDB':
+            data.clear()
+            return db, encode(True)
+    return db, f"-ERR unknown command '{args[0]}'\r\n".encode()
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        db = 0
+        while True:
+            try:
+                args = read_command(self.rfile)
+            except (OSError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            if args[0].upper() == 'QUIT':
+                self.wfile.write(encode(True))
+                return
+            try:
+                db, reply = execute(db, args)
+            except (IndexError, ValueError):
+                reply = f"-ERR wrong arguments for '{args[0]}'\r\n".encode()
+            self.wfile.write(reply)
+
+
+class RedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Redis 协议替身服务（仅用于本地测试）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    with RedisServer((args.host, args.port), RedisHandler) as server:
+        print(f"Redis 替身服务已启动: redis://{args.host}:{args.port}/0")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
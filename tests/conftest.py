@@ -0,0 +1,66 @@
+"""
+app 的数据目录都是相对路径，测试在临时目录中导入 app；只导入模块、不调用 create_app，不启动后台任务。
+模块级的存储实例在整个测试会话中共用，各用例使用不同的文件名与密码，用量按前后差值断言。
+"""
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    os.chdir(tmp_path_factory.mktemp('c1yunpan'))
+    os.makedirs('cloud_disk/uploads')
+    import app as app_module
+    app_module.upload_session_manager.load()
+    return app_module
+
+
+@pytest.fixture(scope='session')
+def client(app):
+    return app.flask_app.test_client()
+
+
+@pytest.fixture(scope='session')
+def base(app):
+    return app.FLASK_BASE_PATH
+
+
+@pytest.fixture
+def token(app, client, base):
+    return client.post(f'{base}/token', json={'password': app.LIST_PASSWORD_HASH}).json['token']
+
+
+def password_hash(name):
+    return hashlib.sha256(f'password-{name}'.encode()).hexdigest()
+
+
+@pytest.fixture
+def upload(app, client, base, token):
+    """上传文件并返回其元数据，密码为 password_hash(文件名)"""
+    def upload(filename, data, expire='forever'):
+        response = client.post(f'{base}/upload', data={
+            'token': token, 'password': password_hash(filename), 'expire': expire,
+            'file': (io.BytesIO(data), filename)
+        })
+        assert response.status_code == 200, response.json
+        return app.metadata_store.get(filename)
+    return upload
+
+
+@pytest.fixture
+def cold(app, tmp_path, monkeypatch):
+    """每个用例使用独立的冷存储目录"""
+    folder = str(tmp_path / 'cold')
+    monkeypatch.setattr(app, 'COLD_FOLDER', folder)
+    monkeypatch.setattr(app, 'cold_tier', app.ColdTier(folder))
+    return app.cold_tier
+
+
+def text_content(lines, tag=''):
+    return b''.join(b'%s line %d of a log file with some words\n' % (tag.encode(), i) for i in range(lines))
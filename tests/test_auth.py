@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(app, request, tmp_path):
+    if request.param == 'memory':
+        return app.MemoryTokenStore()
+    return app.SQLiteTokenStore(str(tmp_path / 'tokens.db'))
+
+
+def test_token_store_expiry(store):
+    now = time.time()
+    store.set('live', now + 60)
+    store.set('expired', now - 1)
+    assert store.get('live') == now + 60
+    assert store.get('expired') == 0
+    assert store.get('unknown') == 0
+    assert store.count(now) == 1
+
+    store.set('live', now + 120)
+    assert store.get('live') == now + 120
+    assert store.count(now) == 1
+
+
+def test_token_store_evicts_earliest_expiry_over_limit(app, store, monkeypatch):
+    monkeypatch.setattr(app, 'TOKEN_MAX_ACTIVE', 3)
+    now = time.time()
+    for i in range(5):
+        store.set(f'token-{i}', now + 60 + i)
+    assert store.count(now) == 3
+    assert [store.get(f'token-{i}') > 0 for i in range(5)] == [False, False, True, True, True]
+
+
+def test_token_auth_renews_after_half_ttl(app, store):
+    auth = app.TokenAuth(store)
+    token = auth.issue()
+    assert auth.validate(token)
+    assert not auth.validate('0' * 64)
+    assert not auth.validate(None)
+
+    # 剩余有效期不足一半时续期
+    store.set(token, time.time() + app.TOKEN_TTL / 4)
+    assert auth.validate(token)
+    assert store.get(token) > time.time() + app.TOKEN_TTL * 3 / 4
+    assert auth.info(token)['requests'] == 2
+
+
+def test_token_endpoint(app, client, base):
+    assert client.post(f'{base}/token', json={'password': '0' * 64}).status_code == 401
+    token = client.post(f'{base}/token', json={'password': app.LIST_PASSWORD_HASH}).json['token']
+    info = client.get(f'{base}/token', query_string={'token': token}).json
+    assert info['expires_at'] > time.time()
+
+
+@pytest.mark.parametrize('path', ['files', 'overview', 'status', 'token'])
+def test_protected_endpoints_require_token(client, base, path):
+    assert client.get(f'{base}/{path}').status_code == 401
+    assert client.get(f'{base}/{path}', query_string={'token': 'invalid'}).status_code == 401
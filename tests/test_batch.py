@@ -0,0 +1,36 @@
+import io
+
+from conftest import password_hash
+
+
+def batch_form(token, names):
+    return {'token': token, 'expire': 'forever',
+            'password': [password_hash(name) for name in names],
+            'file': [(io.BytesIO(name.encode()), name) for name in names]}
+
+
+def test_batch_of_200_files(app, client, base, token):
+    names = [f'batch-{i:03d}.txt' for i in range(200)]
+    response = client.post(f'{base}/upload-batch', data=batch_form(token, names))
+    assert response.status_code == 200, response.json
+    assert response.json['filenames'] == names
+
+    items = [{'filename': name, 'password': password_hash(name)} for name in names]
+    response = client.post(f'{base}/download-zip', json={'token': token, 'items': items})
+    assert response.status_code == 200
+    response.close()
+    response = client.post(f'{base}/delete-batch', json={'token': token, 'items': items})
+    assert sorted(response.json['deleted']) == names
+
+
+def test_oversized_batch_asks_client_to_split(app, client, base, token):
+    names = [f'batch-over-{i:03d}.txt' for i in range(app.MAX_BATCH_FILES + 1)]
+    response = client.post(f'{base}/upload-batch', data=batch_form(token, names))
+    assert response.status_code == 413
+    assert app.metadata_store.get(names[0]) is None
+
+    items = [{'filename': name, 'password': password_hash(name)} for name in names]
+    for path in ('delete-batch', 'download-zip', 'download-link'):
+        response = client.post(f'{base}/{path}', json={'token': token, 'items': items})
+        assert response.status_code == 413, path
+        assert "分批" in response.json['error']
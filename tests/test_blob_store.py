@@ -0,0 +1,30 @@
+import os
+
+from conftest import text_content
+
+
+def test_new_content_is_synced_before_rename(app, upload, monkeypatch):
+    events = []
+    fsync_path, replace = app.fsync_path, os.replace
+    monkeypatch.setattr(app, 'fsync_path', lambda path: (events.append(('fsync', path)), fsync_path(path)))
+    monkeypatch.setattr(app.os, 'replace', lambda src, dst: (events.append(('replace', src, dst)), replace(src, dst)))
+
+    entry = upload('durable.txt', text_content(100, 'durable'))
+    target = os.path.abspath(app.blob_store.entry_path(entry))
+    renames = [event for event in events if event[0] == 'replace' and os.path.abspath(event[2]) == target]
+    assert len(renames) == 1
+    index = events.index(renames[0])
+    # 临时文件先落盘再改名，改名后 fsync 分片目录（新建时连同父目录）
+    assert ('fsync', renames[0][1]) in events[:index]
+    synced = {os.path.abspath(event[1]) for event in events[index:] if event[0] == 'fsync'}
+    shard = os.path.dirname(target)
+    assert {shard, os.path.dirname(shard), os.path.abspath(app.BLOB_FOLDER)} <= synced
+
+
+def test_duplicate_content_is_not_synced_again(app, upload, monkeypatch):
+    data = text_content(100, 'duplicate')
+    upload('duplicate-1.txt', data)
+    synced = []
+    monkeypatch.setattr(app, 'fsync_path', synced.append)
+    upload('duplicate-2.txt', data)
+    assert synced == []
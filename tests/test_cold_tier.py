@@ -0,0 +1,50 @@
+import os
+
+from conftest import password_hash, text_content
+
+
+def test_compact_reclaims_rehydrated_content_in_newest_pack(app, upload, cold):
+    entry = upload('tier-rehydrate.txt', text_content(20000, 'rehydrate'))
+    usage = app.storage_manager.get_storage_usage()
+
+    assert app.tier_mover.archive(entry)
+    assert app.storage_manager.get_storage_usage() < usage
+    assert app.tier_mover.rehydrate(entry)
+    # 取回后打包文件中的空间在回收前仍计入用量
+    assert app.storage_manager.get_storage_usage() > usage
+
+    assert cold.compact() > 0
+    assert app.storage_manager.get_storage_usage() == usage
+    assert cold.stats()['pack_bytes'] == 0
+
+
+def test_compact_reclaims_deleted_content_in_newest_pack(app, upload, cold):
+    kept = upload('tier-kept.txt', text_content(20000, 'kept'))
+    deleted = upload('tier-deleted.txt', text_content(60000, 'deleted'))
+    assert app.tier_mover.archive(kept)
+    assert app.tier_mover.archive(deleted)
+    usage = app.storage_manager.get_storage_usage()
+
+    app.blob_store.remove_entry('tier-deleted.txt')
+    # 已删除内容的空间在打包文件重写前仍计入用量
+    assert app.storage_manager.get_storage_usage() == usage
+    assert cold.compact() > 0
+    assert app.storage_manager.get_storage_usage() < usage
+    with cold.open(kept['sha256']) as f:
+        assert f.read() == text_content(20000, 'kept')
+    assert [name for name in os.listdir(cold.folder) if name.endswith('.pack')] == ['pack-00000002.pack']
+
+
+def test_archived_file_is_served_from_cold_tier(app, client, base, token, upload, cold):
+    data = text_content(20000, 'cold-download')
+    entry = upload('tier-download.txt', data)
+    assert app.tier_mover.archive(entry)
+    assert not os.path.exists(app.blob_store.entry_path(entry))
+
+    query = {'token': token, 'password': password_hash('tier-download.txt')}
+    response = client.get(f'{base}/download/tier-download.txt', query_string=query)
+    assert response.status_code == 200
+    assert response.data == data
+    response = client.get(f'{base}/download/tier-download.txt', query_string=query, headers={'Range': 'bytes=1000-1999'})
+    assert response.status_code == 206
+    assert response.data == data[1000:2000]
@@ -0,0 +1,123 @@
+import gzip
+import io
+import os
+import zipfile
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from conftest import password_hash, text_content
+
+
+@pytest.fixture(scope='module')
+def stored(app, client, base):
+    """一个原样保存的文件和一个压缩保存的文件"""
+    token = client.post(f'{base}/token', json={'password': app.LIST_PASSWORD_HASH}).json['token']
+    files = {'range-raw.bin': os.urandom(200 * 1024), 'range-text.txt': text_content(5000, 'range')}
+    for filename, data in files.items():
+        response = client.post(f'{base}/upload', data={
+            'token': token, 'password': password_hash(filename), 'expire': 'forever',
+            'file': (io.BytesIO(data), filename)
+        })
+        assert response.status_code == 200
+    assert app.metadata_store.get('range-raw.bin').get('encoding', '') == ''
+    assert app.metadata_store.get('range-text.txt')['encoding'] == 'gzip'
+    return files
+
+
+def download(client, base, token, filename, headers=None):
+    return client.get(f'{base}/download/{filename}', headers=headers,
+                      query_string={'token': token, 'password': password_hash(filename)})
+
+
+@pytest.mark.parametrize('filename', ['range-raw.bin', 'range-text.txt'])
+def test_range_requests(client, base, token, stored, filename):
+    data = stored[filename]
+    response = download(client, base, token, filename)
+    assert response.status_code == 200
+    assert response.data == data
+    etag = response.headers['ETag']
+
+    response = download(client, base, token, filename, {'Range': 'bytes=100-1099'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-1099/{len(data)}'
+    assert response.data == data[100:1100]
+
+    response = download(client, base, token, filename, {'Range': 'bytes=-500'})
+    assert response.status_code == 206
+    assert response.data == data[-500:]
+
+    response = download(client, base, token, filename, {'Range': 'bytes=0-9,1000-1009'})
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert data[:10] in response.data and data[1000:1010] in response.data
+
+    response = download(client, base, token, filename, {'Range': f'bytes={len(data)}-'})
+    assert response.status_code == 416
+
+    assert download(client, base, token, filename, {'If-None-Match': etag}).status_code == 304
+    # If-Range 不匹配时返回完整文件
+    response = download(client, base, token, filename, {'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == data
+
+
+def test_compressed_file_sent_encoded_when_accepted(client, base, token, stored):
+    response = download(client, base, token, 'range-text.txt', {'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == stored['range-text.txt']
+
+
+def test_wrong_password_is_rejected(client, base, token, stored):
+    response = client.get(f'{base}/download/range-raw.bin', query_string={'token': token, 'password': '0' * 64})
+    assert response.status_code == 401
+
+
+def link(client, base, token, **fields):
+    response = client.post(f'{base}/download-link', json=dict(fields, token=token))
+    assert response.status_code == 200, response.json
+    return response.json['url']
+
+
+def test_signed_link(client, base, token, stored):
+    url = link(client, base, token, filename='range-raw.bin', password=password_hash('range-raw.bin'))
+    assert url.startswith(f'{base}/dl/range-raw.bin?')
+    response = client.get(url, headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.data == stored['range-raw.bin'][:100]
+
+    query = parse_qs(urlsplit(url).query)
+    expires, signature = query['expires'][0], query['signature'][0]
+    tampered = [
+        f'{base}/dl/range-raw.bin?expires={expires}&signature={"0" * 32}',
+        f'{base}/dl/range-raw.bin?expires={int(expires) + 1}&signature={signature}',
+        f'{base}/dl/range-text.txt?expires={expires}&signature={signature}',
+        f'{base}/dl/range-raw.bin?expires=1&signature={signature}',
+    ]
+    for url in tampered:
+        assert client.get(url).status_code == 403, url
+
+
+def test_signed_link_invalidated_by_reupload(app, client, base, token, upload):
+    upload('link-reupload.txt', b'first')
+    url = link(client, base, token, filename='link-reupload.txt', password=password_hash('link-reupload.txt'))
+    assert client.get(url).data == b'first'
+    app.blob_store.remove_entry('link-reupload.txt')
+    # 同名重新上传（密码不同）后旧链接失效
+    response = client.post(f'{base}/upload', data={
+        'token': token, 'password': password_hash('link-reupload-2'), 'expire': 'forever',
+        'file': (io.BytesIO(b'second'), 'link-reupload.txt')
+    })
+    assert response.status_code == 200
+    assert client.get(url).status_code == 403
+
+
+def test_signed_zip_link(client, base, token, stored):
+    items = [{'filename': name, 'password': password_hash(name)} for name in stored]
+    url = link(client, base, token, items=items)
+    response = client.get(url)
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert {name: archive.read(name) for name in archive.namelist()} == stored
+    assert client.get(url.replace('signature=', 'signature=0')).status_code == 403
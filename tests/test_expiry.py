@@ -0,0 +1,17 @@
+import threading
+
+
+def test_expiry_stats_reads_delete_backlog_under_queue_lock(app, tmp_path):
+    backlog = app.expiry_scheduler.stats()['delete_backlog']
+    assert app.deletion_queue.submit(str(tmp_path / 'missing.bin'))
+    assert app.expiry_scheduler.stats()['delete_backlog'] == backlog + 1
+
+    # 删除线程持有队列锁时，统计等待锁释放而不是读到修改中的任务表
+    stats = []
+    with app.deletion_queue.cond:
+        reader = threading.Thread(target=lambda: stats.append(app.expiry_scheduler.stats()))
+        reader.start()
+        reader.join(0.2)
+        assert stats == []
+    reader.join()
+    assert stats[0]['delete_backlog'] == backlog + 1
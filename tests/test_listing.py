@@ -0,0 +1,30 @@
+import pytest
+
+
+@pytest.mark.parametrize('query', [
+    {'page': 'abc'}, {'per_page': 'x'}, {'page': '1.5'}, {'sort': 'password'}, {'order': 'up'}, {'cursor': '!!'}
+])
+@pytest.mark.parametrize('path', ['/files', '/overview'])
+def test_invalid_listing_args_return_400(client, base, token, path, query):
+    response = client.get(f'{base}{path}', query_string={'token': token, **query})
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_listing_etag_and_cursor(client, base, token, upload):
+    for i in range(3):
+        upload(f'listing-{i}.txt', b'listing %d' % i)
+    response = client.get(f'{base}/files', query_string={'token': token, 'search': 'listing-', 'per_page': 2})
+    assert response.status_code == 200
+    first = response.json
+    assert first['total'] == 3
+    assert len(first['files']) == 2
+
+    cached = client.get(f'{base}/files', query_string={'token': token, 'search': 'listing-', 'per_page': 2},
+                        headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+
+    rest = client.get(f'{base}/files', query_string={'token': token, 'search': 'listing-', 'per_page': 2,
+                                                      'cursor': first['next_cursor']}).json
+    names = [f['name'] for f in first['files'] + rest['files']]
+    assert sorted(names) == ['listing-0.txt', 'listing-1.txt', 'listing-2.txt']
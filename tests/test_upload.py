@@ -0,0 +1,52 @@
+import io
+import os
+
+from conftest import password_hash
+
+
+def count_reserves(app, monkeypatch):
+    calls = []
+    reserve = app.storage_manager.reserve
+    monkeypatch.setattr(app.storage_manager, 'reserve', lambda size: (calls.append(size), reserve(size))[1])
+    return calls
+
+
+def test_upload_reserves_quota_once(app, upload, monkeypatch):
+    calls = count_reserves(app, monkeypatch)
+    upload('reserve-once.bin', os.urandom(3 * 1024 * 1024))
+    assert len(calls) == 1
+    assert app.storage_manager.reserved == 0
+
+
+def test_batch_upload_reserves_quota_in_blocks(app, client, base, token, monkeypatch):
+    calls = count_reserves(app, monkeypatch)
+    response = client.post(f'{base}/upload-batch', data={
+        'token': token, 'expire': 'forever',
+        'password': [password_hash('reserve-batch-1.bin'), password_hash('reserve-batch-2.bin')],
+        'file': [(io.BytesIO(os.urandom(10 * 1024 * 1024)), 'reserve-batch-1.bin'),
+                 (io.BytesIO(b'small'), 'reserve-batch-2.bin')]
+    })
+    assert response.status_code == 200, response.json
+    assert len(calls) == 4
+    assert app.storage_manager.reserved == 0
+
+
+def test_upload_fits_remaining_quota_exactly(app, upload, monkeypatch):
+    data = os.urandom(1024 * 1024)
+    usage = app.storage_manager.get_storage_usage()
+    # 剩余配额小于请求体和一整块，但足够放下文件内容
+    monkeypatch.setattr(app, 'CLOUD_DISK_MAX_STORAGE_SIZE', usage + len(data))
+    assert upload('reserve-exact.bin', data)['size'] == len(data)
+    assert app.storage_manager.reserved == 0
+
+
+def test_upload_over_quota_is_rejected(app, client, base, token, monkeypatch):
+    data = os.urandom(1024 * 1024)
+    monkeypatch.setattr(app, 'CLOUD_DISK_MAX_STORAGE_SIZE', app.storage_manager.get_storage_usage() + len(data) - 1)
+    response = client.post(f'{base}/upload', data={
+        'token': token, 'password': password_hash('reserve-over.bin'), 'expire': 'forever',
+        'file': (io.BytesIO(data), 'reserve-over.bin')
+    })
+    assert response.status_code == 400
+    assert response.json['error'] == "存储空间不足"
+    assert app.storage_manager.reserved == 0
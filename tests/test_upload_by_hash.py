@@ -0,0 +1,47 @@
+import hashlib
+
+from conftest import password_hash, text_content
+
+
+def by_hash(client, base, token, filename, sha256, size, **fields):
+    return client.post(f'{base}/upload-by-hash', json=dict(
+        fields, token=token, filename=filename, password=password_hash(filename), expire='forever',
+        sha256=sha256, size=size))
+
+
+def prove(data, challenge):
+    offset, length = challenge['offset'], challenge['length']
+    return hashlib.sha256(challenge['nonce'].encode() + data[offset:offset + length]).hexdigest()
+
+
+def test_upload_by_hash_with_proof(app, client, base, token, upload):
+    data = text_content(5000, 'by-hash')
+    entry = upload('by-hash-source.txt', data)
+    challenge = by_hash(client, base, token, 'by-hash-copy.txt', entry['sha256'], len(data)).json['challenge']
+    response = by_hash(client, base, token, 'by-hash-copy.txt', entry['sha256'], len(data),
+                       challenge=challenge, proof=prove(data, challenge))
+    assert response.status_code == 200, response.json
+    assert app.metadata_store.get('by-hash-copy.txt')['sha256'] == entry['sha256']
+
+
+def test_unknown_content_gets_challenge(client, base, token):
+    sha256 = hashlib.sha256(b'unknown').hexdigest()
+    response = by_hash(client, base, token, 'by-hash-unknown.txt', sha256, 25 * 1024 * 1024)
+    challenge = response.json['challenge']
+    # 片段只从开头 UPLOAD_PROOF_MAX_OFFSET 内选取
+    assert challenge['offset'] <= 4 * 1024 * 1024
+    response = by_hash(client, base, token, 'by-hash-unknown.txt', sha256, 25 * 1024 * 1024,
+                       challenge=challenge, proof='0' * 64)
+    assert response.status_code == 404
+
+
+def test_failed_proofs_are_rate_limited(app, client, base, token, upload):
+    data = text_content(100, 'by-hash-limited')
+    entry = upload('by-hash-limited.txt', data)
+    statuses = []
+    for _ in range(app.GUESS_BURST + 1):
+        challenge = by_hash(client, base, token, 'by-hash-guess.txt', entry['sha256'], len(data)).json.get('challenge')
+        statuses.append(by_hash(client, base, token, 'by-hash-guess.txt', entry['sha256'], len(data),
+                                challenge=challenge or {}, proof='0' * 64).status_code)
+    assert statuses[:app.GUESS_BURST] == [404] * app.GUESS_BURST
+    assert statuses[-1] == 429
@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+import pytest
+
+from conftest import password_hash
+
+
+@pytest.mark.parametrize('size', [None, [], {}, 'abc'])
+def test_create_session_rejects_invalid_size(client, base, token, size):
+    response = client.post(f'{base}/upload-sessions', json={
+        'token': token, 'filename': 'session-bad.bin', 'password': password_hash('session-bad.bin'),
+        'expire': 'forever', 'size': size
+    })
+    assert response.status_code == 400
+    assert response.json == {"error": "参数错误"}
+
+
+def test_create_session_rejects_non_object_body(client, base):
+    response = client.post(f'{base}/upload-sessions', json=[1, 2])
+    assert response.status_code in (400, 401)
+
+
+def create_session(client, base, token, filename, size, chunk_size=64 * 1024):
+    response = client.post(f'{base}/upload-sessions', json={
+        'token': token, 'filename': filename, 'password': password_hash(filename),
+        'expire': 'forever', 'size': size, 'chunk_size': chunk_size
+    })
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def put_chunk(client, base, token, session, data, index, **headers):
+    chunk_size = session['chunk_size']
+    return client.put(f"{base}/upload-sessions/{session['session_id']}/chunks/{index}",
+                      query_string={'token': token}, headers=headers,
+                      data=data[index * chunk_size:(index + 1) * chunk_size])
+
+
+def test_resumable_upload(app, client, base, token):
+    data = os.urandom(150 * 1024)
+    session = create_session(client, base, token, 'session-file.bin', len(data))
+    assert session['chunk_count'] == 3
+    session_url = f"{base}/upload-sessions/{session['session_id']}"
+
+    # 分块可以乱序上传，中断后按 missing_chunks 续传
+    assert put_chunk(client, base, token, session, data, 2).status_code == 200
+    status = client.get(session_url, query_string={'token': token}).json
+    assert status['missing_chunks'] == [0, 1]
+    assert status['received_ranges'] == [[128 * 1024, len(data)]]
+
+    bad = put_chunk(client, base, token, session, data, 0, **{'X-Chunk-Sha256': '0' * 64})
+    assert bad.status_code == 400
+    for index in status['missing_chunks']:
+        assert put_chunk(client, base, token, session, data, index).status_code == 200
+
+    digest = hashlib.sha256(data).hexdigest()
+    response = client.post(f'{session_url}/finalize', json={'token': token, 'sha256': digest})
+    assert response.status_code == 200, response.json
+    assert app.metadata_store.get('session-file.bin')['sha256'] == digest
+    assert client.get(session_url, query_string={'token': token}).status_code == 404
+    assert app.storage_manager.reserved == 0
+
+
+def test_finalize_rejects_mismatched_hash_and_incomplete_upload(app, client, base, token):
+    data = os.urandom(100 * 1024)
+    session = create_session(client, base, token, 'session-mismatch.bin', len(data))
+    session_url = f"{base}/upload-sessions/{session['session_id']}"
+    assert put_chunk(client, base, token, session, data, 0).status_code == 200
+    response = client.post(f'{session_url}/finalize', json={'token': token, 'sha256': hashlib.sha256(data).hexdigest()})
+    assert response.status_code == 400
+
+    assert put_chunk(client, base, token, session, data, 1).status_code == 200
+    response = client.post(f'{session_url}/finalize', json={'token': token, 'sha256': '0' * 64})
+    assert response.status_code == 400
+    assert app.metadata_store.get('session-mismatch.bin') is None
+
+    assert client.delete(session_url, query_string={'token': token}).status_code == 200
+    assert client.get(session_url, query_string={'token': token}).status_code == 404
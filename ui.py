@@ -0,0 +1,350 @@
+"""
+Streamlit 页面入口，只运行页面，API 由 `python app.py api`（gunicorn）单独运行：
+
+    python app.py ui                  # 使用 app.py 中的端口与根路径配置
+    streamlit run ui.py --server.port 8501 --server.baseUrlPath /c1yunpan
+
+页面只通过 HTTP 调用 API，从 app 导入的只有配置常量（导入 app 不创建目录、不打开任何存储，也不启动后台任务）。
+"""
+import hashlib
+import time
+from datetime import datetime
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app import FLASK_CLOUD_PATH, MAX_BATCH_FILES, UI_API_RETRIES, UI_API_TIMEOUT, UI_CACHE_SIZE, UI_CACHE_TTL
+
+
+def format_time(seconds):
+    if seconds == 0:
+        return "永久"
+    periods = [('天', 86400), ('小时', 3600), ('分钟', 60)]
+    result = []
+    for name, sec in periods:
+        if seconds >= sec:
+            val, seconds = divmod(seconds, sec)
+            result.append(f"{int(val)}{name}")
+    return ' '.join(result) if result else "不足1分钟"
+
+
+def format_file_size(size_in_bytes):
+    """
+    将文件大小从字节转换为 KB、MB 或 GB 的格式，并以最小的单位显示。
+    :param size_in_bytes: 文件大小（以字节为单位）
+    :return: 格式化后的文件大小字符串
+    """
+    units = ['B', 'KB', 'MB', 'GB']
+    size = size_in_bytes  # 初始大小单位是 Bytes
+    unit_index = 0  # 初始单位是 Bytes
+
+    # 逐步转换单位，直到文件大小小于 1000
+    while size >= 1024 and unit_index < len(units) - 1:
+        size /= 1024
+        unit_index += 1
+
+    # 格式化输出，保留两位小数
+    return f"{size:.2f}{units[unit_index]}"
+
+
+class ApiClient:
+    """Streamlit 页面调用 API 的客户端：复用 keep-alive 连接池，统一超时，连接失败和网关错误时重试"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+        # 状态码重试只针对幂等的 GET；连接失败时请求尚未发出，任何方法都可以重试
+        retry = Retry(total=UI_API_RETRIES, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', UI_API_TIMEOUT)
+        return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+def api_client():
+    """每个浏览器会话一个客户端，页面重跑时复用连接"""
+    if 'api_client' not in st.session_state:
+        st.session_state.api_client = ApiClient(FLASK_CLOUD_PATH)
+    return st.session_state.api_client
+
+
+def load_overview(params):
+    """
+    网盘状态和文件列表合并为一次 /overview 请求，按 (令牌, 查询参数) 缓存 UI_CACHE_TTL 秒；
+    缓存过期后带上次的 listing_etag 重新请求，列表未变化时服务端不再返回列表内容
+    """
+    cache = st.session_state.setdefault('overview_cache', {})
+    key = (st.session_state.token, tuple(sorted(params.items())))
+    cached = cache.pop(key, None)
+    if cached and time.time() - cached['fetched_at'] < UI_CACHE_TTL:
+        cache[key] = cached
+        return cached['data']
+
+    headers = {'If-None-Match': cached['data']['listing_etag']} if cached else {}
+    response = api_client().get("/overview", params={"token": st.session_state.token, **params}, headers=headers)
+    response.raise_for_status()
+    data = response.json()
+    if data['listing'] is None:
+        data['listing'] = cached['data']['listing']
+    cache[key] = {"fetched_at": time.time(), "data": data}
+    # 只保留最近使用的几组查询
+    while len(cache) > UI_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    return data
+
+
+def invalidate_overview():
+    """上传/删除后让缓存立即过期，保留 ETag 用于条件请求"""
+    for cached in st.session_state.get('overview_cache', {}).values():
+        cached['fetched_at'] = 0
+
+
+def streamlit_ui():
+    # 初始化会话状态
+    if 'token' not in st.session_state:
+        st.session_state.token = None
+
+    st.set_page_config(
+        page_title="C1云盘",
+        page_icon="📁",
+        layout="centered" if st.session_state.token == None else "wide"
+    )
+
+    st.header("C1云盘")
+
+    # 密码验证模块
+    if not st.session_state.token:
+        list_pass = st.text_input("🔑 输入云盘查看密码", type="password")
+        if list_pass:
+            try:
+                pass_hash = hashlib.sha256(f'salt_pass_{list_pass}'.encode()).hexdigest()
+                response = api_client().post("/token", json={"password": pass_hash})
+                if response.status_code == 200:
+                    st.session_state.token = response.json()['token']
+                    st.rerun()
+                else:
+                    st.error("密码错误")
+            except Exception:
+                st.error("服务不可用")
+        return
+
+    # 文件列表的查询控件在页面下方，这里从会话状态读取当前值，与网盘状态合并为一次请求
+    sort_options = [("最新上传", "upload_time", "desc"), ("最早上传", "upload_time", "asc"),
+                    ("最大文件", "size", "desc"), ("即将过期", "expire_time", "asc"), ("文件名", "name", "asc")]
+    sort_option = st.session_state.get('file_sort', sort_options[0])
+    params = {
+        "page": st.session_state.get('file_page', 1),
+        "per_page": st.session_state.get('file_per_page', 10),
+        "search": st.session_state.get('file_search', ''),
+        "sort": sort_option[1],
+        "order": sort_option[2]
+    }
+    try:
+        overview = load_overview(params)
+    except Exception as e:
+        st.warning(f"云盘状态获取失败：{e}")
+        overview = None
+
+    # 系统状态
+    if overview:
+        status = overview['status']
+        used_storage = status['used_storage']
+        max_storage = status['max_storage']
+        used_size_str = format_file_size(used_storage)
+        max_size_str = format_file_size(max_storage)
+        st.progress(used_storage / max_storage,
+                    f"存储使用： {used_size_str} / {max_size_str}，文件总数：{status['file_count']}")
+
+    # 主界面功能
+    # 快速下载模块
+    with st.expander("⬇️ 输入密码直接下载", expanded=True):
+        dl_password = st.text_input("输入下载密码（4位数字）", max_chars=4, key="direct_download_text_input")
+        if st.button("立即下载"):
+            if len(dl_password) != 4 or not dl_password.isdigit():
+                st.error("需4位数字")
+            else:
+                try:
+                    pass_hash = hashlib.sha256(dl_password.encode()).hexdigest()
+                    # 换取签名直链，浏览器直接从 API 下载，文件内容不经过 Streamlit 进程
+                    response = api_client().post(
+                        "/download-link",
+                        json={"password": pass_hash, "token": st.session_state.token}
+                    )
+                    if response.status_code == 200:
+                        link = response.json()
+                        st.link_button(f"保存文件 {link['filename']}", link['url'])
+                    else:
+                        st.error(response.json().get("error"))
+                except Exception:
+                    st.error("下载失败")
+
+    # 上传模块
+    with st.expander("⬆️ 文件共享", expanded=False):
+        if "file_uploader_counter" not in st.session_state:
+            st.session_state.file_uploader_counter = 0
+        if "upload_pass_counter" not in st.session_state:
+            st.session_state.upload_pass_counter = 0
+        if "expire_option_counter" not in st.session_state:
+            st.session_state.expire_option_counter = 0
+
+        uploaded_files = st.file_uploader(
+            f"选择文件（单个最大50MB，一次最多{MAX_BATCH_FILES}个）",
+            accept_multiple_files=True,
+            key=f"file_uploader_{st.session_state.file_uploader_counter}"
+        )
+        expire_option = st.selectbox(
+            "保存时间",
+            options=[('10分钟', '10m'), ('30分钟', '30m'), ('1天', '1d'),
+                     ('3天', '3d'), ('7天', '7d'), ('永久', 'forever')],
+            format_func=lambda x: x[0],
+            key=f"expire_option_{st.session_state.expire_option_counter}"
+        )
+        # 密码用于下载时定位文件，每个文件各设一个
+        file_passes = [
+            st.text_input(f"🔢 设置4位数字密码：{uploaded_file.name}" if len(uploaded_files) > 1
+                          else "🔢 设置4位数字密码", max_chars=4,
+                          key=f"upload_pass_{st.session_state.upload_pass_counter}_{i}")
+            for i, uploaded_file in enumerate(uploaded_files or [None])
+        ]
+
+        if st.button("上传") and uploaded_files:
+            if len(uploaded_files) > MAX_BATCH_FILES:
+                st.error(f"一次最多上传{MAX_BATCH_FILES}个文件")
+            elif any(len(p) != 4 or not p.isdigit() for p in file_passes):
+                st.error("密码必须为4位数字")
+            elif len(set(file_passes)) < len(file_passes):
+                st.error("每个文件的密码不能相同")
+            else:
+                hashed_passes = [hashlib.sha256(p.encode()).hexdigest() for p in file_passes]
+                try:
+                    # 多个文件一次请求上传，全部成功或全部失败
+                    response = api_client().post(
+                        "/upload-batch",
+                        files=[("file", (f.name, f)) for f in uploaded_files],
+                        data={"password": hashed_passes, "expire": expire_option[1],
+                              "token": st.session_state.token}
+                    )
+                    if response.status_code == 200:
+                        st.success("上传成功")
+                        invalidate_overview()
+                        st.session_state.file_uploader_counter += 1
+                        st.session_state.upload_pass_counter += 1
+                        st.session_state.expire_option_counter += 1
+                        st.rerun()
+
+                    else:
+                        st.error(response.json().get("error"))
+                except Exception:
+                    st.error("上传失败")
+
+    st.subheader('文件列表')
+    # 文件列表展示（分页+搜索）
+    st.text_input("🔍 搜索文件名", key="file_search")
+    col1, col2, col3 = st.columns(3)
+    col1.number_input("页码", min_value=1, value=1, key="file_page")
+    col2.selectbox("每页数量", [10, 20, 50], index=0, key="file_per_page")
+    col3.selectbox("排序", sort_options, format_func=lambda x: x[0], key="file_sort")
+
+    if overview is None:
+        st.error('服务连接错误')
+        return
+    data = overview['listing']
+    st.write(f"共 {data['total']} 个文件（选择文件并输入\"下载密码\"，点击\"下载\"按钮开始下载文件）")
+
+    # 整页文件用一个表格展示，控件数量不随每页数量增长
+    rows = []
+    available = []
+    now = time.time()
+    for file in data['files']:
+        expire_time = float(file['expire_time'])
+        if not expire_time:
+            remain_time = "永久"
+        elif expire_time > now:
+            remain_time = f"{format_time(int(expire_time - now))}后过期"
+        else:
+            remain_time = "已过期"
+        if remain_time != "已过期":
+            available.append(file['name'])
+        rows.append({
+            "文件名": file['name'],
+            "大小": format_file_size(float(file['size'])),
+            "过期时间": remain_time,
+            "共享时间": datetime.fromtimestamp(float(file['upload_time'])).strftime('%Y-%m-%d %H:%M')
+        })
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    if not available:
+        return
+
+    # 下载/删除对选中的文件操作，选中多个文件时打包下载、批量删除
+    selected = st.multiselect("选择文件", available, max_selections=MAX_BATCH_FILES, key="file_action_names")
+    if not selected:
+        return
+    pass_cols = st.columns(min(len(selected), 4))
+    download_passes = [
+        pass_cols[i % len(pass_cols)].text_input(
+            f'🔑 {name}',
+            placeholder="🔑 下载密码",
+            key=f"file_action_pass_{name}",
+            max_chars=4
+        )
+        for i, name in enumerate(selected)
+    ]
+    valid_passes = all(len(p) == 4 and p.isdigit() for p in download_passes)
+    items = [{"filename": name, "password": hashlib.sha256(p.encode()).hexdigest()}
+             for name, p in zip(selected, download_passes)]
+
+    cols = st.columns([1, 1, 4])
+    if cols[0].button("⬇️ 下载"):
+        if not valid_passes:
+            cols[0].error("需4位数字")
+        else:
+            try:
+                if len(items) == 1:
+                    payload = {"token": st.session_state.token, **items[0]}
+                else:
+                    payload = {"token": st.session_state.token, "items": items}
+                response = api_client().post("/download-link", json=payload)
+                if response.status_code == 200:
+                    cols[0].link_button("保存" if len(items) == 1 else "保存ZIP", response.json()['url'])
+                else:
+                    st.error(response.json().get("error"))
+            except Exception:
+                st.error("下载失败")
+
+    # 删除按钮
+    if cols[1].button("🗑️ 删除"):
+        if not valid_passes:
+            cols[1].error("需4位数字")
+        else:
+            try:
+                response = api_client().post(
+                    "/delete-batch",
+                    json={"token": st.session_state.token, "items": items}
+                )
+                if response.status_code == 200:
+                    invalidate_overview()
+                    failed = len(items) - len(response.json()['deleted'])
+                    if failed:
+                        st.error(f"{failed}个文件密码错误，未删除")
+                    else:
+                        st.rerun()
+                else:
+                    st.error("删除失败")
+            except Exception:
+                st.error("服务不可用")
+
+
+if __name__ == "__main__":
+    streamlit_ui()